@@ -1,10 +1,16 @@
 import os
+import base64
+import hashlib
 import json
+import re
+import socket
 import sys
+import threading
 import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
 import xml.etree.ElementTree as ET
-from datetime import datetime, timezone
-from typing import Any, Dict, Optional
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
 import requests
 from bson import ObjectId
 from bson.errors import InvalidId
@@ -12,9 +18,10 @@ from bson.errors import InvalidId
 from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 from dotenv import load_dotenv
-from pymongo import MongoClient
-from pymongo.errors import PyMongoError
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
 from pathlib import Path
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 # Cargar .env desde el directorio del backend
 backend_dir = Path(__file__).parent
@@ -97,8 +104,12 @@ MONGO_DB_NAME = os.getenv("MONGO_DB", "medico_mongo")
 MONGO_USER = os.getenv("MONGO_USER")
 MONGO_PASSWORD = os.getenv("MONGO_PASSWORD")
 
-_mongo_client: Optional[MongoClient] = None
-_mongo_db = None
+# Pool de conexiones (ajustable por entorno)
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "2"))
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000"))
+MONGO_HEARTBEAT_FREQUENCY_MS = int(os.getenv("MONGO_HEARTBEAT_FREQUENCY_MS", "10000"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
 
 
 def _build_mongo_uri() -> str:
@@ -113,59 +124,194 @@ def _build_mongo_uri() -> str:
     return f"mongodb://{auth_part}{MONGO_HOST}:{MONGO_PORT}/{MONGO_DB_NAME}?authSource=admin"
 
 
-def get_mongo_collection(name: str):
-    global _mongo_client, _mongo_db
-    if _mongo_client is None:
+def _is_auth_error(exc: Exception) -> bool:
+    error_str = str(exc).lower()
+    return "authentication" in error_str or "unauthorized" in error_str or "requires authentication" in error_str
+
+
+class MongoConnectionManager:
+    """
+    Mantiene un único MongoClient con pool de conexiones para todo el proceso.
+
+    - La autenticación/permisos se verifican una sola vez, al crear el cliente.
+    - La detección de caídas y la reconexión las hace el monitor de pymongo
+      (heartbeat en segundo plano), no un ping por petición.
+    - Los handles de colección se cachean: pedir una colección no toca la red.
+    """
+
+    def __init__(self, db_name: str, event_listeners: Optional[List[Any]] = None):
+        self.db_name = db_name
+        # Listeners de monitoreo de pymongo (p. ej. bench_mongo_roundtrips.py cuenta comandos)
+        self._event_listeners = list(event_listeners or [])
+        self._lock = threading.Lock()
+        self._client: Optional[MongoClient] = None
+        self._db = None
+        self._collections: Dict[str, Any] = {}
+
+    def _new_client(self, uri: str) -> MongoClient:
+        return MongoClient(
+            uri,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            heartbeatFrequencyMS=MONGO_HEARTBEAT_FREQUENCY_MS,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+            serverSelectionTimeoutMS=5000,
+            retryWrites=True,
+            retryReads=True,
+            event_listeners=self._event_listeners,
+        )
+
+    def _verify(self, client: MongoClient) -> None:
+        # listCollections exige credenciales válidas sobre la BD (ping no)
+        client[self.db_name].list_collection_names()
+
+    def _ensure_indexes(self, db) -> None:
+        for collection_name, indexes in MONGO_INDEXES.items():
+            for index in indexes:
+                options = {k: v for k, v in index.items() if k != "keys"}
+                try:
+                    db[collection_name].create_index(index["keys"], **options)
+                except Exception as e:
+                    print(f"⚠️  No se pudo crear índice {index['keys']} en {collection_name}: {e}")
+        for collection_name, names in MONGO_OBSOLETE_INDEXES.items():
+            try:
+                existing = set(db[collection_name].index_information())
+            except Exception as e:
+                print(f"⚠️  No se pudieron listar los índices de {collection_name}: {e}")
+                continue
+            for name in names:
+                if name not in existing:
+                    continue
+                try:
+                    db[collection_name].drop_index(name)
+                    print(f"🧹 Índice obsoleto {name} eliminado de {collection_name}")
+                except Exception as e:
+                    print(f"⚠️  No se pudo eliminar índice {name} en {collection_name}: {e}")
+
+    def _connect(self) -> MongoClient:
         # Intentar primero con admin (más confiable, tiene todos los permisos)
         admin_uri = f"mongodb://admin:admin123@{MONGO_HOST}:{MONGO_PORT}/{MONGO_DB_NAME}?authSource=admin"
-        print(f"🔌 Conectando a MongoDB: {MONGO_HOST}:{MONGO_PORT}/{MONGO_DB_NAME}")
+        print(f"🔌 Conectando a MongoDB: {MONGO_HOST}:{MONGO_PORT}/{MONGO_DB_NAME} "
+              f"(pool {MONGO_MIN_POOL_SIZE}-{MONGO_MAX_POOL_SIZE})")
+        client = None
         try:
             print(f"   Intentando con usuario admin...")
-            _mongo_client = MongoClient(admin_uri, serverSelectionTimeoutMS=5000)
-            # Verificar conexión y autenticación
-            _mongo_client.admin.command('ping')
+            client = self._new_client(admin_uri)
+            self._verify(client)
             print("✅ Conexión a MongoDB exitosa (con admin)")
+            return client
         except Exception as e:
             print(f"❌ Error con admin: {e}")
-            # Intentar con credenciales personalizadas si existen
-            try:
-                uri = _build_mongo_uri()
-                print(f"⚠️  Intentando con credenciales personalizadas...")
-                _mongo_client = MongoClient(uri, serverSelectionTimeoutMS=5000)
-                _mongo_client.admin.command('ping')
-                print("✅ Conexión a MongoDB exitosa (con credenciales personalizadas)")
-            except Exception as e2:
-                print(f"❌ Error con credenciales personalizadas: {e2}")
-                raise PyMongoError(f"No se pudo conectar a MongoDB: {e2}")
-    
-    # Verificar que la conexión sigue activa y autenticada
-    try:
-        _mongo_client.admin.command('ping')
-    except Exception as e:
-        print(f"⚠️  Conexión MongoDB perdida, reconectando...")
-        _mongo_client = None
-        _mongo_db = None
-        # Reintentar conexión
-        return get_mongo_collection(name)
-    
-    if _mongo_db is None:
-        _mongo_db = _mongo_client[MONGO_DB_NAME]
-    
-    # Verificar autenticación intentando acceder a la colección
+            if client is not None:
+                client.close()
+        # Intentar con credenciales personalizadas si existen
+        try:
+            print(f"⚠️  Intentando con credenciales personalizadas...")
+            client = self._new_client(_build_mongo_uri())
+            self._verify(client)
+            print("✅ Conexión a MongoDB exitosa (con credenciales personalizadas)")
+            return client
+        except Exception as e2:
+            print(f"❌ Error con credenciales personalizadas: {e2}")
+            if client is not None:
+                client.close()
+            raise PyMongoError(f"No se pudo conectar a MongoDB: {e2}")
+
+    @property
+    def db(self):
+        db = self._db
+        if db is None:
+            with self._lock:
+                db = self._db
+                if db is None:
+                    self._client = self._connect()
+                    db = self._client[self.db_name]
+                    self._ensure_indexes(db)
+                    self._db = db
+        return db
+
+    def collection(self, name: str):
+        while True:
+            db = self.db
+            with self._lock:
+                # invalidate() pudo cerrar ese cliente mientras tanto: volver a conectar en
+                # lugar de cachear (o devolver) un handle ligado al cliente cerrado
+                if self._db is not db:
+                    continue
+                collection = self._collections.get(name)
+                if collection is None:
+                    collection = db[name]
+                    self._collections[name] = collection
+                return collection
+
+    def invalidate(self) -> None:
+        """Descarta el cliente actual; la próxima petición vuelve a conectar y verificar."""
+        with self._lock:
+            client = self._client
+            self._client = None
+            self._db = None
+            self._collections = {}
+        if client is not None:
+            client.close()
+
+    def handle_error(self, exc: Exception) -> None:
+        """Si el error es de autenticación, fuerza reconexión en la siguiente petición."""
+        if _is_auth_error(exc):
+            print(f"⚠️  Error de autenticación detectado, se reconectará MongoDB: {exc}")
+            self.invalidate()
+
+
+# Caché persistente de resúmenes generados con Gemini
+SUMMARY_CACHE_COLLECTION = os.getenv("SUMMARY_CACHE_COLLECTION", "did_conversation_summaries")
+SUMMARY_CACHE_TTL_DAYS = int(os.getenv("SUMMARY_CACHE_TTL_DAYS", "30"))
+
+# Precálculo de resúmenes en segundo plano (ver SummaryPrecomputeWorker)
+SUMMARY_WORKER_ENABLED = os.getenv("SUMMARY_WORKER_ENABLED", "true").lower() == "true"
+SUMMARY_WORKER_THREADS = int(os.getenv("SUMMARY_WORKER_THREADS", "2"))
+SUMMARY_POLL_SECONDS = int(os.getenv("SUMMARY_POLL_SECONDS", "30"))
+SUMMARY_IDLE_SECONDS = int(os.getenv("SUMMARY_IDLE_SECONDS", "120"))
+SUMMARY_LOOKBACK_HOURS = int(os.getenv("SUMMARY_LOOKBACK_HOURS", "24"))
+SUMMARY_WORKER_BATCH = int(os.getenv("SUMMARY_WORKER_BATCH", "200"))
+# Con varios procesos (gunicorn, réplicas) solo sondea el que tiene el lease en MongoDB
+SUMMARY_LEASE_COLLECTION = os.getenv("SUMMARY_LEASE_COLLECTION", "did_summary_worker_lease")
+# Tiempo máximo que una petición espera un resumen que el worker ya está generando
+SUMMARY_WAIT_SECONDS = float(os.getenv("SUMMARY_WAIT_SECONDS", "30"))
+# Tras un fallo del worker (Gemini, JSON inválido), stale=ok no vuelve a encolar esa clave
+# durante este tiempo
+SUMMARY_FAILURE_COOLDOWN_SECONDS = int(os.getenv("SUMMARY_FAILURE_COOLDOWN_SECONDS", "300"))
+
+# Índices que el backend asegura al conectar (idempotente; ver database/scripts/init/init-mongo.js)
+MONGO_INDEXES: Dict[str, List[Dict[str, Any]]] = {
+    "did_conversations": [
+        {"keys": [("agentId", 1), ("chatId", 1)], "unique": True},
+        # _id como desempate para la paginación por cursor (updatedAt, _id)
+        {"keys": [("userId", 1), ("updatedAt", -1), ("_id", -1)]},
+        {"keys": [("patientId", 1), ("updatedAt", -1), ("_id", -1)]},
+        # Sondeo del worker de resúmenes (conversaciones inactivas recientes)
+        {"keys": [("updatedAt", -1)]},
+    ],
+    SUMMARY_CACHE_COLLECTION: [
+        # Las entradas que no se regeneran en SUMMARY_CACHE_TTL_DAYS se eliminan solas
+        {"keys": [("updatedAt", 1)], "expireAfterSeconds": SUMMARY_CACHE_TTL_DAYS * 86400},
+    ],
+}
+
+# Índices reemplazados por otros; se eliminan al conectar para no mantenerlos en cada escritura
+MONGO_OBSOLETE_INDEXES: Dict[str, List[str]] = {
+    # Sustituidos por las versiones con _id como desempate
+    "did_conversations": ["userId_1_updatedAt_-1", "patientId_1_updatedAt_-1"],
+}
+
+mongo_manager = MongoConnectionManager(MONGO_DB_NAME)
+
+
+def get_mongo_collection(name: str):
     try:
-        collection = _mongo_db[name]
-        # Hacer una operación de prueba para verificar permisos
-        collection.find_one({}, limit=1)
-        return collection
+        return mongo_manager.collection(name)
+    except PyMongoError:
+        raise
     except Exception as e:
-        error_str = str(e).lower()
-        print(f"❌ Error accediendo a colección {name}: {e}")
-        # Si falla por autenticación, intentar reconectar con admin
-        if "authentication" in error_str or "unauthorized" in error_str or "requires authentication" in error_str:
-            print(f"⚠️  Error de autenticación detectado, reconectando con admin...")
-            _mongo_client = None
-            _mongo_db = None
-            return get_mongo_collection(name)  # Reintentar
         raise PyMongoError(f"Error accediendo a colección {name}: {e}")
 
 
@@ -183,6 +329,135 @@ def _safe_int(value: Any):
     except (ValueError, TypeError):
         return None
 
+
+# ===== Paginación por cursor (keyset) =====
+CONVERSATION_SORT = [("updatedAt", -1), ("_id", -1)]
+
+
+def _encode_cursor(doc: Dict[str, Any]) -> str:
+    """
+    Codifica (updatedAt, _id) del último documento de la página como token opaco.
+
+    "t" guarda el tipo BSON de updatedAt ("d" fecha, "s" texto heredado, null si falta),
+    porque MongoDB ordena por tipo antes que por valor: en orden descendente van primero
+    las fechas, luego los textos y al final los documentos sin updatedAt.
+    """
+    updated_at = doc.get("updatedAt")
+    if isinstance(updated_at, datetime):
+        kind, value = "d", updated_at.isoformat()
+    elif isinstance(updated_at, str):
+        kind, value = "s", updated_at
+    else:
+        kind, value = None, None
+    payload = {"t": kind, "u": value, "i": str(doc["_id"])}
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(token: str) -> Dict[str, Any]:
+    """
+    Convierte un token de _encode_cursor en el filtro keyset para la siguiente página.
+
+    Raises:
+        ValueError: si el token no es válido
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        last_id = ObjectId(payload["i"])
+        # Cursores sin "t" (anteriores a este formato) solo podían llevar fechas
+        kind = payload.get("t", "d" if payload.get("u") else None)
+        if kind == "d":
+            updated_at = datetime.fromisoformat(payload["u"])
+        elif kind == "s":
+            updated_at = str(payload["u"])
+        elif kind is None:
+            updated_at = None
+        else:
+            raise ValueError(f"tipo desconocido {kind!r}")
+    except Exception as e:
+        raise ValueError(f"Cursor inválido: {e}")
+
+    if kind is None:
+        # Las conversaciones sin updatedAt van al final del orden descendente
+        return {"updatedAt": None, "_id": {"$lt": last_id}}
+    # $lt solo compara valores del mismo tipo, así que los tipos que van después en el
+    # orden descendente se incluyen aparte
+    later_types: List[Dict[str, Any]] = [{"updatedAt": None}]
+    if kind == "d":
+        later_types.insert(0, {"updatedAt": {"$type": "string"}})
+    return {
+        "$or": [
+            {"updatedAt": {"$lt": updated_at}},
+            {"updatedAt": updated_at, "_id": {"$lt": last_id}},
+            *later_types,
+        ]
+    }
+
+
+def _with_cursor(query: Dict[str, Any], cursor_token: Optional[str]) -> Dict[str, Any]:
+    if not cursor_token:
+        return query
+    keyset = _decode_cursor(cursor_token)
+    return {"$and": [query, keyset]} if query else keyset
+
+
+# ===== Zonas horarias para agrupar conversaciones por día =====
+CONVERSATION_TIMEZONE = os.getenv("CONVERSATION_TIMEZONE", "UTC")
+_UTC_OFFSET_RE = re.compile(r"([+-])(\d{2})(?::?(\d{2}))?")
+
+
+def _resolve_timezone(name: str):
+    """
+    Convierte un nombre de zona (Olson, p.ej. America/Mexico_City) o un offset
+    (+HH:MM, +HHMM o +HH, también con -) en tzinfo. Acepta lo mismo que $dateToString de MongoDB.
+
+    Raises:
+        ValueError: si la zona no es válida
+    """
+    if not name or name.upper() in ("UTC", "Z", "GMT"):
+        return timezone.utc
+    if name[0] in "+-":
+        # MongoDB solo acepta [+-]HH:MM, [+-]HHMM o [+-]HH; "+5" o "+5:3" los rechaza
+        match = _UTC_OFFSET_RE.fullmatch(name)
+        if not match:
+            raise ValueError(f"Zona horaria inválida: {name}")
+        sign, hours, minutes = match.groups()
+        if int(hours) > 23 or int(minutes or 0) > 59:
+            raise ValueError(f"Zona horaria inválida: {name}")
+        offset = timedelta(hours=int(hours), minutes=int(minutes or 0))
+        return timezone(offset if sign == "+" else -offset)
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Zona horaria inválida: {name}")
+
+
+def _day_range(date_str: str, tz_name: str):
+    """
+    Rango [inicio, fin) en UTC (naive, como lo guarda pymongo) del día local date_str.
+
+    Raises:
+        ValueError: si la fecha o la zona no son válidas
+    """
+    try:
+        day = datetime.strptime(date_str, "%Y-%m-%d")
+    except ValueError:
+        raise ValueError("Formato de fecha inválido. Use YYYY-MM-DD")
+    tz = _resolve_timezone(tz_name)
+    start = day.replace(tzinfo=tz)
+    end = (day + timedelta(days=1)).replace(tzinfo=tz)
+    return (start.astimezone(timezone.utc).replace(tzinfo=None),
+            end.astimezone(timezone.utc).replace(tzinfo=None))
+
+
+def _split_page(docs: List[Dict[str, Any]], limit: int):
+    """Recibe limit + 1 documentos y retorna (página, nextCursor)."""
+    if len(docs) > limit:
+        page = docs[:limit]
+        return page, _encode_cursor(page[-1])
+    return docs, None
+
 # ===== Gemini =====
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_GEMINI_API_KEY")
 
@@ -540,34 +815,38 @@ def health():
         return jsonify({"status": "degraded", "mongodb": "disconnected", "error": str(e)}), 200
 
 # ===== D-ID Conversations =====
-@app.post("/api/did/conversations")
-def save_did_conversation():
+def _build_did_message_upsert(data: Dict[str, Any]):
     """
-    Guarda un mensaje en la conversación D-ID.
+    Valida un mensaje D-ID y construye el filtro/update para un upsert atómico.
     Agrupa mensajes por agentId/chatId (mapeados desde agentSessionId/agentConversationId).
-    Compatible con el formato del conversation-service.js
+
+    Returns:
+        (filtro, update, id_nuevo). id_nuevo es el _id que tendrá la conversación si el
+        upsert la crea, lo que permite distinguir creación de actualización sin otra consulta.
+
+    Raises:
+        ValueError: si el mensaje no es válido (mensaje listo para el cliente)
     """
-    data: Dict[str, Any] = request.get_json(silent=True) or {}
     role = data.get("role")
     if role not in {"user", "agent"}:
-        return jsonify({"error": "El campo 'role' es obligatorio y debe ser 'user' o 'agent'."}), 400
+        raise ValueError("El campo 'role' es obligatorio y debe ser 'user' o 'agent'.")
 
     text = (data.get("text") or "").strip()
     audio_url = data.get("audioUrl")
     if not text and not audio_url:
-        return jsonify({"error": "Debe incluir 'text' o 'audioUrl'."}), 400
+        raise ValueError("Debe incluir 'text' o 'audioUrl'.")
 
     # Mapear agentSessionId/agentConversationId a agentId/chatId para compatibilidad
     agent_id = data.get("agentId") or data.get("agentSessionId") or data.get("agent_session_id")
     chat_id = data.get("chatId") or data.get("agentConversationId") or data.get("agent_conversation_id")
-    
+
     if not agent_id or not chat_id:
-        return jsonify({"error": "agentId/chatId o agentSessionId/agentConversationId requeridos"}), 400
-    
+        raise ValueError("agentId/chatId o agentSessionId/agentConversationId requeridos")
+
     patient_id = _safe_int(data.get("patientId"))
     # Aceptar tanto "usuarioId" como "userId" para compatibilidad
     usuario_id = _safe_int(data.get("usuarioId")) or _safe_int(data.get("userId"))
-    
+
     # Timestamp del mensaje
     timestamp_str = data.get("startedAt") or data.get("finishedAt") or data.get("timestamp")
     if timestamp_str:
@@ -577,7 +856,65 @@ def save_did_conversation():
             timestamp = datetime.now(timezone.utc)
     else:
         timestamp = datetime.utcnow()
-    
+
+    message = {
+        "role": role,
+        "content": text,
+        "timestamp": timestamp,
+    }
+    if audio_url:
+        message["audio"] = audio_url
+
+    now = datetime.now(timezone.utc)
+    new_id = ObjectId()
+    set_on_insert: Dict[str, Any] = {
+        "_id": new_id,
+        "createdAt": now,
+        # Campos adicionales para compatibilidad
+        "agent_session_id": data.get("agentSessionId"),
+        "agent_conversation_id": data.get("agentConversationId"),
+        "session_uuid": data.get("sessionUuid"),
+        "agent_url": data.get("agentUrl"),
+        "agent_origin": data.get("agentOrigin"),
+        "consulta_id": _safe_int(data.get("consultaId")),
+        "metadata": data.get("metadata") or {},
+    }
+    set_fields: Dict[str, Any] = {"updatedAt": now}
+    # Siempre actualizar patientId y userId si se proporcionan, incluso si ya existen;
+    # si no se proporcionan, solo se inicializan a null al crear la conversación
+    if patient_id is not None:
+        set_fields["patientId"] = patient_id
+    else:
+        set_on_insert["patientId"] = None
+    if usuario_id is not None:
+        set_fields["userId"] = usuario_id
+    else:
+        set_on_insert["userId"] = None
+
+    update = {
+        "$setOnInsert": set_on_insert,
+        "$push": {"messages": message},
+        "$set": set_fields,
+    }
+    return {"agentId": agent_id, "chatId": chat_id}, update, new_id
+
+
+@app.post("/api/did/conversations")
+def save_did_conversation():
+    """
+    Guarda un mensaje en la conversación D-ID.
+    Agrupa mensajes por agentId/chatId (mapeados desde agentSessionId/agentConversationId).
+    Compatible con el formato del conversation-service.js
+
+    Un único find_one_and_update con upsert crea la conversación o agrega el mensaje
+    en un solo round trip, sin carreras entre mensajes concurrentes del mismo chat.
+    """
+    data: Dict[str, Any] = request.get_json(silent=True) or {}
+    try:
+        query, update, new_id = _build_did_message_upsert(data)
+    except ValueError as validation_error:
+        return jsonify({"error": str(validation_error)}), 400
+
     try:
         # Intentar obtener la colección con mejor manejo de errores
         try:
@@ -585,102 +922,173 @@ def save_did_conversation():
         except Exception as mongo_error:
             print(f"❌ Error obteniendo colección MongoDB: {mongo_error}")
             return jsonify({"error": f"MongoDB no disponible: {str(mongo_error)}"}), 503
-        
+
         # Log para depuración
-        print(f"💾 Guardando mensaje D-ID: role={role}, agentId={agent_id}, chatId={chat_id}, userId={usuario_id}, patientId={patient_id}, text={text[:50]}...")
-        
-        # Buscar o crear la conversación
+        message = update["$push"]["messages"]
+        print(f"💾 Guardando mensaje D-ID: role={message['role']}, agentId={query['agentId']}, chatId={query['chatId']}, "
+              f"userId={update['$set'].get('userId')}, patientId={update['$set'].get('patientId')}, text={message['content'][:50]}...")
+
         try:
-            conversation = collection.find_one({
-                "agentId": agent_id,
-                "chatId": chat_id
-            })
-        except Exception as find_error:
-            print(f"❌ Error buscando conversación en MongoDB: {find_error}")
-            return jsonify({"error": f"Error consultando MongoDB: {str(find_error)}"}), 503
-        
-        # Crear el mensaje
-        message = {
-            "role": role,
-            "content": text,
-            "timestamp": timestamp,
-        }
-        if audio_url:
-            message["audio"] = audio_url
-        
-        if not conversation:
-            # Crear nueva conversación
-            conversation_doc = {
-                "agentId": agent_id,
-                "chatId": chat_id,
-                "userId": usuario_id,
-                "patientId": patient_id,
-                "messages": [message],
-                "createdAt": datetime.now(timezone.utc),
-                "updatedAt": datetime.now(timezone.utc),
-                # Campos adicionales para compatibilidad
-                "agent_session_id": data.get("agentSessionId"),
-                "agent_conversation_id": data.get("agentConversationId"),
-                "session_uuid": data.get("sessionUuid"),
-                "agent_url": data.get("agentUrl"),
-                "agent_origin": data.get("agentOrigin"),
-                "consulta_id": _safe_int(data.get("consultaId")),
-                "metadata": data.get("metadata") or {}
-            }
-            try:
-                result = collection.insert_one(conversation_doc)
-                return jsonify({"id": str(result.inserted_id), "conversationId": str(result.inserted_id)}), 201
-            except Exception as insert_error:
-                print(f"❌ Error insertando conversación en MongoDB: {insert_error}")
-                import traceback
-                traceback.print_exc()
-                return jsonify({"error": f"Error guardando en MongoDB: {str(insert_error)}"}), 503
-        else:
-            # Agregar mensaje a conversación existente
             try:
-                # Siempre actualizar patientId y userId si se proporcionan, incluso si ya existen
-                update_data = {
-                    "$push": {"messages": message},
-                    "$set": {
-                        "updatedAt": datetime.now(timezone.utc)
-                    }
-                }
-                # Actualizar patientId si se proporciona (incluso si ya existe uno)
-                if patient_id is not None:
-                    update_data["$set"]["patientId"] = patient_id
-                # Actualizar userId si se proporciona (incluso si ya existe uno)
-                if usuario_id is not None:
-                    update_data["$set"]["userId"] = usuario_id
-                
-                collection.update_one(
-                    {"_id": conversation["_id"]},
-                    update_data
+                conversation = collection.find_one_and_update(
+                    query, update, upsert=True,
+                    projection={"_id": 1}, return_document=ReturnDocument.AFTER
                 )
-                return jsonify({"id": str(conversation["_id"]), "conversationId": str(conversation["_id"])}), 200
-            except Exception as update_error:
-                print(f"❌ Error actualizando conversación en MongoDB: {update_error}")
-                import traceback
-                traceback.print_exc()
-                return jsonify({"error": f"Error actualizando MongoDB: {str(update_error)}"}), 503
-            
+            except DuplicateKeyError:
+                # Dos upserts simultáneos del mismo chat: el otro ya creó el documento,
+                # reintentar convierte este en un $push normal
+                conversation = collection.find_one_and_update(
+                    query, update, upsert=True,
+                    projection={"_id": 1}, return_document=ReturnDocument.AFTER
+                )
+        except Exception as upsert_error:
+            print(f"❌ Error guardando conversación en MongoDB: {upsert_error}")
+            traceback.print_exc()
+            return jsonify({"error": f"Error guardando en MongoDB: {str(upsert_error)}"}), 503
+
+        conversation_id = str(conversation["_id"])
+        created = conversation["_id"] == new_id
+        return jsonify({"id": conversation_id, "conversationId": conversation_id}), 201 if created else 200
+
     except PyMongoError as exc:
+        mongo_manager.handle_error(exc)
         print(f"❌ PyMongoError: {exc}")
-        import traceback
         traceback.print_exc()
         return jsonify({"error": f"MongoDB no disponible: {exc}"}), 503
     except Exception as exc:
         print(f"❌ Error inesperado: {exc}")
-        import traceback
         traceback.print_exc()
         return jsonify({"error": f"Error interno del servidor: {exc}"}), 500
 
 
+MAX_DID_BATCH_SIZE = int(os.getenv("MAX_DID_BATCH_SIZE", "500"))
+
+
+@app.post("/api/did/conversations/batch")
+def save_did_conversation_batch():
+    """
+    Guarda muchos mensajes D-ID (de uno o varios agentId/chatId) en una sola petición.
+    Acepta {"messages": [...]} o directamente una lista; cada mensaje tiene el mismo
+    formato que POST /api/did/conversations.
+
+    Todos los mensajes válidos se aplican con un único bulk_write de upserts ordenados,
+    así el orden de los mensajes dentro de cada chat se respeta.
+    Retorna un resultado por mensaje, en el mismo orden de entrada.
+    """
+    body = request.get_json(silent=True)
+    messages = body.get("messages") if isinstance(body, dict) else body
+    if not isinstance(messages, list) or not messages:
+        return jsonify({"error": "Se requiere una lista no vacía en 'messages'."}), 400
+    if len(messages) > MAX_DID_BATCH_SIZE:
+        return jsonify({"error": f"Máximo {MAX_DID_BATCH_SIZE} mensajes por lote."}), 413
+
+    results: List[Dict[str, Any]] = []
+    operations = []
+    op_positions: List[int] = []  # índice de operación -> posición en results
+    op_keys: List[tuple] = []
+    for position, item in enumerate(messages):
+        if not isinstance(item, dict):
+            results.append({"index": position, "status": "error", "error": "Cada mensaje debe ser un objeto JSON."})
+            continue
+        try:
+            query, update, _ = _build_did_message_upsert(item)
+        except ValueError as validation_error:
+            results.append({"index": position, "status": "error", "error": str(validation_error)})
+            continue
+        results.append({"index": position, "status": "pending"})
+        operations.append(UpdateOne(query, update, upsert=True))
+        op_positions.append(position)
+        op_keys.append((query["agentId"], query["chatId"]))
+
+    if not operations:
+        return jsonify({"results": results, "applied": 0, "failed": len(results)}), 400
+
+    try:
+        collection = get_mongo_collection("did_conversations")
+    except PyMongoError as exc:
+        return jsonify({"error": f"MongoDB no disponible: {exc}"}), 503
+
+    upserted_ids: Dict[int, Any] = {}
+    applied_ops = len(operations)
+    try:
+        bulk_result = collection.bulk_write(operations, ordered=True)
+        upserted_ids = bulk_result.upserted_ids or {}
+    except BulkWriteError as bwe:
+        # En modo ordenado Mongo se detiene en el primer error: lo anterior ya está aplicado
+        details = bwe.details or {}
+        upserted_ids = {u["index"]: u["_id"] for u in details.get("upserted", [])}
+        write_errors = details.get("writeErrors", [])
+        applied_ops = write_errors[0]["index"] if write_errors else 0
+        for write_error in write_errors:
+            results[op_positions[write_error["index"]]].update(
+                status="error", error=write_error.get("errmsg", "Error de escritura")
+            )
+        for op_index in range(applied_ops, len(operations)):
+            if results[op_positions[op_index]]["status"] == "pending":
+                results[op_positions[op_index]].update(status="skipped", error="No aplicado por un error previo en el lote")
+    except PyMongoError as exc:
+        mongo_manager.handle_error(exc)
+        print(f"❌ Error en bulk_write de conversaciones: {exc}")
+        return jsonify({"error": f"MongoDB no disponible: {exc}"}), 503
+
+    # Los ids de conversaciones que ya existían se resuelven con una sola consulta
+    existing_keys = {op_keys[i] for i in range(applied_ops) if i not in upserted_ids}
+    conversation_ids: Dict[tuple, str] = {op_keys[i]: str(_id) for i, _id in upserted_ids.items()}
+    existing_keys -= set(conversation_ids)
+    if existing_keys:
+        try:
+            cursor = collection.find(
+                {"$or": [{"agentId": agent_id, "chatId": chat_id} for agent_id, chat_id in existing_keys]},
+                {"agentId": 1, "chatId": 1},
+            )
+            for doc in cursor:
+                conversation_ids[(doc["agentId"], doc["chatId"])] = str(doc["_id"])
+        except PyMongoError as exc:
+            print(f"⚠️ No se pudieron resolver ids de conversaciones: {exc}")
+
+    for op_index in range(applied_ops):
+        result = results[op_positions[op_index]]
+        if result["status"] != "pending":
+            continue
+        conversation_id = conversation_ids.get(op_keys[op_index])
+        result.update(
+            status="created" if op_index in upserted_ids else "updated",
+            id=conversation_id,
+            conversationId=conversation_id,
+        )
+
+    applied = sum(1 for r in results if r["status"] in ("created", "updated"))
+    status_code = 200 if applied == len(results) else 207
+    print(f"💾 Lote D-ID: {applied}/{len(results)} mensajes guardados en {len(set(op_keys))} conversaciones")
+    return jsonify({"results": results, "applied": applied, "failed": len(results) - applied}), status_code
+
+
+def _conversation_summary_stages() -> List[Dict[str, Any]]:
+    """
+    Etapas de agregación que reemplazan el array messages por messageCount y lastMessage,
+    para que el transcript completo nunca salga de MongoDB.
+    """
+    return [
+        {"$addFields": {
+            "messageCount": {"$size": {"$ifNull": ["$messages", []]}},
+            "lastMessage": {"$arrayElemAt": [{"$slice": [{"$ifNull": ["$messages", []]}, -1]}, 0]},
+        }},
+        {"$project": {"messages": 0}},
+    ]
+
+
 @app.get("/api/did/conversations")
 def list_did_conversations():
     """
     Lista conversaciones D-ID.
     Soporta filtrado por patientId, userId, agentId, chatId.
     Compatible con el formato del conversation-service.js
+
+    Por defecto cada item trae metadatos, messageCount y lastMessage (sin el array messages).
+    Usar include=messages para recibir el transcript completo.
+
+    Paginación: la respuesta incluye nextCursor; enviarlo como ?cursor=... para la
+    siguiente página (null cuando no hay más).
     """
     try:
         collection = get_mongo_collection("did_conversations")
@@ -743,15 +1151,32 @@ def list_did_conversations():
                 condition["session_uuid"] = session_uuid
         else:
             query["session_uuid"] = session_uuid
+
+    try:
+        query = _with_cursor(query, request.args.get("cursor"))
+    except ValueError as cursor_error:
+        return jsonify({"error": str(cursor_error)}), 400
     
 
+    # Por defecto solo se envían metadatos + último mensaje; include=messages trae el transcript completo
+    include = {part.strip() for part in (request.args.get("include") or "").split(",")}
+    include_messages = "messages" in include
+
     items = []
     try:
         # Ordenar por updatedAt (nuevo formato) o created_at (formato antiguo)
-        cursor = collection.find(query).sort("updatedAt", -1).limit(limit)
-        count = 0
-        for doc in cursor:
-            count += 1
+        # Se pide un documento extra para saber si hay página siguiente
+        if include_messages:
+            cursor = collection.find(query).sort(CONVERSATION_SORT).limit(limit + 1)
+        else:
+            cursor = collection.aggregate([
+                {"$match": query},
+                {"$sort": dict(CONVERSATION_SORT)},
+                {"$limit": limit + 1},
+                *_conversation_summary_stages(),
+            ])
+        docs, next_cursor = _split_page(list(cursor), limit)
+        for doc in docs:
             doc["id"] = str(doc.pop("_id"))
             # Normalizar formato de respuesta
             if "messages" in doc:
@@ -760,10 +1185,11 @@ def list_did_conversations():
                     doc["lastMessage"] = doc["messages"][-1]
             items.append(doc)
     except PyMongoError as exc:
+        mongo_manager.handle_error(exc)
         print(f"❌ Error en MongoDB: {exc}")
         return jsonify({"error": f"MongoDB no disponible: {exc}"}), 503
 
-    return jsonify({"items": items, "count": len(items), "conversations": items})
+    return jsonify({"items": items, "count": len(items), "conversations": items, "nextCursor": next_cursor})
 
 
 @app.get("/api/did/conversations/by-date")
@@ -771,6 +1197,13 @@ def get_conversations_by_date():
     """
     Obtiene las conversaciones agrupadas por día para un paciente.
     Retorna un objeto con fechas como keys y arrays de conversaciones como valores.
+    Paginado por cursor (limit, por defecto 200; nextCursor -> ?cursor=...).
+
+    La agrupación se hace en MongoDB ($dateToString en la zona horaria tz, por defecto
+    CONVERSATION_TIMEZONE): solo viajan conteos por día y stubs ligeros de cada
+    conversación. day=YYYY-MM-DD expande un único día e incluye lastMessage.
+    counts_by_date cuenta las conversaciones de la página; totals_by_date, las de todas
+    las páginas (una agregación aparte, sin cursor, que solo devuelve conteos).
     """
     try:
         collection = get_mongo_collection("did_conversations")
@@ -799,53 +1232,115 @@ def get_conversations_by_date():
             query["userId"] = user_id
 
     try:
-        # Obtener todas las conversaciones del paciente
-        conversations = list(collection.find(query).sort("updatedAt", -1))
-        
-        # Agrupar por día (solo fecha, sin hora)
+        limit = max(1, min(int(request.args.get("limit", 200)), 500))
+    except ValueError:
+        limit = 200
+
+    tz_name = (request.args.get("tz") or CONVERSATION_TIMEZONE).strip()
+    try:
+        _resolve_timezone(tz_name)
+    except ValueError as tz_error:
+        return jsonify({"error": str(tz_error)}), 400
+
+    # day=YYYY-MM-DD expande un solo día (con lastMessage); el rango se empuja a la consulta
+    expand_day = request.args.get("day")
+    if expand_day:
+        try:
+            day_start, day_end = _day_range(expand_day, tz_name)
+        except ValueError as day_error:
+            return jsonify({"error": str(day_error)}), 400
+        query = {"$and": [query, {"updatedAt": {"$gte": day_start, "$lt": day_end}}]}
+
+    # Consulta sin cursor: los totales por día cubren todas las páginas
+    base_query = query
+    try:
+        query = _with_cursor(query, request.args.get("cursor"))
+    except ValueError as cursor_error:
+        return jsonify({"error": str(cursor_error)}), 400
+
+    day_expr = {"$dateToString": {
+        "format": "%Y-%m-%d",
+        # $convert tolera timestamps legacy guardados como string
+        "date": {"$convert": {
+            "input": {"$ifNull": ["$updatedAt", "$createdAt"]},
+            "to": "date", "onError": None, "onNull": None,
+        }},
+        "timezone": tz_name,
+        "onNull": None,
+    }}
+
+    stub: Dict[str, Any] = {
+        "id": {"$toString": "$_id"},
+        "agentId": "$agentId",
+        "chatId": "$chatId",
+        "patientId": "$patientId",
+        "userId": "$userId",
+        "createdAt": "$createdAt",
+        "updatedAt": "$updatedAt",
+        "messageCount": {"$size": {"$ifNull": ["$messages", []]}},
+    }
+    if expand_day:
+        stub["lastMessage"] = {"$arrayElemAt": [{"$slice": [{"$ifNull": ["$messages", []]}, -1]}, 0]}
+
+    pipeline = [
+        {"$match": query},
+        {"$sort": dict(CONVERSATION_SORT)},
+        # limit + 1 para detectar si hay página siguiente
+        {"$limit": limit + 1},
+        {"$facet": {
+            "days": [
+                {"$limit": limit},
+                {"$addFields": {"_day": day_expr}},
+                {"$match": {"_day": {"$ne": None}}},
+                {"$group": {"_id": "$_day", "count": {"$sum": 1}, "conversations": {"$push": stub}}},
+                {"$sort": {"_id": -1}},
+            ],
+            "tail": [
+                {"$skip": limit - 1},
+                {"$project": {"updatedAt": 1}},
+            ],
+        }},
+    ]
+    # Solo conteos (sin documentos): totales por día de toda la consulta, no de la página
+    totals_pipeline = [
+        {"$match": base_query},
+        {"$group": {"_id": day_expr, "count": {"$sum": 1}}},
+        {"$match": {"_id": {"$ne": None}}},
+        {"$sort": {"_id": -1}},
+    ]
+
+    try:
+        facet = next(collection.aggregate(pipeline), {"days": [], "tail": []})
+        totals_by_date = {bucket["_id"]: bucket["count"] for bucket in collection.aggregate(totals_pipeline)}
+        tail = facet.get("tail", [])
+        next_cursor = _encode_cursor(tail[0]) if len(tail) > 1 else None
+
         conversations_by_date: Dict[str, List[Dict]] = {}
-        
-        for conv in conversations:
-            # Obtener fecha del último mensaje o de updatedAt
-            updated_at = conv.get("updatedAt") or conv.get("createdAt")
-            if not updated_at:
-                continue
-                
-            # Convertir a datetime si es string
-            if isinstance(updated_at, str):
-                try:
-                    updated_at = datetime.fromisoformat(updated_at.replace('Z', '+00:00'))
-                except:
-                    continue
-            
-            # Obtener solo la fecha (YYYY-MM-DD)
-            date_key = updated_at.strftime("%Y-%m-%d")
-            
-            # Normalizar el documento
-            conv_id = str(conv.pop("_id"))
-            conv["id"] = conv_id
-            conv["messageCount"] = len(conv.get("messages", []))
-            if conv.get("messages"):
-                conv["lastMessage"] = conv["messages"][-1]
-            
-            if date_key not in conversations_by_date:
-                conversations_by_date[date_key] = []
-            conversations_by_date[date_key].append(conv)
-        
-        # Ordenar fechas de más reciente a más antigua
-        sorted_dates = sorted(conversations_by_date.keys(), reverse=True)
-        
+        counts_by_date: Dict[str, int] = {}
+        for bucket in facet.get("days", []):
+            conversations_by_date[bucket["_id"]] = bucket["conversations"]
+            counts_by_date[bucket["_id"]] = bucket["count"]
+
+        # Los buckets ya vienen ordenados de más reciente a más antiguo
+        sorted_dates = list(conversations_by_date.keys())
+
         # Formatear respuesta
         result = {
             "dates": sorted_dates,
             "conversations_by_date": conversations_by_date,
+            # counts_by_date y total_* son de esta página; totals_by_date, de todas
+            "counts_by_date": counts_by_date,
             "total_days": len(sorted_dates),
-            "total_conversations": len(conversations)
+            "total_conversations": sum(counts_by_date.values()),
+            "totals_by_date": totals_by_date,
+            "timezone": tz_name,
+            "nextCursor": next_cursor
         }
-        
+
         return jsonify(result), 200
-        
+
     except PyMongoError as exc:
+        mongo_manager.handle_error(exc)
         print(f"❌ Error en MongoDB: {exc}")
         return jsonify({"error": f"MongoDB no disponible: {exc}"}), 503
     except Exception as e:
@@ -854,32 +1349,291 @@ def get_conversations_by_date():
         return jsonify({"error": f"Error interno: {str(e)}"}), 500
 
 
-@app.get("/api/did/conversations/daily-summary")
-def get_daily_summary():
+# ===== Caché de resúmenes =====
+# Cambiar al modificar los prompts de resumen para invalidar las entradas anteriores
+SUMMARY_PROMPT_VERSION = "1"
+
+
+def _summary_content_hash(messages: List[Dict[str, Any]]) -> str:
+    """Hash estable del contenido de los mensajes; cambia en cuanto se agrega un mensaje."""
+    digest = hashlib.sha256(SUMMARY_PROMPT_VERSION.encode("utf-8"))
+    for msg in messages:
+        timestamp = msg.get("timestamp")
+        digest.update(json.dumps(
+            [str(msg.get("conversation_id", "")), msg.get("role"), msg.get("content"),
+             timestamp.isoformat() if isinstance(timestamp, datetime) else timestamp],
+            ensure_ascii=False, default=str,
+        ).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _summary_cache_get(cache_key: str, content_hash: Optional[str] = None) -> Optional[Dict[str, Any]]:
     """
-    Genera un resumen diario de todas las conversaciones de un paciente en una fecha específica.
-    Usa Gemini para generar el resumen.
+    Retorna el resumen cacheado de cache_key. Con content_hash, solo si corresponde
+    exactamente al contenido actual; sin él, la última entrada (para resumen incremental).
     """
+    query: Dict[str, Any] = {"_id": cache_key}
+    if content_hash is not None:
+        query["contentHash"] = content_hash
     try:
-        collection = get_mongo_collection("did_conversations")
-    except PyMongoError as exc:
-        return jsonify({"error": f"MongoDB no disponible: {exc}"}), 503
+        return get_mongo_collection(SUMMARY_CACHE_COLLECTION).find_one(
+            query,
+            {"summary": 1, "highlights": 1, "updatedAt": 1, "contentHash": 1, "messageCount": 1,
+             "lastFailureAt": 1},
+        )
+    except PyMongoError as e:
+        print(f"⚠️ [SUMMARY_CACHE] Error leyendo caché {cache_key}: {e}")
+        return None
 
-    patient_id = _safe_int(request.args.get("patientId"))
-    user_id = _safe_int(request.args.get("userId"))
-    date_str = request.args.get("date")  # Formato: YYYY-MM-DD
-    
-    if not patient_id and not user_id:
-        return jsonify({"error": "Se requiere patientId o userId"}), 400
-    
-    if not date_str:
-        return jsonify({"error": "Se requiere el parámetro 'date' (formato: YYYY-MM-DD)"}), 400
 
-    # Validar formato de fecha
+def _summary_cache_put(cache_key: str, content_hash: str, result: Dict[str, Any], **fields) -> None:
+    """Guarda (o reemplaza) el resumen de cache_key; el hash anterior queda invalidado."""
     try:
-        target_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-    except ValueError:
-        return jsonify({"error": "Formato de fecha inválido. Use YYYY-MM-DD"}), 400
+        get_mongo_collection(SUMMARY_CACHE_COLLECTION).update_one(
+            {"_id": cache_key},
+            {"$set": {
+                "contentHash": content_hash,
+                "summary": result.get("summary"),
+                "highlights": result.get("highlights", []),
+                "updatedAt": datetime.now(timezone.utc),
+                **fields,
+            }, "$unset": {"lastFailureAt": "", "lastError": ""}},
+            upsert=True,
+        )
+    except PyMongoError as e:
+        print(f"⚠️ [SUMMARY_CACHE] Error guardando caché {cache_key}: {e}")
+
+
+def _summary_cache_mark_failure(cache_key: str, error: Exception) -> None:
+    """Registra que la última regeneración de cache_key falló (sin tocar el resumen anterior)."""
+    now = datetime.now(timezone.utc)
+    try:
+        get_mongo_collection(SUMMARY_CACHE_COLLECTION).update_one(
+            {"_id": cache_key},
+            # updatedAt en inserción: el índice TTL también limpia claves que nunca tuvieron resumen
+            {"$set": {"lastFailureAt": now, "lastError": str(error)[:500]},
+             "$setOnInsert": {"updatedAt": now}},
+            upsert=True,
+        )
+    except PyMongoError as e:
+        print(f"⚠️ [SUMMARY_CACHE] Error registrando fallo de {cache_key}: {e}")
+
+
+def _failure_retry_after(cached: Optional[Dict[str, Any]]) -> int:
+    """Segundos que faltan para volver a intentar una clave que falló (0 si se puede ya)."""
+    failed_at = cached.get("lastFailureAt") if cached else None
+    if not isinstance(failed_at, datetime):
+        return 0
+    if failed_at.tzinfo is None:
+        failed_at = failed_at.replace(tzinfo=timezone.utc)
+    elapsed = (datetime.now(timezone.utc) - failed_at).total_seconds()
+    return max(0, int(SUMMARY_FAILURE_COOLDOWN_SECONDS - elapsed))
+
+
+def _daily_summary_cache_key(patient_id: Optional[int], user_id: Optional[int], date_str: str, tz_name: str) -> str:
+    return f"daily:{patient_id or ''}:{user_id or ''}:{date_str}:{tz_name}"
+
+
+def _generate_summary_json(prompt: str, system_prompt: str, log_tag: str) -> Dict[str, Any]:
+    """
+    Llama a Gemini y parsea la respuesta JSON (quitando bloques ```json```).
+    Lanza json.JSONDecodeError si la respuesta no es JSON válido.
+    """
+    if not gemini_model:
+        raise Exception("Gemini client no está inicializado. Verifica GEMINI_API_KEY.")
+
+    try:
+        response = gemini_model.generate_content(system_prompt + "\n\n" + prompt)
+    except Exception as gemini_error:
+        error_str = str(gemini_error)
+        print(f"❌ [{log_tag}] Error llamando a Gemini: {error_str}")
+        if "API key not valid" in error_str or "API_KEY_INVALID" in error_str:
+            print(f"💡 La API key parece ser inválida. Verifica:")
+            print(f"   1. Que la API key sea correcta en Google AI Studio")
+            print(f"   2. Que tenga habilitada 'Generative Language API' en Google Cloud Console")
+            print(f"   3. Que no esté restringida por IP o dominio")
+            print(f"   4. Que tengas créditos/quota disponible")
+        raise
+
+    text = (response.text or "").strip()
+
+    # Limpiar el texto (puede venir con markdown code blocks)
+    if text.startswith("```json"):
+        text = text[7:]
+    if text.startswith("```"):
+        text = text[3:]
+    if text.endswith("```"):
+        text = text[:-3]
+    text = text.strip()
+
+    return json.loads(text)
+
+
+def _stale_or_pending(cached: Optional[Dict[str, Any]], max_highlights: int, **fields) -> Dict[str, Any]:
+    """Respuesta de ?stale=ok mientras el worker regenera: el resumen anterior o 'pending'."""
+    if cached and cached.get("summary"):
+        return {
+            "summary": cached.get("summary"),
+            "highlights": (cached.get("highlights") or [])[:max_highlights],
+            "cached": True,
+            "status": "stale",
+            **fields,
+        }
+    return {"summary": None, "highlights": [], "cached": False, "status": "pending", **fields}
+
+
+def _regenerate_in_background(cache_key: str, cached: Optional[Dict[str, Any]], max_highlights: int,
+                              task, *args, **fields) -> Dict[str, Any]:
+    """
+    Encola la regeneración de cache_key en summary_worker y responde con _stale_or_pending.
+    Si la última regeneración falló hace menos de SUMMARY_FAILURE_COOLDOWN_SECONDS no se
+    encola de nuevo: se responde el resumen anterior ("stale") o status "failed", con retryAfter.
+    """
+    retry_after = _failure_retry_after(cached)
+    if not retry_after:
+        summary_worker.submit(cache_key, task, *args)
+        return _stale_or_pending(cached, max_highlights, **fields)
+    result = _stale_or_pending(cached, max_highlights, retryAfter=retry_after, **fields)
+    if result["status"] == "pending":
+        result["status"] = "failed"
+    return result
+
+
+def _build_conversation_summary(conversation: Dict[str, Any], mode: str = "auto",
+                                stale_ok: bool = False) -> Dict[str, Any]:
+    """
+    Resume una conversación: caché por hash de mensajes, incremental sobre el resumen
+    anterior si la conversación solo creció, o completo (mode=full, que siempre regenera).
+    Con stale_ok, si no hay resumen vigente no llama a Gemini: encola la regeneración en
+    summary_worker y retorna el resumen anterior (status "stale") o status "pending".
+    mode=full ignora stale_ok y genera el resumen en la petición.
+    Lanza json.JSONDecodeError si Gemini no devuelve JSON válido.
+    """
+    messages = conversation.get("messages", [])
+    if not messages:
+        return {
+            "summary": "Esta conversación no contiene mensajes.",
+            "highlights": [],
+            "status": "fresh"
+        }
+
+    # Caché: se invalida sola cuando llegan mensajes nuevos (cambia el hash)
+    cache_key = f"conversation:{conversation['_id']}"
+    content_hash = _summary_content_hash(messages)
+    cached = _summary_cache_get(cache_key)
+    if mode != "full" and cached and cached.get("contentHash") == content_hash:
+        return {
+            "summary": cached.get("summary") or "No se pudo generar resumen.",
+            "highlights": (cached.get("highlights") or [])[:5],
+            "cached": True,
+            "mode": "cached",
+            "status": "fresh"
+        }
+
+    if stale_ok and mode != "full":
+        return _regenerate_in_background(cache_key, cached, 5, _precompute_conversation_summary, conversation["_id"])
+
+    # Modo incremental: si el resumen cacheado cubre un prefijo intacto de la conversación
+    # (watermark = messageCount), solo se envían ese resumen y los mensajes nuevos.
+    # mode=full fuerza el resumen completo.
+    watermark = cached.get("messageCount") if cached else None
+    incremental = (
+        mode != "full"
+        and isinstance(watermark, int)
+        and 0 < watermark < len(messages)
+        and bool(cached.get("summary"))
+        and _summary_content_hash(messages[:watermark]) == cached.get("contentHash")
+    )
+    pending_messages = messages[watermark:] if incremental else messages
+
+    # Construir el texto de la conversación
+    conversation_text = ""
+    for msg in pending_messages:
+        role = msg.get("role", "unknown")
+        content = msg.get("content", "").strip()
+        if content:
+            conversation_text += f"{role.upper()}: {content}\n"
+
+    # Generar resumen con IA
+    if incremental:
+        previous_highlights = "\n".join(f"- {h}" for h in (cached.get("highlights") or []))
+        prompt = f"""Tienes el resumen previo de una conversación entre un paciente y un asistente médico virtual, y los mensajes nuevos que se agregaron después de ese resumen. Genera un resumen ACTUALIZADO de toda la conversación:
+1. Un párrafo resumen (máximo 150 palabras) que integre el resumen previo con la información nueva: contexto general, síntomas o preocupaciones principales del paciente, y recomendaciones o información proporcionada.
+2. Hasta 5 puntos destacados (bullets) con la información más importante de toda la conversación: síntomas mencionados, recomendaciones clave, preocupaciones principales, o cualquier dato clínico relevante.
+
+Resumen previo (mensajes 1 a {watermark}):
+{cached.get("summary")}
+
+Puntos destacados previos:
+{previous_highlights}
+
+Mensajes nuevos (del {watermark + 1} al {len(messages)}):
+{conversation_text}
+
+Responde en formato JSON con esta estructura:
+{{
+  "summary": "párrafo resumen aquí",
+  "highlights": [
+    "punto destacado 1",
+    "punto destacado 2",
+    ...
+  ]
+}}
+
+Responde SOLO con el JSON, sin texto adicional."""
+    else:
+        prompt = f"""Analiza la siguiente conversación entre un paciente y un asistente médico virtual y genera:
+1. Un párrafo resumen (máximo 150 palabras) que describa el contexto general de la conversación, los síntomas o preocupaciones principales del paciente, y las recomendaciones o información proporcionada.
+2. Hasta 5 puntos destacados (bullets) con la información más importante: síntomas mencionados, recomendaciones clave, preocupaciones principales, o cualquier dato clínico relevante.
+
+Conversación:
+{conversation_text}
+
+Responde en formato JSON con esta estructura:
+{{
+  "summary": "párrafo resumen aquí",
+  "highlights": [
+    "punto destacado 1",
+    "punto destacado 2",
+    ...
+  ]
+}}
+
+Responde SOLO con el JSON, sin texto adicional."""
+
+    result = _generate_summary_json(
+        prompt,
+        "Eres un asistente médico experto. Responde siempre en español y en formato JSON válido.",
+        "SUMMARY",
+    )
+    # messageCount es el watermark del próximo resumen incremental;
+    # sourceUpdatedAt le indica al worker hasta qué mensaje está resumida la conversación
+    _summary_cache_put(
+        cache_key, content_hash, result,
+        kind="conversation", conversationId=conversation["_id"], messageCount=len(messages),
+        summaryMode="incremental" if incremental else "full",
+        sourceUpdatedAt=conversation.get("updatedAt"),
+    )
+
+    return {
+        "summary": result.get("summary", "No se pudo generar resumen."),
+        "highlights": result.get("highlights", [])[:5],
+        "cached": False,
+        "mode": "incremental" if incremental else "full",
+        "status": "fresh"
+    }
+
+
+def _build_daily_summary(patient_id: Optional[int], user_id: Optional[int], date_str: str,
+                         tz_name: str, stale_ok: bool = False) -> Dict[str, Any]:
+    """
+    Resume todas las conversaciones de un paciente/usuario en el día date_str (zona tz_name).
+    Lanza ValueError si la fecha o la zona son inválidas; stale_ok igual que en
+    _build_conversation_summary.
+    """
+    day_start, day_end = _day_range(date_str, tz_name)
+    local_tz = _resolve_timezone(tz_name)
+    collection = get_mongo_collection("did_conversations")
 
     # Construir query
     query: Dict[str, Any] = {}
@@ -896,80 +1650,121 @@ def get_daily_summary():
         else:
             query["userId"] = user_id
 
-    try:
-        # Obtener todas las conversaciones del paciente
-        all_conversations = list(collection.find(query))
-        
-        # Filtrar conversaciones del día específico
-        day_conversations = []
-        all_messages = []
-        
-        for conv in all_conversations:
-            updated_at = conv.get("updatedAt") or conv.get("createdAt")
-            if not updated_at:
+    # El rango se empuja a MongoDB para que el índice compuesto (patientId/userId, updatedAt)
+    # haga el filtrado. La segunda rama cubre timestamps legacy guardados como string ISO
+    # (ventana de ±1 día, afinada abajo); database/utils/normalize_conversation_timestamps.py
+    # los convierte a Date para que esa rama deje de encontrar documentos.
+    day_filter = {
+        "$or": [
+            {"updatedAt": {"$gte": day_start, "$lt": day_end}},
+            {"updatedAt": {
+                "$type": "string",
+                "$gte": (day_start - timedelta(days=1)).isoformat(),
+                "$lt": (day_end + timedelta(days=1)).isoformat(),
+            }},
+        ]
+    }
+    query = {"$and": [query, day_filter]}
+
+    day_conversations = []
+    all_messages = []
+    source_updated_at = None
+
+    cursor = collection.find(query, {"messages": 1, "updatedAt": 1}).sort(CONVERSATION_SORT)
+    for conv in cursor:
+        updated_at = conv.get("updatedAt")
+        # Solo los documentos legacy necesitan verificación en Python
+        if isinstance(updated_at, str):
+            try:
+                parsed = datetime.fromisoformat(updated_at.replace('Z', '+00:00'))
+            except ValueError:
                 continue
-                
-            # Convertir a datetime si es string
-            if isinstance(updated_at, str):
+            if parsed.tzinfo is not None:
+                parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+            if not (day_start <= parsed < day_end):
+                continue
+        elif isinstance(updated_at, datetime) and (source_updated_at is None or updated_at > source_updated_at):
+            source_updated_at = updated_at
+
+        day_conversations.append(conv)
+        # Agregar todos los mensajes de esta conversación
+        messages = conv.get("messages", [])
+        for msg in messages:
+            all_messages.append({
+                "conversation_id": str(conv.get("_id")),
+                "role": msg.get("role", "unknown"),
+                "content": msg.get("content", ""),
+                "timestamp": msg.get("timestamp")
+            })
+
+    if not day_conversations:
+        return {
+            "date": date_str,
+            "summary": f"No se encontraron conversaciones para el día {date_str}.",
+            "highlights": [],
+            "conversation_count": 0,
+            "message_count": 0,
+            "status": "fresh"
+        }
+
+    # Construir el texto de todas las conversaciones del día
+    conversation_text = ""
+    for msg in all_messages:
+        role = msg.get("role", "unknown")
+        content = msg.get("content", "").strip()
+        if content:
+            timestamp = msg.get("timestamp", "")
+            if timestamp:
                 try:
-                    updated_at = datetime.fromisoformat(updated_at.replace('Z', '+00:00'))
+                    if isinstance(timestamp, str):
+                        ts = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+                    else:
+                        ts = timestamp
+                    # Mostrar la hora en la zona del resumen (pymongo devuelve UTC naive)
+                    if ts.tzinfo is None:
+                        ts = ts.replace(tzinfo=timezone.utc)
+                    time_str = ts.astimezone(local_tz).strftime("%H:%M")
+                    conversation_text += f"[{time_str}] {role.upper()}: {content}\n"
                 except:
-                    continue
-            
-            # Verificar si es del día objetivo
-            conv_date = updated_at.date()
-            if conv_date == target_date:
-                day_conversations.append(conv)
-                # Agregar todos los mensajes de esta conversación
-                messages = conv.get("messages", [])
-                for msg in messages:
-                    all_messages.append({
-                        "conversation_id": str(conv.get("_id")),
-                        "role": msg.get("role", "unknown"),
-                        "content": msg.get("content", ""),
-                        "timestamp": msg.get("timestamp")
-                    })
-        
-        if not day_conversations:
-            return jsonify({
-                "date": date_str,
-                "summary": f"No se encontraron conversaciones para el día {date_str}.",
-                "highlights": [],
-                "conversation_count": 0,
-                "message_count": 0
-            }), 200
-
-        # Construir el texto de todas las conversaciones del día
-        conversation_text = ""
-        for msg in all_messages:
-            role = msg.get("role", "unknown")
-            content = msg.get("content", "").strip()
-            if content:
-                timestamp = msg.get("timestamp", "")
-                if timestamp:
-                    try:
-                        if isinstance(timestamp, str):
-                            ts = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-                            time_str = ts.strftime("%H:%M")
-                        else:
-                            time_str = timestamp.strftime("%H:%M")
-                        conversation_text += f"[{time_str}] {role.upper()}: {content}\n"
-                    except:
-                        conversation_text += f"{role.upper()}: {content}\n"
-                else:
                     conversation_text += f"{role.upper()}: {content}\n"
+            else:
+                conversation_text += f"{role.upper()}: {content}\n"
 
-        if not conversation_text.strip():
-            return jsonify({
-                "date": date_str,
-                "summary": f"Se encontraron {len(day_conversations)} conversaciones pero no contienen mensajes.",
-                "highlights": [],
-                "conversation_count": len(day_conversations),
-                "message_count": 0
-            }), 200
-
-        # Generar resumen con Gemini
-        prompt = f"""Analiza todas las conversaciones que un paciente tuvo con un asistente médico virtual el día {date_str} y genera:
+    if not conversation_text.strip():
+        return {
+            "date": date_str,
+            "summary": f"Se encontraron {len(day_conversations)} conversaciones pero no contienen mensajes.",
+            "highlights": [],
+            "conversation_count": len(day_conversations),
+            "message_count": 0,
+            "status": "fresh"
+        }
+
+    # Caché: misma clave de día + mismo contenido => mismo resumen, sin llamar a Gemini
+    cache_key = _daily_summary_cache_key(patient_id, user_id, date_str, tz_name)
+    content_hash = _summary_content_hash(all_messages)
+    cached = _summary_cache_get(cache_key)
+    if cached and cached.get("contentHash") == content_hash:
+        return {
+            "date": date_str,
+            "summary": cached.get("summary") or "No se pudo generar resumen.",
+            "highlights": (cached.get("highlights") or [])[:7],
+            "conversation_count": len(day_conversations),
+            "message_count": len(all_messages),
+            "cached": True,
+            "status": "fresh"
+        }
+
+    if stale_ok:
+        return _regenerate_in_background(
+            cache_key, cached, 7, _build_daily_summary, patient_id, user_id, date_str, tz_name,
+            date=date_str,
+            conversation_count=len(day_conversations),
+            message_count=len(all_messages),
+        )
+
+    # Generar resumen con Gemini
+    prompt = f"""Analiza todas las conversaciones que un paciente tuvo con un asistente médico virtual el día {date_str} y genera:
 1. Un resumen general (máximo 200 palabras) que describa:
    - El contexto general de las consultas del día
    - Los síntomas o preocupaciones principales que el paciente mencionó
@@ -998,73 +1793,291 @@ Responde en formato JSON con esta estructura:
 
 Responde SOLO con el JSON, sin texto adicional."""
 
-        if not gemini_model:
-            raise Exception("Gemini client no está inicializado. Verifica GEMINI_API_KEY.")
-        
-        # Usar Gemini para generar el resumen
-        full_prompt = "Eres un asistente médico experto. Analiza conversaciones médicas y genera resúmenes claros y profesionales en español. Responde siempre en formato JSON válido.\n\n" + prompt
+    try:
+        result = _generate_summary_json(
+            prompt,
+            "Eres un asistente médico experto. Analiza conversaciones médicas y genera resúmenes claros y profesionales en español. Responde siempre en formato JSON válido.",
+            "DAILY_SUMMARY",
+        )
+        _summary_cache_put(
+            cache_key, content_hash, result,
+            kind="daily", date=date_str, timezone=tz_name,
+            patientId=patient_id, userId=user_id,
+            conversationIds=[conv["_id"] for conv in day_conversations],
+            sourceUpdatedAt=source_updated_at,
+        )
+    except json.JSONDecodeError:
+        # Si falla el parseo, crear un resumen básico (no se cachea)
+        result = {
+            "summary": f"El paciente tuvo {len(day_conversations)} conversaciones el día {date_str}. Se discutieron síntomas y se proporcionó orientación médica.",
+            "highlights": [
+                f"Total de conversaciones: {len(day_conversations)}",
+                f"Total de mensajes: {len(all_messages)}",
+                "Consulta médica virtual",
+                "Orientación y recomendaciones proporcionadas"
+            ]
+        }
+
+    return {
+        "date": date_str,
+        "summary": result.get("summary", "No se pudo generar resumen."),
+        "highlights": result.get("highlights", [])[:7],
+        "conversation_count": len(day_conversations),
+        "message_count": len(all_messages),
+        "cached": False,
+        "status": "fresh"
+    }
+
+
+def _precompute_conversation_summary(conversation_id: ObjectId) -> None:
+    """Tarea del worker: relee la conversación (puede haber crecido) y la resume."""
+    conversation = get_mongo_collection("did_conversations").find_one({"_id": conversation_id})
+    if conversation:
+        _build_conversation_summary(conversation)
+
+
+class SummaryPrecomputeWorker:
+    """
+    Precalcula resúmenes de conversación y diarios en segundo plano.
+
+    Un hilo sondea did_conversations cada SUMMARY_POLL_SECONDS buscando conversaciones
+    inactivas (sin cambios en SUMMARY_IDLE_SECONDS, dentro de SUMMARY_LOOKBACK_HOURS) cuyo
+    resumen cacheado sea anterior a su updatedAt, y encola su resumen y el del día del
+    paciente en un ThreadPoolExecutor. Cada clave de caché tiene como máximo una tarea en
+    curso; las peticiones síncronas esperan esa tarea en lugar de repetir la llamada a Gemini.
+
+    Cada proceso del backend arranca su propio worker, pero solo sondea el que tiene el
+    lease de SUMMARY_LEASE_COLLECTION (se renueva en cada sondeo y caduca tras tres sondeos
+    sin renovar), para que cada resumen pendiente se genere una sola vez.
+    """
+
+    def __init__(self, threads: int, poll_seconds: int, idle_seconds: int, lookback_hours: int):
+        self._threads = max(1, threads)
+        self._poll_seconds = poll_seconds
+        self._idle = timedelta(seconds=idle_seconds)
+        self._lookback = timedelta(hours=lookback_hours)
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._inflight: Dict[str, Future] = {}
+        # clave -> updatedAt ya encolado; evita reintentar cada sondeo lo que no se cachea
+        self._attempted: Dict[str, datetime] = {}
+        self._stop = threading.Event()
+        self._poller: Optional[threading.Thread] = None
+        self._owner = f"{socket.gethostname()}:{os.getpid()}:{id(self):x}"
+        self._lease_seconds = max(poll_seconds * 3, 60)
+        self._leader = False
+
+    def start(self) -> None:
+        """Arranca el hilo de sondeo (idempotente)."""
+        with self._lock:
+            if self._poller is not None:
+                return
+            self._poller = threading.Thread(target=self._run, name="summary-poller", daemon=True)
+            self._poller.start()
+        print(f"🧵 Worker de resúmenes activo ({self._threads} hilos, sondeo cada {self._poll_seconds}s, "
+              f"inactividad {int(self._idle.total_seconds())}s)")
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._release_lease()
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def submit(self, key: str, fn, *args) -> Future:
+        """Encola fn(*args) para key, o retorna la tarea que ya está en curso para esa clave."""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._threads, thread_name_prefix="summary-worker"
+                )
+            future = self._executor.submit(self._run_task, key, fn, *args)
+            self._inflight[key] = future
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return future
+
+    def wait(self, key: str, timeout: float = SUMMARY_WAIT_SECONDS) -> None:
+        """Si hay una tarea en curso para key, espera a que termine (como máximo timeout)."""
+        with self._lock:
+            future = self._inflight.get(key)
+        if future is None:
+            return
         try:
-            response = gemini_model.generate_content(full_prompt)
-        except Exception as gemini_error:
-            error_str = str(gemini_error)
-            print(f"❌ [DAILY_SUMMARY] Error llamando a Gemini: {error_str}")
-            if "API key not valid" in error_str or "API_KEY_INVALID" in error_str:
-                print(f"💡 La API key parece ser inválida. Verifica:")
-                print(f"   1. Que la API key sea correcta en Google AI Studio")
-                print(f"   2. Que tenga habilitada 'Generative Language API' en Google Cloud Console")
-                print(f"   3. Que no esté restringida por IP o dominio")
-                print(f"   4. Que tengas créditos/quota disponible")
-            raise
-        
-        text = (response.text or "").strip()
-        
-        # Limpiar el texto (puede venir con markdown code blocks)
-        if text.startswith("```json"):
-            text = text[7:]
-        if text.startswith("```"):
-            text = text[3:]
-        if text.endswith("```"):
-            text = text[:-3]
-        text = text.strip()
+            future.result(timeout=timeout)
+        except Exception:
+            pass
 
+    def _forget(self, key: str, future: Future) -> None:
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    @staticmethod
+    def _run_task(key: str, fn, *args) -> None:
         try:
-            result = json.loads(text)
-        except json.JSONDecodeError:
-            # Si falla el parseo, crear un resumen básico
-            result = {
-                "summary": f"El paciente tuvo {len(day_conversations)} conversaciones el día {date_str}. Se discutieron síntomas y se proporcionó orientación médica.",
-                "highlights": [
-                    f"Total de conversaciones: {len(day_conversations)}",
-                    f"Total de mensajes: {len(all_messages)}",
-                    "Consulta médica virtual",
-                    "Orientación y recomendaciones proporcionadas"
-                ]
-            }
-        
-        return jsonify({
-            "date": date_str,
-            "summary": result.get("summary", "No se pudo generar resumen."),
-            "highlights": result.get("highlights", [])[:7],
-            "conversation_count": len(day_conversations),
-            "message_count": len(all_messages)
-        }), 200
+            fn(*args)
+        except PyMongoError as e:
+            mongo_manager.handle_error(e)
+            print(f"⚠️ [SUMMARY_WORKER] Error MongoDB en {key}: {e}", file=sys.stderr)
+        except Exception as e:
+            print(f"⚠️ [SUMMARY_WORKER] No se pudo precalcular {key}: {e}", file=sys.stderr)
+            _summary_cache_mark_failure(key, e)
 
-    except json.JSONDecodeError:
-        # Si falla el parseo JSON, crear un resumen básico
-        return jsonify({
-            "date": date_str,
-            "summary": f"El paciente tuvo {len(day_conversations) if 'day_conversations' in locals() else 0} conversaciones el día {date_str}. Se discutieron síntomas y se proporcionó orientación médica.",
-            "highlights": [
-                f"Total de conversaciones: {len(day_conversations) if 'day_conversations' in locals() else 0}",
-                "Consulta médica virtual",
-                "Orientación proporcionada"
-            ],
-            "conversation_count": len(day_conversations) if 'day_conversations' in locals() else 0,
-            "message_count": len(all_messages) if 'all_messages' in locals() else 0
-        }), 200
+    def _hold_lease(self) -> bool:
+        """Toma o renueva el lease del sondeo; False si otro proceso lo tiene vigente."""
+        now = datetime.now(timezone.utc)
+        try:
+            get_mongo_collection(SUMMARY_LEASE_COLLECTION).find_one_and_update(
+                {"_id": "summary-poller", "$or": [{"owner": self._owner}, {"expiresAt": {"$lt": now}}]},
+                {"$set": {"owner": self._owner, "expiresAt": now + timedelta(seconds=self._lease_seconds)}},
+                upsert=True,
+            )
+            leader = True
+        except DuplicateKeyError:
+            # El documento existe con otro dueño y sin caducar: el upsert choca con su _id
+            leader = False
+        if leader != self._leader:
+            self._leader = leader
+            state = "toma" if leader else "cede"
+            print(f"🧵 [SUMMARY_WORKER] {self._owner} {state} el sondeo de resúmenes")
+        return leader
+
+    def _release_lease(self) -> None:
+        if not self._leader:
+            return
+        try:
+            get_mongo_collection(SUMMARY_LEASE_COLLECTION).delete_one(
+                {"_id": "summary-poller", "owner": self._owner}
+            )
+        except Exception:
+            pass
+        self._leader = False
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._poll_seconds):
+            try:
+                if not self._hold_lease():
+                    continue
+                self.poll_once()
+            except PyMongoError as e:
+                mongo_manager.handle_error(e)
+                print(f"⚠️ [SUMMARY_WORKER] Error MongoDB en el sondeo: {e}", file=sys.stderr)
+            except Exception as e:
+                print(f"⚠️ [SUMMARY_WORKER] Error en el sondeo: {e}", file=sys.stderr)
+
+    def poll_once(self) -> int:
+        """Encola los resúmenes desactualizados de conversaciones inactivas; retorna cuántos."""
+        now = datetime.now(timezone.utc)
+        conversations = get_mongo_collection("did_conversations").find(
+            {"updatedAt": {"$gte": now - self._lookback, "$lt": now - self._idle}},
+            {"updatedAt": 1, "patientId": 1, "userId": 1},
+        ).sort("updatedAt", -1).limit(SUMMARY_WORKER_BATCH)
+
+        local_tz = _resolve_timezone(CONVERSATION_TIMEZONE)
+        # clave de caché -> (updatedAt más reciente que cubre, función, argumentos)
+        tasks: Dict[str, Any] = {}
+        for conv in conversations:
+            updated_at = conv["updatedAt"]
+            tasks[f"conversation:{conv['_id']}"] = (updated_at, _precompute_conversation_summary, (conv["_id"],))
+
+            # Mismo día y clave que pide el dashboard (solo patientId, zona por defecto)
+            patient_id, user_id = conv.get("patientId"), conv.get("userId")
+            if not patient_id and not user_id:
+                continue
+            if patient_id:
+                user_id = None
+            date_str = updated_at.replace(tzinfo=timezone.utc).astimezone(local_tz).date().isoformat()
+            daily_key = _daily_summary_cache_key(patient_id, user_id, date_str, CONVERSATION_TIMEZONE)
+            if daily_key not in tasks or tasks[daily_key][0] < updated_at:
+                tasks[daily_key] = (updated_at, _build_daily_summary,
+                                    (patient_id, user_id, date_str, CONVERSATION_TIMEZONE))
+
+        if not tasks:
+            self._attempted.clear()
+            return 0
+
+        # Una sola consulta para saber hasta dónde llega cada resumen cacheado
+        summarized = {
+            doc["_id"]: doc.get("sourceUpdatedAt")
+            for doc in get_mongo_collection(SUMMARY_CACHE_COLLECTION).find(
+                {"_id": {"$in": list(tasks)}}, {"sourceUpdatedAt": 1}
+            )
+        }
+
+        queued = 0
+        for key, (updated_at, fn, args) in tasks.items():
+            source = summarized.get(key)
+            if isinstance(source, datetime) and source >= updated_at:
+                continue
+            if self._attempted.get(key) == updated_at:
+                continue
+            self._attempted[key] = updated_at
+            self.submit(key, fn, *args)
+            queued += 1
+
+        # Olvidar claves que salieron de la ventana de sondeo
+        self._attempted = {key: value for key, value in self._attempted.items() if key in tasks}
+        if queued:
+            print(f"🧵 [SUMMARY_WORKER] {queued} resúmenes encolados")
+        return queued
+
+
+summary_worker = SummaryPrecomputeWorker(
+    SUMMARY_WORKER_THREADS, SUMMARY_POLL_SECONDS, SUMMARY_IDLE_SECONDS, SUMMARY_LOOKBACK_HOURS
+)
+
+
+def _wants_stale(args) -> bool:
+    return (args.get("stale") or "").strip().lower() in ("ok", "1", "true")
+
+
+@app.get("/api/did/conversations/daily-summary")
+def get_daily_summary():
+    """
+    Genera un resumen diario de todas las conversaciones de un paciente en una fecha específica.
+    Usa Gemini para generar el resumen.
+    El día se interpreta en la zona horaria tz (por defecto CONVERSATION_TIMEZONE).
+    status: "fresh" (vigente), "stale" (anterior, regenerándose) o "pending" (sin resumen aún);
+    los dos últimos solo con stale=ok, que responde sin esperar a Gemini. Con stale=ok, tras
+    un fallo reciente del worker no se reintenta: "stale" o "failed", con retryAfter.
+    "fallback" es un texto genérico porque Gemini falló; "error" acompaña a los 4xx/5xx.
+    """
+    try:
+        get_mongo_collection("did_conversations")
+    except PyMongoError as exc:
+        return jsonify({"status": "error", "error": f"MongoDB no disponible: {exc}"}), 503
+
+    patient_id = _safe_int(request.args.get("patientId"))
+    user_id = _safe_int(request.args.get("userId"))
+    date_str = request.args.get("date")  # Formato: YYYY-MM-DD
+
+    if not patient_id and not user_id:
+        return jsonify({"status": "error", "error": "Se requiere patientId o userId"}), 400
+
+    if not date_str:
+        return jsonify({"status": "error", "error": "Se requiere el parámetro 'date' (formato: YYYY-MM-DD)"}), 400
+
+    tz_name = (request.args.get("tz") or CONVERSATION_TIMEZONE).strip()
+    stale_ok = _wants_stale(request.args)
+
+    try:
+        if not stale_ok:
+            # Si el worker ya está generando este resumen, esperarlo en vez de duplicar la llamada
+            summary_worker.wait(_daily_summary_cache_key(patient_id, user_id, date_str, tz_name))
+        result = _build_daily_summary(patient_id, user_id, date_str, tz_name, stale_ok=stale_ok)
+        return jsonify(result), 202 if result["status"] == "pending" else 200
+
+    except ValueError as range_error:
+        # Fecha o zona horaria inválida
+        return jsonify({"status": "error", "error": str(range_error)}), 400
     except PyMongoError as e:
+        mongo_manager.handle_error(e)
         print(f"❌ [DAILY_SUMMARY] Error MongoDB: {e}", file=sys.stderr)
-        return jsonify({"error": f"MongoDB no disponible: {e}"}), 503
+        return jsonify({"status": "error", "error": f"MongoDB no disponible: {e}"}), 503
     except Exception as e:
         print(f"❌ [DAILY_SUMMARY] Error: {e}", file=sys.stderr)
         traceback.print_exc(file=sys.stderr)
@@ -1074,6 +2087,7 @@ Responde SOLO con el JSON, sin texto adicional."""
             "highlights": [],
             "conversation_count": 0,
             "message_count": 0,
+            "status": "fallback",
             "error": str(e)
         }), 200
 
@@ -1083,112 +2097,57 @@ def get_conversation_summary(conversation_id: str):
     """
     Obtiene un resumen de una conversación específica usando IA.
     Retorna un párrafo resumen y hasta 5 bullets con lo más importante.
+    Los resúmenes se cachean en SUMMARY_CACHE_COLLECTION por conversación + hash de mensajes.
+    Si la conversación creció desde el último resumen, se actualiza de forma incremental
+    (resumen previo + mensajes nuevos); mode=full fuerza regenerarlo completo.
+    status: "fresh", "stale", "pending", "failed", "fallback" o "error" (ver daily-summary).
     """
     try:
         # Obtener colección MongoDB
         collection = get_mongo_collection("did_conversations")
-        
+
         # Validar y limpiar el ID
         conversation_id = str(conversation_id).strip()
-        
+
         if len(conversation_id) != 24:
-            return jsonify({"error": f"ID de conversación inválido: longitud incorrecta ({len(conversation_id)} caracteres, debe ser 24)"}), 400
-        
+            return jsonify({"status": "error", "error": f"ID de conversación inválido: longitud incorrecta ({len(conversation_id)} caracteres, debe ser 24)"}), 400
+
         try:
             obj_id = ObjectId(conversation_id)
         except InvalidId as e:
-            return jsonify({"error": f"ID de conversación inválido: '{conversation_id}'. Debe ser un ObjectId válido de 24 caracteres hexadecimales."}), 400
-        
+            return jsonify({"status": "error", "error": f"ID de conversación inválido: '{conversation_id}'. Debe ser un ObjectId válido de 24 caracteres hexadecimales."}), 400
+
+        stale_ok = _wants_stale(request.args)
+        if not stale_ok:
+            # Si el worker ya está generando este resumen, esperarlo en vez de duplicar la llamada
+            summary_worker.wait(f"conversation:{obj_id}")
+
         # Buscar conversación
         conversation = collection.find_one({"_id": obj_id})
         if not conversation:
-            return jsonify({"error": "Conversación no encontrada"}), 404
-
-        messages = conversation.get("messages", [])
-        if not messages:
-            return jsonify({
-                "summary": "Esta conversación no contiene mensajes.",
-                "highlights": []
-            }), 200
-
-        # Construir el texto de la conversación
-        conversation_text = ""
-        for msg in messages:
-            role = msg.get("role", "unknown")
-            content = msg.get("content", "").strip()
-            if content:
-                conversation_text += f"{role.upper()}: {content}\n"
-
-        # Generar resumen con IA
-        prompt = f"""Analiza la siguiente conversación entre un paciente y un asistente médico virtual y genera:
-1. Un párrafo resumen (máximo 150 palabras) que describa el contexto general de la conversación, los síntomas o preocupaciones principales del paciente, y las recomendaciones o información proporcionada.
-2. Hasta 5 puntos destacados (bullets) con la información más importante: síntomas mencionados, recomendaciones clave, preocupaciones principales, o cualquier dato clínico relevante.
-
-Conversación:
-{conversation_text}
-
-Responde en formato JSON con esta estructura:
-{{
-  "summary": "párrafo resumen aquí",
-  "highlights": [
-    "punto destacado 1",
-    "punto destacado 2",
-    ...
-  ]
-}}
+            return jsonify({"status": "error", "error": "Conversación no encontrada"}), 404
 
-Responde SOLO con el JSON, sin texto adicional."""
-
-        if not gemini_model:
-            raise Exception("Gemini client no está inicializado. Verifica GEMINI_API_KEY.")
-        
-        # Usar Gemini en lugar de OpenAI
-        full_prompt = "Eres un asistente médico experto. Responde siempre en español y en formato JSON válido.\n\n" + prompt
-        try:
-            response = gemini_model.generate_content(full_prompt)
-        except Exception as gemini_error:
-            error_str = str(gemini_error)
-            print(f"❌ [SUMMARY] Error llamando a Gemini: {error_str}")
-            if "API key not valid" in error_str or "API_KEY_INVALID" in error_str:
-                print(f"💡 La API key parece ser inválida. Verifica:")
-                print(f"   1. Que la API key sea correcta en Google AI Studio")
-                print(f"   2. Que tenga habilitada 'Generative Language API' en Google Cloud Console")
-                print(f"   3. Que no esté restringida por IP o dominio")
-                print(f"   4. Que tengas créditos/quota disponible")
-            raise
-        
-        text = (response.text or "").strip()
-        
-        # Limpiar el texto (puede venir con markdown code blocks)
-        if text.startswith("```json"):
-            text = text[7:]
-        if text.startswith("```"):
-            text = text[3:]
-        if text.endswith("```"):
-            text = text[:-3]
-        text = text.strip()
-
-        result = json.loads(text)
-        
-        return jsonify({
-            "summary": result.get("summary", "No se pudo generar resumen."),
-            "highlights": result.get("highlights", [])[:5]
-        }), 200
+        mode = (request.args.get("mode") or "auto").strip().lower()
+        result = _build_conversation_summary(conversation, mode, stale_ok=stale_ok)
+        return jsonify(result), 202 if result["status"] == "pending" else 200
 
     except json.JSONDecodeError:
         # Si falla el parseo JSON, crear un resumen básico
-        msg_count = len(messages) if 'messages' in locals() and messages else 0
+        messages = conversation.get("messages", []) if 'conversation' in locals() and conversation else []
+        msg_count = len(messages)
         return jsonify({
             "summary": f"Conversación con {msg_count} mensajes. El paciente consultó sobre sus síntomas y recibió orientación médica.",
             "highlights": [
                 f"Total de mensajes: {msg_count}",
                 "Consulta médica virtual",
                 "Orientación y recomendaciones proporcionadas"
-            ]
+            ],
+            "status": "fallback"
         }), 200
     except PyMongoError as e:
+        mongo_manager.handle_error(e)
         print(f"❌ [SUMMARY] Error MongoDB: {e}", file=sys.stderr)
-        return jsonify({"error": f"MongoDB no disponible: {e}"}), 503
+        return jsonify({"status": "error", "error": f"MongoDB no disponible: {e}"}), 503
     except Exception as e:
         print(f"❌ [SUMMARY] Error: {e}", file=sys.stderr)
         traceback.print_exc(file=sys.stderr)
@@ -1198,7 +2157,8 @@ Responde SOLO con el JSON, sin texto adicional."""
             "highlights": [
                 "Consulta médica virtual",
                 "Orientación proporcionada"
-            ]
+            ],
+            "status": "fallback"
         }), 200
 
 
@@ -1618,7 +2578,7 @@ def register():
         if str(frontend_path) not in sys.path:
             sys.path.insert(0, str(frontend_path))
         
-        from db_connection import register_patient
+        from db_connection import PasswordHasherSaturated, register_patient
         
         data = request.get_json()
         if not data:
@@ -1639,14 +2599,18 @@ def register():
             return jsonify({"error": "Formato de correo inválido"}), 400
         
         # Registrar paciente
-        user = register_patient(
-            username=username,
-            password=password,
-            correo=correo,
-            nombre=nombre,
-            apellido=apellido,
-            telefono=telefono
-        )
+        try:
+            user = register_patient(
+                username=username,
+                password=password,
+                correo=correo,
+                nombre=nombre,
+                apellido=apellido,
+                telefono=telefono
+            )
+        except PasswordHasherSaturated as e:
+            print(f"⚠️ Registro rechazado: {e}")
+            return jsonify({"error": "Servidor ocupado, intenta de nuevo en unos segundos"}), 429, {"Retry-After": "1"}
         
         if not user:
             return jsonify({"error": "El usuario o correo ya existe"}), 409
@@ -1664,6 +2628,11 @@ def register():
         return jsonify({"error": f"Error al registrar usuario: {str(e)}"}), 500
 
 
+# Precálculo de resúmenes en segundo plano (sin Gemini no hay nada que precalcular)
+if SUMMARY_WORKER_ENABLED and gemini_model:
+    summary_worker.start()
+
+
 if __name__ == "__main__":
     import sys
     port = int(os.getenv("PORT", 8080))
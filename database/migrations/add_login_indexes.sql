@@ -0,0 +1,12 @@
+-- ===========================================
+-- MIGRACIÓN: ÍNDICES PARA LOGIN
+-- Aplica a una BD existente lo que init-postgres.sql ya crea en instalaciones nuevas:
+-- índices funcionales LOWER(username) / LOWER(correo) que usa authenticate_user_sp.
+-- Idempotente. Ejecutar antes de volver a aplicar stored_procedures.sql:
+--   psql -U admin -d medico_db -f database/migrations/add_login_indexes.sql
+-- ===========================================
+
+CREATE INDEX IF NOT EXISTS idx_usuario_username_lower ON USUARIO(LOWER(username));
+CREATE INDEX IF NOT EXISTS idx_usuario_correo_lower ON USUARIO(LOWER(correo));
+
+ANALYZE USUARIO;
@@ -0,0 +1,22 @@
+-- ===========================================
+-- MIGRACIÓN: ÍNDICES PARA BÚSQUEDA DE PACIENTES
+-- Aplica a una BD existente lo que init-postgres.sql ya crea en instalaciones nuevas:
+-- índice por médico y trigramas (pg_trgm + unaccent) para search_doctor_patients_sp.
+-- Idempotente. Ejecutar antes de volver a aplicar stored_procedures.sql:
+--   psql -U admin -d medico_db -f database/migrations/add_patient_search_indexes.sql
+-- ===========================================
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+-- unaccent() es STABLE; este envoltorio IMMUTABLE (diccionario fijo) permite indexarlo
+CREATE OR REPLACE FUNCTION immutable_unaccent(TEXT)
+RETURNS TEXT AS $$
+    SELECT public.unaccent('public.unaccent'::regdictionary, $1)
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT;
+
+CREATE INDEX IF NOT EXISTS idx_paciente_medico_gen ON PACIENTE(id_medico_gen);
+CREATE INDEX IF NOT EXISTS idx_paciente_nombre_trgm ON PACIENTE USING gin (LOWER(immutable_unaccent(nombre)) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_paciente_correo_trgm ON PACIENTE USING gin (LOWER(correo) gin_trgm_ops);
+
+ANALYZE PACIENTE;
@@ -185,8 +185,21 @@ db.interaccion_ia.createIndex({ "tipo": 1, "fecha": -1 });
 db.interaccion_ia.createIndex({ "paciente_id": 1, "fecha": -1 });
 db.consulta_doc.createIndex({ "consulta_id": 1 });
 db.did_conversations.createIndex({ "agentId": 1, "chatId": 1 }, { unique: true });
-db.did_conversations.createIndex({ "userId": 1, "updatedAt": -1 });
-db.did_conversations.createIndex({ "patientId": 1, "updatedAt": -1 });
+// _id como desempate: permite paginar por cursor (updatedAt, _id) sin ordenar en memoria.
+// Reemplazan a los índices (userId, updatedAt) y (patientId, updatedAt), que se eliminan si existen
+["userId_1_updatedAt_-1", "patientId_1_updatedAt_-1"].forEach(function (name) {
+    if (db.did_conversations.getIndexes().some(function (index) { return index.name === name; })) {
+        db.did_conversations.dropIndex(name);
+    }
+});
+db.did_conversations.createIndex({ "userId": 1, "updatedAt": -1, "_id": -1 });
+db.did_conversations.createIndex({ "patientId": 1, "updatedAt": -1, "_id": -1 });
+// Sondeo del worker de resúmenes (conversaciones inactivas recientes)
+db.did_conversations.createIndex({ "updatedAt": -1 });
+
+// Caché de resúmenes Gemini (clave en _id); entradas sin regenerar en 30 días expiran
+db.createCollection("did_conversation_summaries");
+db.did_conversation_summaries.createIndex({ "updatedAt": 1 }, { expireAfterSeconds: 2592000 });
 
 print("✅ MongoDB inicializado correctamente");
 
@@ -299,6 +299,24 @@ CREATE INDEX idx_consulta_medico_fecha ON CONSULTA(id_medico, fecha_hora DESC);
 CREATE INDEX idx_episodio_paciente ON EPISODIO(id_paciente);
 CREATE INDEX idx_archivo_asoc_entidad ON ARCHIVO_ASOCIACION(entidad, entidad_id);
 CREATE INDEX idx_interaccion_ia_fecha ON AUDITORIA(fecha_hora DESC);
+CREATE INDEX idx_paciente_medico_gen ON PACIENTE(id_medico_gen);
+
+-- Login sin distinguir mayúsculas (authenticate_user_sp): una búsqueda por índice por columna
+CREATE INDEX idx_usuario_username_lower ON USUARIO(LOWER(username));
+CREATE INDEX idx_usuario_correo_lower ON USUARIO(LOWER(correo));
+
+-- Búsqueda de pacientes (search_doctor_patients_sp): trigramas sin acentos ni mayúsculas
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+-- unaccent() es STABLE; este envoltorio IMMUTABLE (diccionario fijo) permite indexarlo
+CREATE OR REPLACE FUNCTION immutable_unaccent(TEXT)
+RETURNS TEXT AS $$
+    SELECT public.unaccent('public.unaccent'::regdictionary, $1)
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT;
+
+CREATE INDEX idx_paciente_nombre_trgm ON PACIENTE USING gin (LOWER(immutable_unaccent(nombre)) gin_trgm_ops);
+CREATE INDEX idx_paciente_correo_trgm ON PACIENTE USING gin (LOWER(correo) gin_trgm_ops);
 
 -- ===========================================
 -- DATOS DE EJEMPLO
@@ -221,7 +221,9 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
--- Procedimiento para obtener TODOS los pacientes asignados a un médico
+-- Procedimiento para obtener TODOS los pacientes asignados a un médico (con su foto de perfil)
+-- DROP: CREATE OR REPLACE no puede cambiar las columnas de retorno
+DROP FUNCTION IF EXISTS get_doctor_patients_sp(INTEGER);
 CREATE OR REPLACE FUNCTION get_doctor_patients_sp(doctor_id INTEGER)
 RETURNS TABLE (
     id INTEGER,
@@ -245,7 +247,8 @@ RETURNS TABLE (
     ocupacion_id INTEGER,
     ocupacion_nombre VARCHAR(100),
     estado_civil_id INTEGER,
-    estado_civil_nombre VARCHAR(50)
+    estado_civil_nombre VARCHAR(50),
+    foto_url TEXT
 ) AS $$
 BEGIN
     RETURN QUERY
@@ -271,21 +274,39 @@ BEGIN
         oc.id as ocupacion_id,
         oc.nombre as ocupacion_nombre,
         ec.id as estado_civil_id,
-        ec.nombre as estado_civil_nombre
+        ec.nombre as estado_civil_nombre,
+        foto.url as foto_url
     FROM PACIENTE p
     LEFT JOIN TIPO_SANGRE ts ON p.id_tipo_sangre = ts.id
     LEFT JOIN OCUPACION oc ON p.id_ocupacion = oc.id
     LEFT JOIN ESTADO_CIVIL ec ON p.id_estado_civil = ec.id
+    LEFT JOIN LATERAL (
+        SELECT a.url
+        FROM ARCHIVO_ASOCIACION aa
+        JOIN ARCHIVO a ON a.id = aa.archivo_id
+        WHERE aa.entidad = 'PACIENTE'
+        AND aa.entidad_id = p.id
+        AND aa.descripcion = 'Foto de perfil'
+        ORDER BY aa.id
+        LIMIT 1
+    ) foto ON TRUE
     WHERE p.id_medico_gen = doctor_id
     ORDER BY p.nombre, p.id;
 END;
 $$ LANGUAGE plpgsql;
 
 -- Procedimiento para buscar pacientes de un médico por nombre/correo/ID
+-- Requiere pg_trgm, unaccent e immutable_unaccent (init-postgres.sql o
+-- migrations/add_patient_search_indexes.sql). Los filtros sobre
+-- LOWER(immutable_unaccent(nombre)) y LOWER(correo) usan los índices GIN de trigramas;
+-- el resultado se ordena por: ID exacto, prefijo del nombre y similitud.
+-- accent_insensitive = FALSE exige que los acentos coincidan ("Ramón" no encuentra "Ramon").
+DROP FUNCTION IF EXISTS search_doctor_patients_sp(INTEGER, TEXT, INTEGER);
 CREATE OR REPLACE FUNCTION search_doctor_patients_sp(
     doctor_id INTEGER,
     search_term TEXT,
-    limit_count INTEGER DEFAULT 10
+    limit_count INTEGER DEFAULT 10,
+    accent_insensitive BOOLEAN DEFAULT TRUE
 )
 RETURNS TABLE (
     id INTEGER,
@@ -313,16 +334,23 @@ RETURNS TABLE (
 ) AS $$
 DECLARE
     normalized_term TEXT := NULLIF(TRIM(search_term), '');
+    term_lower TEXT := LOWER(normalized_term);
+    term_key TEXT := LOWER(immutable_unaccent(normalized_term));
+    term_id INTEGER := CASE WHEN TRIM(search_term) ~ '^[0-9]{1,9}$' THEN TRIM(search_term)::INTEGER END;
 BEGIN
+    IF normalized_term IS NULL THEN
+        RETURN;
+    END IF;
+
     RETURN QUERY
     SELECT 
         p.id,
-        p.nombre,
+        p.nombre::TEXT,
         p.fecha_nacimiento,
         p.sexo,
         p.altura,
         p.peso,
-        p.estilo_vida,
+        p.estilo_vida::TEXT,
         p.alergias,
         p.telefono,
         p.correo,
@@ -343,14 +371,24 @@ BEGIN
     LEFT JOIN OCUPACION oc ON p.id_ocupacion = oc.id
     LEFT JOIN ESTADO_CIVIL ec ON p.id_estado_civil = ec.id
     WHERE p.id_medico_gen = doctor_id
-      AND normalized_term IS NOT NULL
       AND (
-        p.nombre ILIKE '%' || normalized_term || '%'
-        OR p.correo ILIKE '%' || normalized_term || '%'
-        OR CAST(p.id AS TEXT) = normalized_term
+        p.id = term_id
+        OR LOWER(p.correo) LIKE '%' || term_lower || '%'
+        -- Subcadena sin acentos (indexada); en modo estricto se confirma con acentos
+        OR (
+            LOWER(immutable_unaccent(p.nombre)) LIKE '%' || term_key || '%'
+            AND (accent_insensitive OR LOWER(p.nombre) LIKE '%' || term_lower || '%')
+        )
+        -- Coincidencia aproximada (errores de tipeo), umbral pg_trgm.similarity_threshold
+        OR (accent_insensitive AND LOWER(immutable_unaccent(p.nombre)) % term_key)
       )
     ORDER BY
-        CASE WHEN LOWER(p.nombre) LIKE LOWER(normalized_term || '%') THEN 0 ELSE 1 END,
+        CASE
+            WHEN p.id = term_id THEN 0
+            WHEN LOWER(immutable_unaccent(p.nombre)) LIKE term_key || '%' THEN 1
+            ELSE 2
+        END,
+        similarity(LOWER(immutable_unaccent(p.nombre)), term_key) DESC,
         p.nombre
     LIMIT COALESCE(NULLIF(limit_count, 0), 10);
 END;
@@ -406,7 +444,8 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
--- Procedimiento para obtener médico por ID
+-- Procedimiento para obtener médico por ID (con su foto de perfil)
+DROP FUNCTION IF EXISTS get_doctor_by_id_sp(INTEGER);
 CREATE OR REPLACE FUNCTION get_doctor_by_id_sp(doctor_id INTEGER)
 RETURNS TABLE (
     id INTEGER,
@@ -418,7 +457,8 @@ RETURNS TABLE (
     descripcion TEXT,
     usuario_id INTEGER,
     id_especialidad INTEGER,
-    especialidad_nombre VARCHAR(100)
+    especialidad_nombre VARCHAR(100),
+    foto_url TEXT
 ) AS $$
 BEGIN
     RETURN QUERY
@@ -432,13 +472,125 @@ BEGIN
         m.descripcion,
         m.usuario_id,
         m.id_especialidad,
-        e.nombre::VARCHAR(100) as especialidad_nombre
+        e.nombre::VARCHAR(100) as especialidad_nombre,
+        foto.url as foto_url
     FROM MEDICO m
     LEFT JOIN ESPECIALIDAD e ON m.id_especialidad = e.id
+    LEFT JOIN LATERAL (
+        SELECT a.url
+        FROM ARCHIVO_ASOCIACION aa
+        JOIN ARCHIVO a ON a.id = aa.archivo_id
+        WHERE aa.entidad = 'MEDICO'
+        AND aa.entidad_id = m.id
+        AND aa.descripcion = 'Foto de perfil'
+        ORDER BY aa.id
+        LIMIT 1
+    ) foto ON TRUE
     WHERE m.id = doctor_id;
 END;
 $$ LANGUAGE plpgsql;
 
+-- Procedimiento para obtener las fotos de perfil de muchas entidades en una consulta
+-- (p_entidad: 'PACIENTE' o 'MEDICO'); las entidades sin foto no aparecen
+CREATE OR REPLACE FUNCTION get_profile_photos_sp(p_entidad VARCHAR, p_entidad_ids INTEGER[])
+RETURNS TABLE (
+    entidad_id INTEGER,
+    foto_url TEXT
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT DISTINCT ON (aa.entidad_id)
+        aa.entidad_id,
+        a.url
+    FROM ARCHIVO_ASOCIACION aa
+    JOIN ARCHIVO a ON a.id = aa.archivo_id
+    WHERE aa.entidad = p_entidad
+    AND aa.entidad_id = ANY(p_entidad_ids)
+    AND aa.descripcion = 'Foto de perfil'
+    ORDER BY aa.entidad_id, aa.id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Procedimiento de login: médico o paciente por username o correo, sin distinguir mayúsculas
+-- Requiere idx_usuario_username_lower / idx_usuario_correo_lower (init-postgres.sql o
+-- migrations/add_login_indexes.sql). Cada rama del UNION ALL es una búsqueda en su índice
+-- funcional (un OR entre las dos columnas obliga a recorrer USUARIO); si hay dos usuarios
+-- posibles se prefiere la coincidencia exacta. La foto se une con LATERAL: una sola
+-- búsqueda en idx_archivo_asoc_entidad en lugar de la subconsulta correlacionada con OR.
+-- Plan esperado (database/utils/explain_login_lookup.py):
+--   Nested Loop Left Join
+--     -> ... -> Limit -> Sort -> Append
+--           -> Index Scan using idx_usuario_username_lower on usuario
+--           -> Index Scan using idx_usuario_correo_lower on usuario
+--     -> Limit -> ... Index Scan using idx_archivo_asoc_entidad on archivo_asociacion
+CREATE OR REPLACE FUNCTION authenticate_user_sp(p_login VARCHAR)
+RETURNS TABLE (
+    usuario_id INTEGER,
+    username VARCHAR(50),
+    correo VARCHAR(150),
+    rol_id INTEGER,
+    password_hash VARCHAR(255),
+    paciente_id INTEGER,
+    paciente_nombre VARCHAR(200),
+    paciente_correo VARCHAR(150),
+    medico_id INTEGER,
+    medico_nombre VARCHAR(200),
+    medico_cedula VARCHAR(50),
+    medico_correo VARCHAR(150),
+    especialidad VARCHAR(100),
+    foto_url TEXT
+) AS $$
+BEGIN
+    RETURN QUERY
+    WITH candidato AS (
+        SELECT c.id
+        FROM (
+            SELECT u.id, (u.username = p_login) AS exacto
+            FROM USUARIO u
+            WHERE LOWER(u.username) = LOWER(p_login)
+            AND u.rol_id IN (2, 3)  -- Médicos o pacientes
+            UNION ALL
+            SELECT u.id, (u.correo = p_login) AS exacto
+            FROM USUARIO u
+            WHERE LOWER(u.correo) = LOWER(p_login)
+            AND u.rol_id IN (2, 3)
+        ) c
+        ORDER BY c.exacto DESC, c.id
+        LIMIT 1
+    )
+    SELECT
+        u.id,
+        u.username,
+        u.correo,
+        u.rol_id,
+        u.password_hash,
+        p.id,
+        p.nombre::VARCHAR(200),
+        p.correo,
+        m.id,
+        m.nombre::VARCHAR(200),
+        m.cedula,
+        m.correo,
+        e.nombre::VARCHAR(100),
+        foto.url
+    FROM candidato c
+    JOIN USUARIO u ON u.id = c.id
+    LEFT JOIN PACIENTE p ON p.usuario_id = u.id
+    LEFT JOIN MEDICO m ON m.usuario_id = u.id
+    LEFT JOIN ESPECIALIDAD e ON m.id_especialidad = e.id
+    LEFT JOIN LATERAL (
+        SELECT a.url
+        FROM ARCHIVO_ASOCIACION aa
+        JOIN ARCHIVO a ON a.id = aa.archivo_id
+        WHERE aa.entidad = CASE WHEN u.rol_id = 2 THEN 'MEDICO' ELSE 'PACIENTE' END
+        AND aa.entidad_id = CASE WHEN u.rol_id = 2 THEN m.id ELSE p.id END
+        AND aa.descripcion = 'Foto de perfil'
+        ORDER BY aa.id
+        LIMIT 1
+    ) foto ON TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
 -- Procedimiento para obtener catálogos
 CREATE OR REPLACE FUNCTION get_catalogos_sp()
 RETURNS JSON AS $$
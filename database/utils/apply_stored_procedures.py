@@ -85,7 +85,9 @@ def apply_stored_procedures():
         required_procedures = [
             'get_doctor_patients_sp',
             'get_doctor_by_id_sp',
-            'get_catalogos_sp'
+            'get_catalogos_sp',
+            'get_profile_photos_sp',
+            'authenticate_user_sp'
         ]
         
         print(f"\n[INFO] Verificando stored procedures requeridos...")
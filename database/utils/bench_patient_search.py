@@ -0,0 +1,209 @@
+"""
+Benchmark de búsqueda de pacientes: ILIKE '%término%' vs trigramas (pg_trgm + unaccent)
+Ejecuta: python bench_patient_search.py [filas] [--keep]
+
+Crea el esquema bench_search con una tabla PACIENTE sintética (por defecto 1,000,000
+filas, nombres en español con acentos, repartidos entre BENCH_DOCTORS médicos) y mide
+la mediana de varias búsquedas en tres fases:
+
+1. Consulta anterior (ILIKE) sin índices
+2. Consulta anterior con índice en id_medico_gen
+3. Consulta de search_doctor_patients_sp con índices GIN de trigramas
+
+Requiere permisos para CREATE EXTENSION (pg_trgm, unaccent). Con --keep no se borra
+el esquema al terminar (para repetir con EXPLAIN desde psql).
+"""
+import os
+import statistics
+import sys
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+load_dotenv()
+
+POSTGRES_HOST = os.getenv("POSTGRES_HOST", "localhost")
+POSTGRES_PORT = os.getenv("POSTGRES_PORT", "5432")
+POSTGRES_DB = os.getenv("POSTGRES_DB", "medico_db")
+POSTGRES_USER = os.getenv("POSTGRES_USER", "admin")
+POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "admin123")
+
+BENCH_DOCTORS = int(os.getenv("BENCH_DOCTORS", "20"))
+REPETITIONS = int(os.getenv("BENCH_REPETITIONS", "7"))
+
+# (descripción, término); se busca siempre dentro de los pacientes del médico 1 (IDs múltiplos de BENCH_DOCTORS)
+SEARCHES = [
+    ("subcadena", "gonzál"),
+    ("sin acento", "ramon"),
+    ("con acento", "Ramón"),
+    ("prefijo correo", "maria.lopez"),
+    ("error de tipeo", "rodrigez"),
+    ("ID exacto", "40000"),
+]
+
+SETUP_SQL = """
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+CREATE OR REPLACE FUNCTION immutable_unaccent(TEXT)
+RETURNS TEXT AS $$
+    SELECT public.unaccent('public.unaccent'::regdictionary, $1)
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT;
+
+DROP SCHEMA IF EXISTS bench_search CASCADE;
+CREATE SCHEMA bench_search;
+CREATE TABLE bench_search.paciente (
+    id SERIAL PRIMARY KEY,
+    nombre VARCHAR(200) NOT NULL,
+    correo VARCHAR(150),
+    id_medico_gen INT
+);
+"""
+
+POPULATE_SQL = """
+INSERT INTO bench_search.paciente (nombre, correo, id_medico_gen)
+SELECT
+    n.nombre || ' ' || a1.apellido || ' ' || a2.apellido,
+    lower(immutable_unaccent(n.nombre || '.' || a1.apellido)) || i || '@correo.mx',
+    1 + (i %% %(doctors)s)
+FROM generate_series(1, %(rows)s) AS i
+CROSS JOIN LATERAL (
+    SELECT (ARRAY['María', 'José', 'Ramón', 'Lucía', 'Sofía', 'Andrés', 'Julián', 'Mónica',
+                  'Raúl', 'Inés', 'Héctor', 'Ana', 'Jesús', 'Verónica', 'Martín', 'Iván'])
+           [1 + (i * 7) %% 16] AS nombre
+) n
+CROSS JOIN LATERAL (
+    SELECT (ARRAY['González', 'Rodríguez', 'López', 'Martínez', 'Pérez', 'Sánchez', 'Ramírez',
+                  'Hernández', 'Gómez', 'Díaz', 'Muñoz', 'Álvarez', 'Núñez', 'Ibáñez'])
+           [1 + (i * 13) %% 14] AS apellido
+) a1
+CROSS JOIN LATERAL (
+    SELECT (ARRAY['Castro', 'Ortiz', 'Rubio', 'Marín', 'Suárez', 'Molina', 'Delgado', 'Morales',
+                  'Ortega', 'Guzmán', 'Vázquez', 'Ramos', 'Cortés', 'Peña', 'Ríos', 'Méndez', 'Cruz'])
+           [1 + (i * 31) %% 17] AS apellido
+) a2;
+ANALYZE bench_search.paciente;
+"""
+
+# Consulta de search_doctor_patients_sp antes de este cambio
+LEGACY_QUERY = """
+SELECT p.id
+FROM bench_search.paciente p
+WHERE p.id_medico_gen = %(doctor)s
+  AND (
+    p.nombre ILIKE '%%' || %(term)s || '%%'
+    OR p.correo ILIKE '%%' || %(term)s || '%%'
+    OR CAST(p.id AS TEXT) = %(term)s
+  )
+ORDER BY
+    CASE WHEN LOWER(p.nombre) LIKE LOWER(%(term)s || '%%') THEN 0 ELSE 1 END,
+    p.nombre
+LIMIT 10
+"""
+
+# Mismo WHERE/ORDER BY que search_doctor_patients_sp (modo sin acentos)
+TRIGRAM_QUERY = """
+SELECT p.id
+FROM bench_search.paciente p
+WHERE p.id_medico_gen = %(doctor)s
+  AND (
+    p.id = %(term_id)s
+    OR LOWER(p.correo) LIKE '%%' || LOWER(%(term)s) || '%%'
+    OR LOWER(immutable_unaccent(p.nombre)) LIKE '%%' || LOWER(immutable_unaccent(%(term)s)) || '%%'
+    OR LOWER(immutable_unaccent(p.nombre)) %% LOWER(immutable_unaccent(%(term)s))
+  )
+ORDER BY
+    CASE
+        WHEN p.id = %(term_id)s THEN 0
+        WHEN LOWER(immutable_unaccent(p.nombre)) LIKE LOWER(immutable_unaccent(%(term)s)) || '%%' THEN 1
+        ELSE 2
+    END,
+    similarity(LOWER(immutable_unaccent(p.nombre)), LOWER(immutable_unaccent(%(term)s))) DESC,
+    p.nombre
+LIMIT 10
+"""
+
+
+def timed(cursor, sql, params):
+    """Mediana en ms de REPETITIONS ejecuciones (después de una de calentamiento)."""
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    samples = []
+    for _ in range(REPETITIONS):
+        start = time.perf_counter()
+        cursor.execute(sql, params)
+        cursor.fetchall()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), len(rows)
+
+
+def run_phase(cursor, title, sql):
+    print(f"\n📊 {title}")
+    for label, term in SEARCHES:
+        params = {"doctor": 1, "term": term, "term_id": int(term) if term.isdigit() else None}
+        median_ms, found = timed(cursor, sql, params)
+        print(f"   {label:<16} {term!r:<14} {median_ms:>9.2f} ms   ({found} resultados)")
+    # Plan de la primera búsqueda para ver qué índices se usan
+    cursor.execute("EXPLAIN " + sql, {"doctor": 1, "term": SEARCHES[0][1], "term_id": None})
+    plan = [row[0] for row in cursor.fetchall()]
+    print("   Plan:")
+    for line in plan[:8]:
+        print(f"      {line}")
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else 1_000_000
+    keep = "--keep" in sys.argv
+
+    conn = psycopg2.connect(
+        host=POSTGRES_HOST,
+        port=POSTGRES_PORT,
+        database=POSTGRES_DB,
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD
+    )
+    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+
+    try:
+        with conn.cursor() as cursor:
+            print("=" * 60)
+            print(f"🔬 Búsqueda de pacientes: {rows:,} filas, {BENCH_DOCTORS} médicos")
+            print("=" * 60)
+
+            start = time.perf_counter()
+            cursor.execute(SETUP_SQL)
+            cursor.execute(POPULATE_SQL, {"rows": rows, "doctors": BENCH_DOCTORS})
+            print(f"✅ Tabla sintética creada en {time.perf_counter() - start:.1f}s")
+
+            run_phase(cursor, "1. ILIKE sin índices", LEGACY_QUERY)
+
+            cursor.execute("CREATE INDEX ON bench_search.paciente (id_medico_gen)")
+            cursor.execute("ANALYZE bench_search.paciente")
+            run_phase(cursor, "2. ILIKE + índice id_medico_gen", LEGACY_QUERY)
+
+            start = time.perf_counter()
+            cursor.execute(
+                "CREATE INDEX ON bench_search.paciente "
+                "USING gin (LOWER(immutable_unaccent(nombre)) gin_trgm_ops)"
+            )
+            cursor.execute(
+                "CREATE INDEX ON bench_search.paciente USING gin (LOWER(correo) gin_trgm_ops)"
+            )
+            cursor.execute("ANALYZE bench_search.paciente")
+            print(f"\n✅ Índices de trigramas creados en {time.perf_counter() - start:.1f}s")
+            run_phase(cursor, "3. Trigramas + unaccent (search_doctor_patients_sp)", TRIGRAM_QUERY)
+    finally:
+        if not keep:
+            with conn.cursor() as cursor:
+                cursor.execute("DROP SCHEMA IF EXISTS bench_search CASCADE")
+        conn.close()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except psycopg2.Error as e:
+        print(f"❌ Error de PostgreSQL: {e}")
+        sys.exit(1)
@@ -0,0 +1,139 @@
+"""
+Verifica con EXPLAIN que el login (authenticate_user_sp) usa los índices funcionales
+Ejecuta: python explain_login_lookup.py [username_o_correo]
+
+EXPLAIN sobre la llamada al procedimiento solo muestra "Function Scan", así que se
+explica la misma consulta que contiene authenticate_user_sp (y, para comparar, la
+consulta anterior con OR y subconsulta correlacionada). Con pocas filas en USUARIO el
+planificador prefiere Seq Scan aunque exista el índice; por eso se usa
+enable_seqscan = off, que solo cambia el plan si el índice es utilizable.
+"""
+import os
+import sys
+
+import psycopg2
+from dotenv import load_dotenv
+from psycopg2.extras import RealDictCursor
+
+load_dotenv()
+
+POSTGRES_HOST = os.getenv("POSTGRES_HOST", "localhost")
+POSTGRES_PORT = os.getenv("POSTGRES_PORT", "5432")
+POSTGRES_DB = os.getenv("POSTGRES_DB", "medico_db")
+POSTGRES_USER = os.getenv("POSTGRES_USER", "admin")
+POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "admin123")
+
+EXPECTED_INDEXES = [
+    "idx_usuario_username_lower",
+    "idx_usuario_correo_lower",
+    "idx_archivo_asoc_entidad",
+]
+
+# Misma consulta que authenticate_user_sp
+LOGIN_LOOKUP_QUERY = """
+WITH candidato AS (
+    SELECT c.id
+    FROM (
+        SELECT u.id, (u.username = %(login)s) AS exacto
+        FROM USUARIO u
+        WHERE LOWER(u.username) = LOWER(%(login)s)
+        AND u.rol_id IN (2, 3)
+        UNION ALL
+        SELECT u.id, (u.correo = %(login)s) AS exacto
+        FROM USUARIO u
+        WHERE LOWER(u.correo) = LOWER(%(login)s)
+        AND u.rol_id IN (2, 3)
+    ) c
+    ORDER BY c.exacto DESC, c.id
+    LIMIT 1
+)
+SELECT u.id, u.username, p.id AS paciente_id, m.id AS medico_id, foto.url AS foto_url
+FROM candidato c
+JOIN USUARIO u ON u.id = c.id
+LEFT JOIN PACIENTE p ON p.usuario_id = u.id
+LEFT JOIN MEDICO m ON m.usuario_id = u.id
+LEFT JOIN ESPECIALIDAD e ON m.id_especialidad = e.id
+LEFT JOIN LATERAL (
+    SELECT a.url
+    FROM ARCHIVO_ASOCIACION aa
+    JOIN ARCHIVO a ON a.id = aa.archivo_id
+    WHERE aa.entidad = CASE WHEN u.rol_id = 2 THEN 'MEDICO' ELSE 'PACIENTE' END
+    AND aa.entidad_id = CASE WHEN u.rol_id = 2 THEN m.id ELSE p.id END
+    AND aa.descripcion = 'Foto de perfil'
+    ORDER BY aa.id
+    LIMIT 1
+) foto ON TRUE
+"""
+
+# Consulta de authenticate_user antes de este cambio
+LEGACY_QUERY = """
+SELECT u.id, u.username, p.id AS paciente_id, m.id AS medico_id,
+    (SELECT url FROM ARCHIVO a
+     JOIN ARCHIVO_ASOCIACION aa ON a.id = aa.archivo_id
+     WHERE ((aa.entidad = 'PACIENTE' AND aa.entidad_id = p.id)
+            OR (aa.entidad = 'MEDICO' AND aa.entidad_id = m.id))
+     AND aa.descripcion = 'Foto de perfil'
+     LIMIT 1) AS foto_url
+FROM USUARIO u
+LEFT JOIN PACIENTE p ON p.usuario_id = u.id
+LEFT JOIN MEDICO m ON m.usuario_id = u.id
+LEFT JOIN ESPECIALIDAD e ON m.id_especialidad = e.id
+WHERE (u.username = %(login)s OR u.correo = %(login)s)
+AND (u.rol_id = 2 OR u.rol_id = 3)
+"""
+
+
+def explain(cursor, title, sql, login):
+    cursor.execute("EXPLAIN (ANALYZE, COSTS OFF) " + sql, {"login": login})
+    plan = "\n".join(row["QUERY PLAN"] for row in cursor.fetchall())
+    print(f"\n📊 {title}")
+    for line in plan.splitlines():
+        print(f"   {line}")
+    return plan
+
+
+def main():
+    login = sys.argv[1] if len(sys.argv) > 1 else "carlos.ramirez@test.com"
+
+    conn = psycopg2.connect(
+        host=POSTGRES_HOST,
+        port=POSTGRES_PORT,
+        database=POSTGRES_DB,
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD
+    )
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            print("=" * 60)
+            print(f"🔬 Plan del login para {login!r}")
+            print("=" * 60)
+
+            cursor.execute("SELECT * FROM authenticate_user_sp(%s)", (login.upper(),))
+            row = cursor.fetchone()
+            if row:
+                print(f"✅ authenticate_user_sp (en mayúsculas) encontró al usuario {row['usuario_id']} ({row['username']})")
+            else:
+                print("⚠️ authenticate_user_sp no encontró al usuario (¿existe?)")
+
+            cursor.execute("SET enable_seqscan = off")
+            explain(cursor, "Consulta anterior (OR + subconsulta correlacionada)", LEGACY_QUERY, login)
+            plan = explain(cursor, "authenticate_user_sp (UNION ALL + LATERAL)", LOGIN_LOOKUP_QUERY, login)
+
+            missing = [index for index in EXPECTED_INDEXES if index not in plan]
+            if missing:
+                print(f"\n❌ El plan no usa: {', '.join(missing)}")
+                print("   Aplica database/migrations/add_login_indexes.sql y vuelve a ejecutar")
+                return 1
+            print(f"\n✅ El plan usa {', '.join(EXPECTED_INDEXES)}")
+            return 0
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except psycopg2.Error as e:
+        print(f"❌ Error de PostgreSQL: {e}")
+        sys.exit(1)
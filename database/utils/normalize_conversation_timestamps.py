@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Script de migración única: convierte a Date los timestamps legacy guardados como
+string ISO en did_conversations (updatedAt, createdAt y messages[].timestamp).
+
+Con los timestamps normalizados, /api/did/conversations/daily-summary y /by-date
+resuelven los rangos de fecha solo con el índice (patientId/userId, updatedAt).
+
+Uso:
+    python normalize_conversation_timestamps.py            # aplica cambios
+    python normalize_conversation_timestamps.py --dry-run  # solo reporta
+"""
+
+import os
+import sys
+from datetime import datetime, timezone
+from pymongo import MongoClient, UpdateOne
+
+# Configuración de MongoDB
+MONGO_HOST = os.getenv("MONGO_HOST", "localhost")
+MONGO_PORT = int(os.getenv("MONGO_PORT", "27017"))
+MONGO_DB_NAME = os.getenv("MONGO_DB", "medico_mongo")
+MONGO_USER = os.getenv("MONGO_USER", "app_user")
+MONGO_PASSWORD = os.getenv("MONGO_PASSWORD", "app_password")
+
+BATCH_SIZE = 500
+
+
+def build_mongo_uri():
+    """Construye la URI de conexión a MongoDB"""
+    return f"mongodb://{MONGO_USER}:{MONGO_PASSWORD}@{MONGO_HOST}:{MONGO_PORT}/{MONGO_DB_NAME}?authSource=admin"
+
+
+def connect_mongo():
+    """Conecta a MongoDB con fallback a admin"""
+    try:
+        uri = build_mongo_uri()
+        client = MongoClient(uri, serverSelectionTimeoutMS=5000)
+        client.admin.command('ping')
+        return client
+    except Exception:
+        # Intentar con admin
+        admin_uri = f"mongodb://admin:admin123@{MONGO_HOST}:{MONGO_PORT}/{MONGO_DB_NAME}?authSource=admin"
+        client = MongoClient(admin_uri, serverSelectionTimeoutMS=5000)
+        client.admin.command('ping')
+        return client
+
+
+def parse_timestamp(value):
+    """Convierte un string ISO a datetime UTC naive (formato que guarda pymongo)"""
+    if not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def build_update(doc):
+    """Retorna el $set necesario para normalizar un documento, o None si no hace falta"""
+    changes = {}
+    for field in ("updatedAt", "createdAt"):
+        parsed = parse_timestamp(doc.get(field))
+        if parsed is not None:
+            changes[field] = parsed
+
+    messages = doc.get("messages") or []
+    for index, msg in enumerate(messages):
+        parsed = parse_timestamp(msg.get("timestamp")) if isinstance(msg, dict) else None
+        if parsed is not None:
+            changes[f"messages.{index}.timestamp"] = parsed
+
+    return changes or None
+
+
+def normalize(dry_run=False):
+    print("=" * 60)
+    print("🕒 Normalización de timestamps en did_conversations")
+    print("=" * 60)
+
+    client = connect_mongo()
+    collection = client[MONGO_DB_NAME]["did_conversations"]
+
+    legacy_query = {
+        "$or": [
+            {"updatedAt": {"$type": "string"}},
+            {"createdAt": {"$type": "string"}},
+            {"messages.timestamp": {"$type": "string"}},
+        ]
+    }
+    total = collection.count_documents(legacy_query)
+    print(f"\n📋 Documentos con timestamps string: {total}")
+    if total == 0 or dry_run:
+        if dry_run:
+            print("ℹ️  --dry-run: no se aplicaron cambios")
+        client.close()
+        return 0
+
+    updated = 0
+    skipped = 0
+    operations = []
+    projection = {"updatedAt": 1, "createdAt": 1, "messages.timestamp": 1}
+    for doc in collection.find(legacy_query, projection):
+        changes = build_update(doc)
+        if not changes:
+            skipped += 1
+            continue
+        operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": changes}))
+        if len(operations) >= BATCH_SIZE:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        updated += collection.bulk_write(operations, ordered=False).modified_count
+
+    print(f"✅ Documentos normalizados: {updated}")
+    if skipped:
+        print(f"⚠️  Documentos con strings no parseables (sin cambios): {skipped}")
+    client.close()
+    return updated
+
+
+if __name__ == "__main__":
+    try:
+        normalize(dry_run="--dry-run" in sys.argv)
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        sys.exit(1)
@@ -3,17 +3,33 @@ Módulo de conexión a bases de datos
 Maneja conexiones a PostgreSQL y MongoDB
 """
 import os
+import hashlib
+import hmac
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 from dotenv import load_dotenv
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
 from pymongo import MongoClient
 from pymongo.errors import ConnectionFailure
 from datetime import datetime
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict, List, Any, Tuple
 import logging
 import bcrypt
 
+try:
+    import redis
+except ImportError:  # Opcional: solo para compartir la caché de catálogos entre procesos
+    redis = None
+
 # Inicializar logger antes de usarlo
 logger = logging.getLogger(__name__)
 
@@ -57,6 +73,29 @@ POSTGRES_PORT = os.getenv("POSTGRES_PORT", "5432")
 POSTGRES_DB = os.getenv("POSTGRES_DB", "medico_db")
 POSTGRES_USER = os.getenv("POSTGRES_USER", "admin")
 POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "admin123")
+# Pool de conexiones (compartido por los hilos de los servicios Flask)
+POSTGRES_POOL_MIN = int(os.getenv("POSTGRES_POOL_MIN", "1"))
+POSTGRES_POOL_MAX = int(os.getenv("POSTGRES_POOL_MAX", "10"))
+# Segundos que una petición espera una conexión libre antes de fallar
+POSTGRES_POOL_TIMEOUT = float(os.getenv("POSTGRES_POOL_TIMEOUT", "5"))
+# Las conexiones inactivas más de estos segundos se verifican con SELECT 1 al tomarlas
+POSTGRES_HEALTHCHECK_IDLE_SECONDS = float(os.getenv("POSTGRES_HEALTHCHECK_IDLE_SECONDS", "30"))
+
+# Caché de catálogos: TTL en proceso y, si CATALOG_CACHE_REDIS_URL está definido, Redis
+# compartido entre procesos (la copia local vive CATALOG_CACHE_LOCAL_TTL segundos)
+CATALOG_CACHE_TTL = int(os.getenv("CATALOG_CACHE_TTL", "300"))
+CATALOG_CACHE_LOCAL_TTL = int(os.getenv("CATALOG_CACHE_LOCAL_TTL", "30"))
+CATALOG_CACHE_REDIS_URL = os.getenv("CATALOG_CACHE_REDIS_URL")
+
+# Hash/verificación de contraseñas con bcrypt en un pool acotado de hilos (bcrypt libera
+# el GIL, así que escala con los núcleos); más de BCRYPT_MAX_QUEUE en espera se rechazan
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", str(os.cpu_count() or 2)))
+BCRYPT_MAX_QUEUE = int(os.getenv("BCRYPT_MAX_QUEUE", str(BCRYPT_WORKERS * 4)))
+# Costo bcrypt objetivo: los hashes con otro costo se recalculan tras un login correcto
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Caché en memoria (HMAC) de logins correctos recientes; 0 la desactiva
+PASSWORD_CACHE_TTL = float(os.getenv("PASSWORD_CACHE_TTL", "0"))
+PASSWORD_CACHE_MAX = int(os.getenv("PASSWORD_CACHE_MAX", "10000"))
 
 # MongoDB
 MONGO_HOST = os.getenv("MONGO_HOST", "localhost")
@@ -69,53 +108,218 @@ MONGO_PASSWORD = os.getenv("MONGO_PASSWORD", "app_password")
 # CONEXIÓN POSTGRESQL
 # ===========================================
 
-_postgres_conn = None
+class PostgresPoolTimeout(Exception):
+    """No se liberó ninguna conexión del pool dentro de POSTGRES_POOL_TIMEOUT."""
+
+
+class PostgresConnectionPool:
+    """
+    ThreadedConnectionPool con espera acotada, health check al tomar una conexión y métricas.
+
+    psycopg2 lanza PoolError en cuanto se agotan las conexiones; un semáforo con
+    maxconn permisos hace que las peticiones esperen (hasta timeout) en lugar de fallar.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float, healthcheck_idle: float):
+        self.minconn = max(0, minconn)
+        self.maxconn = max(1, maxconn, self.minconn)
+        self.timeout = timeout
+        self.healthcheck_idle = healthcheck_idle
+        self._pool: Optional[ThreadedConnectionPool] = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.maxconn)
+        self._last_used: Dict[int, float] = {}
+        # Métricas
+        self._in_use = 0
+        self._waiting = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _get_pool(self) -> ThreadedConnectionPool:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadedConnectionPool(
+                        self.minconn,
+                        self.maxconn,
+                        host=POSTGRES_HOST,
+                        port=POSTGRES_PORT,
+                        database=POSTGRES_DB,
+                        user=POSTGRES_USER,
+                        password=POSTGRES_PASSWORD
+                    )
+                    logger.info(f"✅ Pool PostgreSQL creado ({self.minconn}-{self.maxconn} conexiones)")
+        return self._pool
+
+    def _is_healthy(self, conn) -> bool:
+        """Descarta conexiones cerradas; las inactivas mucho tiempo se verifican con SELECT 1."""
+        if conn.closed:
+            return False
+        idle = time.monotonic() - self._last_used.get(id(conn), 0.0)
+        if idle < self.healthcheck_idle:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def _release(self, conn, discard: bool = False) -> None:
+        self._last_used.pop(id(conn), None)
+        if discard:
+            self._discarded += 1
+        else:
+            self._last_used[id(conn)] = time.monotonic()
+        try:
+            self._get_pool().putconn(conn, close=discard or bool(conn.closed))
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo devolver la conexión al pool: {e}")
+
+    @contextmanager
+    def connection(self):
+        """
+        Toma una conexión del pool para una petición y la devuelve al salir.
+        Si el bloque lanza una excepción (o deja una transacción abierta) se hace rollback.
+        """
+        start = time.monotonic()
+        with self._lock:
+            self._waiting += 1
+        acquired = self._slots.acquire(timeout=self.timeout)
+        waited = time.monotonic() - start
+        with self._lock:
+            self._waiting -= 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            if not acquired:
+                self._timeouts += 1
+        if not acquired:
+            raise PostgresPoolTimeout(
+                f"Sin conexiones PostgreSQL libres tras {self.timeout:.1f}s (máximo {self.maxconn})"
+            )
+
+        conn = None
+        try:
+            pool = self._get_pool()
+            conn = pool.getconn()
+            if not self._is_healthy(conn):
+                logger.warning("⚠️ Conexión PostgreSQL inválida en el pool, reconectando")
+                self._release(conn, discard=True)
+                conn = pool.getconn()
+            with self._lock:
+                self._in_use += 1
+                self._checkouts += 1
+        except Exception as e:
+            if conn is not None:
+                self._release(conn, discard=True)
+            self._slots.release()
+            logger.error(f"❌ Error conectando a PostgreSQL: {e}")
+            raise
+
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            if not broken and not conn.closed and \
+                    conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except Exception:
+                    broken = True
+            with self._lock:
+                self._in_use -= 1
+            self._release(conn, discard=broken)
+            self._slots.release()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "min": self.minconn,
+                "max": self.maxconn,
+                "in_use": self._in_use,
+                "waiting": self._waiting,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "discarded": self._discarded,
+                "wait_avg_ms": round(self._wait_total / max(1, self._checkouts + self._timeouts) * 1000, 3),
+                "wait_max_ms": round(self._wait_max * 1000, 3),
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+            self._last_used.clear()
+        if pool is not None:
+            pool.closeall()
+
+
+_postgres_pool = PostgresConnectionPool(
+    POSTGRES_POOL_MIN, POSTGRES_POOL_MAX, POSTGRES_POOL_TIMEOUT, POSTGRES_HEALTHCHECK_IDLE_SECONDS
+)
+
+
+def postgres_connection():
+    """
+    Context manager con una conexión del pool:
+
+        with postgres_connection() as conn:
+            ...
+            conn.commit()
+    """
+    return _postgres_pool.connection()
+
+
+def get_postgres_pool_metrics() -> Dict[str, Any]:
+    """Métricas del pool (conexiones en uso, peticiones esperando, tiempo de espera)."""
+    return _postgres_pool.metrics()
+
 
 def get_postgres_connection():
-    """Obtiene o crea una conexión a PostgreSQL"""
-    global _postgres_conn
+    """
+    Abre una conexión dedicada a PostgreSQL, fuera del pool (scripts de diagnóstico).
+    Los servicios deben usar postgres_connection().
+    """
     try:
-        if _postgres_conn is None or _postgres_conn.closed:
-            _postgres_conn = psycopg2.connect(
-                host=POSTGRES_HOST,
-                port=POSTGRES_PORT,
-                database=POSTGRES_DB,
-                user=POSTGRES_USER,
-                password=POSTGRES_PASSWORD
-            )
-            logger.info("✅ Conexión a PostgreSQL establecida")
-        return _postgres_conn
+        return psycopg2.connect(
+            host=POSTGRES_HOST,
+            port=POSTGRES_PORT,
+            database=POSTGRES_DB,
+            user=POSTGRES_USER,
+            password=POSTGRES_PASSWORD
+        )
     except Exception as e:
         logger.error(f"❌ Error conectando a PostgreSQL: {e}")
         raise
 
 
 def warmup_postgres_connection():
-    """Establece la conexión y ejecuta un SELECT rápido para evitar la latencia del primer request."""
-    conn = get_postgres_connection()
-    try:
+    """Abre el pool y ejecuta un SELECT rápido para evitar la latencia del primer request."""
+    with postgres_connection() as conn:
         with conn.cursor() as cursor:
             cursor.execute("SELECT 1")
-    finally:
-        try:
-            conn.rollback()
-        except Exception:
-            pass
+        conn.rollback()
 
 def execute_query(query: str, params: tuple = None, fetch: bool = True) -> List[Dict]:
     """Ejecuta una consulta SQL y retorna los resultados como lista de diccionarios"""
-    conn = get_postgres_connection()
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(query, params)
-            if fetch:
-                results = cursor.fetchall()
-                conn.commit()
-                return results
+        with postgres_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(query, params)
+                results = cursor.fetchall() if fetch else []
             conn.commit()
-            return []
+            return results
     except Exception as e:
-        conn.rollback()
         logger.error(f"Error ejecutando query: {e}")
         raise
 
@@ -376,6 +580,26 @@ def create_diagnosis(
         return result.get('id')
     raise Exception("No se pudo crear el diagnóstico")
 
+_CONSULTATIONS_FALLBACK_QUERY = """
+SELECT 
+    c.id, 
+    c.fecha_hora, 
+    c.narrativa, 
+    c.diagnostico_final,
+    m.nombre as medico_nombre,
+    ec.nombre as estado_consulta,
+    c.mongo_consulta_id,
+    c.cita_id,
+    c.id_estado_consulta,
+    c.id_episodio
+FROM consulta c
+LEFT JOIN medico m ON c.id_medico = m.id
+LEFT JOIN estado_consulta ec ON c.id_estado_consulta = ec.id
+WHERE c.id_paciente = %s
+ORDER BY c.fecha_hora DESC
+LIMIT %s
+"""
+
 def get_patient_consultations(patient_id: int, limit: int = 10) -> List[Dict]:
     """Obtiene las consultas de un paciente usando stored procedure"""
     try:
@@ -395,26 +619,7 @@ def get_patient_consultations(patient_id: int, limit: int = 10) -> List[Dict]:
         # Si el stored procedure no existe, intentar con una query directa como fallback
         logger.warning("Intentando query directa como fallback...")
         try:
-            fallback_query = """
-                SELECT 
-                    c.id, 
-                    c.fecha_hora, 
-                    c.narrativa, 
-                    c.diagnostico_final,
-                    m.nombre as medico_nombre,
-                    ec.nombre as estado_consulta,
-                    c.mongo_consulta_id,
-                    c.cita_id,
-                    c.id_estado_consulta,
-                    c.id_episodio
-                FROM consulta c
-                LEFT JOIN medico m ON c.id_medico = m.id
-                LEFT JOIN estado_consulta ec ON c.id_estado_consulta = ec.id
-                WHERE c.id_paciente = %s
-                ORDER BY c.fecha_hora DESC
-                LIMIT %s
-            """
-            results = execute_query(fallback_query, (patient_id, limit))
+            results = execute_query(_CONSULTATIONS_FALLBACK_QUERY, (patient_id, limit))
             logger.info(f"Query directa retornó {len(results)} resultados")
             return results
         except Exception as fallback_error:
@@ -430,46 +635,287 @@ def get_patient_files(patient_id: int) -> List[Dict]:
 # FUNCIONES DE AUTENTICACIÓN
 # ===========================================
 
+class PasswordHasherSaturated(Exception):
+    """Hay BCRYPT_MAX_QUEUE operaciones de bcrypt en espera; el llamador debe responder 429."""
+
+
+class PasswordHasherPool:
+    """
+    Ejecuta bcrypt.hashpw/checkpw en un ThreadPoolExecutor acotado, con métricas de cola.
+
+    Cada operación cuesta ~250 ms de CPU; hacerla en el hilo de la petición (y peor aún
+    con una conexión PostgreSQL tomada) bloquea al resto. Con la cola llena se rechaza
+    de inmediato en lugar de acumular peticiones que igual terminarían en timeout.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(self.workers + self.max_queue)
+        self._lock = threading.Lock()
+        # Métricas
+        self._pending = 0
+        self._active = 0
+        self._completed = 0
+        self._rejected = 0
+        self._run_total = 0.0
+        self._queue_total = 0.0
+
+    def _run(self, fn, args, submitted: float):
+        started = time.monotonic()
+        with self._lock:
+            self._active += 1
+            self._queue_total += started - submitted
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._completed += 1
+                self._run_total += time.monotonic() - started
+
+    def call(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise PasswordHasherSaturated(
+                f"Demasiadas operaciones de contraseña en curso ({self.workers} hilos, cola de {self.max_queue})"
+            )
+        with self._lock:
+            self._pending += 1
+        try:
+            return self._executor.submit(self._run, fn, args, time.monotonic()).result()
+        finally:
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+
+    def submit_background(self, fn, *args) -> Optional[Future]:
+        """Encola fn sin esperar el resultado; con la cola llena no hace nada y retorna None."""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            return None
+        with self._lock:
+            self._pending += 1
+        future = self._executor.submit(self._run, fn, args, time.monotonic())
+        future.add_done_callback(self._background_done)
+        return future
+
+    def _background_done(self, _future) -> None:
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            completed = max(1, self._completed)
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "active": self._active,
+                "queued": self._pending - self._active,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "queue_wait_avg_ms": round(self._queue_total / completed * 1000, 3),
+                "run_avg_ms": round(self._run_total / completed * 1000, 3),
+            }
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+class VerifiedPasswordCache:
+    """
+    Recuerda por unos segundos los logins correctos para no repetir bcrypt en picos de carga.
+
+    No guarda contraseñas: por usuario se guarda HMAC-SHA256(clave aleatoria del proceso,
+    hash almacenado + contraseña). Incluir el hash almacenado hace que un cambio de
+    contraseña invalide la entrada; la clave aleatoria hace que el volcado de memoria no
+    sirva para probar contraseñas sin conocerla.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self._key = os.urandom(32)
+        self._entries: "OrderedDict[Any, Tuple[bytes, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    def _digest(self, password: str, stored_hash: str) -> bytes:
+        message = stored_hash.encode('utf-8') + b"\0" + password.encode('utf-8')
+        return hmac.new(self._key, message, hashlib.sha256).digest()
+
+    def check(self, user_key: Any, password: str, stored_hash: str) -> bool:
+        if not self.enabled:
+            return False
+        digest = self._digest(password, stored_hash)
+        with self._lock:
+            entry = self._entries.get(user_key)
+            if entry and entry[1] > time.monotonic() and hmac.compare_digest(entry[0], digest):
+                self._entries.move_to_end(user_key)
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def remember(self, user_key: Any, password: str, stored_hash: str) -> None:
+        if not self.enabled:
+            return
+        digest = self._digest(password, stored_hash)
+        with self._lock:
+            self._entries[user_key] = (digest, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(user_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def forget(self, user_key: Any) -> None:
+        with self._lock:
+            self._entries.pop(user_key, None)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "ttl_seconds": self.ttl_seconds,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+_password_hasher = PasswordHasherPool(BCRYPT_WORKERS, BCRYPT_MAX_QUEUE)
+# El UPDATE del hash recalculado espera conexión de PostgreSQL: va en su propio hilo para no
+# ocupar un hilo de bcrypt que necesitan los logins
+_password_upgrade_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pwd-upgrade")
+_verified_passwords = VerifiedPasswordCache(PASSWORD_CACHE_TTL, PASSWORD_CACHE_MAX)
+
+
+def bcrypt_cost(stored_hash: str) -> Optional[int]:
+    """Costo (log2 de rondas) de un hash bcrypt "$2b$12$...", o None si no tiene ese formato."""
+    parts = (stored_hash or "").split("$")
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+
+def _hashpw(raw: bytes, rounds: int) -> str:
+    return bcrypt.hashpw(raw, bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+
+
+def hash_password(password: str, rounds: Optional[int] = None) -> str:
+    """Hash bcrypt de la contraseña con BCRYPT_ROUNDS (en el pool; puede lanzar PasswordHasherSaturated)."""
+    return _password_hasher.call(_hashpw, password.encode('utf-8'), rounds or BCRYPT_ROUNDS)
+
+
+def verify_password(password: str, stored_hash: str) -> bool:
+    """Compara la contraseña con el hash bcrypt (en el pool; puede lanzar PasswordHasherSaturated)."""
+    return _password_hasher.call(bcrypt.checkpw, password.encode('utf-8'), stored_hash.encode('utf-8'))
+
+
+def _store_upgraded_hash(usuario_id: int, old_hash: str, hashed: Future) -> None:
+    """Guarda el hash recalculado con BCRYPT_ROUNDS solo si nadie cambió la contraseña entretanto."""
+    try:
+        new_hash = hashed.result()
+        execute_query(
+            "UPDATE USUARIO SET password_hash = %s WHERE id = %s AND password_hash = %s",
+            (new_hash, usuario_id, old_hash),
+            fetch=False
+        )
+        _verified_passwords.forget(usuario_id)
+        logger.info(f"🔐 Hash de contraseña del usuario {usuario_id} actualizado a costo {BCRYPT_ROUNDS}")
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo actualizar el hash del usuario {usuario_id}: {e}")
+
+
+def check_user_password(usuario_id: int, password: str, stored_hash: str) -> bool:
+    """
+    Verifica la contraseña de un usuario: primero en la caché de logins recientes y, si no
+    está, con bcrypt en el pool. Tras un login correcto con un hash de costo menor que
+    BCRYPT_ROUNDS, el nuevo hash se calcula y guarda en segundo plano.
+    """
+    if _verified_passwords.check(usuario_id, password, stored_hash):
+        return True
+    if not verify_password(password, stored_hash):
+        return False
+    _verified_passwords.remember(usuario_id, password, stored_hash)
+    cost = bcrypt_cost(stored_hash)
+    if usuario_id is not None and cost is not None and cost < BCRYPT_ROUNDS:
+        # Solo el hash va al pool de bcrypt; con la cola llena se omite y se reintentará en el
+        # siguiente login. Los hashes de costo mayor se dejan como están.
+        hashed = _password_hasher.submit_background(_hashpw, password.encode('utf-8'), BCRYPT_ROUNDS)
+        if hashed is not None:
+            hashed.add_done_callback(
+                lambda done: _password_upgrade_executor.submit(_store_upgraded_hash, usuario_id, stored_hash, done)
+            )
+    return True
+
+
+def get_password_hasher_metrics() -> Dict[str, Any]:
+    """Métricas del pool de bcrypt (hilos ocupados, cola, rechazos, tiempos medios) y de la caché."""
+    metrics = _password_hasher.metrics()
+    metrics["target_rounds"] = BCRYPT_ROUNDS
+    metrics["cache"] = _verified_passwords.metrics()
+    return metrics
+
+
+# Login anterior a authenticate_user_sp (BD sin stored_procedures.sql actualizado)
+_LOGIN_FALLBACK_QUERY = """
+    SELECT 
+        u.id as usuario_id,
+        u.username,
+        u.correo,
+        u.rol_id,
+        u.password_hash,
+        p.id as paciente_id,
+        p.nombre as paciente_nombre,
+        p.correo as paciente_correo,
+        m.id as medico_id,
+        m.nombre as medico_nombre,
+        m.cedula as medico_cedula,
+        m.correo as medico_correo,
+        e.nombre as especialidad,
+        (SELECT url FROM ARCHIVO a 
+         JOIN ARCHIVO_ASOCIACION aa ON a.id = aa.archivo_id 
+         WHERE ((aa.entidad = 'PACIENTE' AND aa.entidad_id = p.id) 
+                OR (aa.entidad = 'MEDICO' AND aa.entidad_id = m.id))
+         AND aa.descripcion = 'Foto de perfil'
+         LIMIT 1) as foto_url
+    FROM USUARIO u
+    LEFT JOIN PACIENTE p ON p.usuario_id = u.id
+    LEFT JOIN MEDICO m ON m.usuario_id = u.id
+    LEFT JOIN ESPECIALIDAD e ON m.id_especialidad = e.id
+    WHERE (u.username = %s OR u.correo = %s)
+    AND (u.rol_id = 2 OR u.rol_id = 3)  -- Médicos o pacientes
+"""
+
 def authenticate_user(username: str, password: str) -> Optional[Dict]:
     """
     Autentica un usuario y retorna información del paciente o médico asociado
     
     Args:
-        username: Username o correo del usuario
-        password: Contraseña (por ahora se valida cualquier contraseña para pruebas)
+        username: Username o correo del usuario (sin distinguir mayúsculas)
+        password: Contraseña
     
     Returns:
         Diccionario con información del usuario y paciente/médico, o None si falla
+
+    Raises:
+        PasswordHasherSaturated: si el pool de bcrypt está lleno
     """
-    query = """
-        SELECT 
-            u.id as usuario_id,
-            u.username,
-            u.correo,
-            u.rol_id,
-            u.password_hash,
-            p.id as paciente_id,
-            p.nombre as paciente_nombre,
-            p.correo as paciente_correo,
-            m.id as medico_id,
-            m.nombre as medico_nombre,
-            m.cedula as medico_cedula,
-            m.correo as medico_correo,
-            e.nombre as especialidad,
-            (SELECT url FROM ARCHIVO a 
-             JOIN ARCHIVO_ASOCIACION aa ON a.id = aa.archivo_id 
-             WHERE ((aa.entidad = 'PACIENTE' AND aa.entidad_id = p.id) 
-                    OR (aa.entidad = 'MEDICO' AND aa.entidad_id = m.id))
-             AND aa.descripcion = 'Foto de perfil'
-             LIMIT 1) as foto_url
-        FROM USUARIO u
-        LEFT JOIN PACIENTE p ON p.usuario_id = u.id
-        LEFT JOIN MEDICO m ON m.usuario_id = u.id
-        LEFT JOIN ESPECIALIDAD e ON m.id_especialidad = e.id
-        WHERE (u.username = %s OR u.correo = %s)
-        AND (u.rol_id = 2 OR u.rol_id = 3)  -- Médicos o pacientes
-    """
-    result = execute_one(query, (username, username))
+    # execute_one devuelve la conexión al pool antes de verificar la contraseña
+    try:
+        result = execute_one("SELECT * FROM authenticate_user_sp(%s)", (username,))
+    except psycopg2.errors.UndefinedFunction:
+        logger.warning("⚠️ authenticate_user_sp no existe; aplica stored_procedures.sql. Usando query directa")
+        result = execute_one(_LOGIN_FALLBACK_QUERY, (username, username))
     
     # Validar contraseña con bcrypt
     if result:
@@ -477,8 +923,10 @@ def authenticate_user(username: str, password: str) -> Optional[Dict]:
         if stored_hash:
             try:
                 # Verificar contraseña
-                if not bcrypt.checkpw(password.encode('utf-8'), stored_hash.encode('utf-8')):
+                if not check_user_password(result.get("usuario_id"), password, stored_hash):
                     return None  # Contraseña incorrecta
+            except PasswordHasherSaturated:
+                raise
             except Exception as e:
                 logger.error(f"Error al verificar contraseña: {e}")
                 return None
@@ -546,67 +994,72 @@ def register_patient(
     
     Returns:
         Diccionario con información del usuario y paciente creado, o None si falla
+
+    Raises:
+        PasswordHasherSaturated: si el pool de bcrypt está lleno
+    """
+    # Verificar si el usuario o correo ya existe (sin distinguir mayúsculas, como el login;
+    # cada lado del OR usa su índice LOWER(...)) antes de gastar un bcrypt en el registro
+    check_query = """
+        SELECT id FROM USUARIO 
+        WHERE LOWER(username) = LOWER(%s) OR LOWER(correo) = LOWER(%s)
     """
-    conn = get_postgres_connection()
+    if execute_one(check_query, (username, correo)):
+        logger.warning(f"Usuario o correo ya existe: {username} / {correo}")
+        return None
+
+    # Hashear contraseña sin tener una conexión del pool tomada (bcrypt tarda ~250 ms)
+    password_hash = hash_password(password)
+
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            # Verificar si el usuario o correo ya existe
-            check_query = """
-                SELECT id FROM USUARIO 
-                WHERE username = %s OR correo = %s
-            """
-            cursor.execute(check_query, (username, correo))
-            existing = cursor.fetchone()
-            if existing:
-                logger.warning(f"Usuario o correo ya existe: {username} / {correo}")
-                return None
-            
-            # Hashear contraseña
-            password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-            
-            # Crear usuario (rol_id = 3 para paciente)
-            insert_user_query = """
-                INSERT INTO USUARIO (username, correo, telefono, password_hash, rol_id)
-                VALUES (%s, %s, %s, %s, 3)
-                RETURNING id
-            """
-            cursor.execute(insert_user_query, (username, correo, telefono or None, password_hash))
-            user_result = cursor.fetchone()
-            usuario_id = user_result['id']
-            
-            # Crear paciente con datos mínimos
-            insert_patient_query = """
-                INSERT INTO PACIENTE (usuario_id, nombre, apellido, correo, telefono)
-                VALUES (%s, %s, %s, %s, %s)
-                RETURNING id
-            """
-            cursor.execute(insert_patient_query, (
-                usuario_id,
-                nombre or "",
-                apellido or "",
-                correo,
-                telefono or None
-            ))
-            patient_result = cursor.fetchone()
-            paciente_id = patient_result['id']
+        with postgres_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                # Crear usuario (rol_id = 3 para paciente)
+                insert_user_query = """
+                    INSERT INTO USUARIO (username, correo, telefono, password_hash, rol_id)
+                    VALUES (%s, %s, %s, %s, 3)
+                    RETURNING id
+                """
+                cursor.execute(insert_user_query, (username, correo, telefono or None, password_hash))
+                user_result = cursor.fetchone()
+                usuario_id = user_result['id']
+                
+                # Crear paciente con datos mínimos
+                insert_patient_query = """
+                    INSERT INTO PACIENTE (usuario_id, nombre, apellido, correo, telefono)
+                    VALUES (%s, %s, %s, %s, %s)
+                    RETURNING id
+                """
+                cursor.execute(insert_patient_query, (
+                    usuario_id,
+                    nombre or "",
+                    apellido or "",
+                    correo,
+                    telefono or None
+                ))
+                patient_result = cursor.fetchone()
+                paciente_id = patient_result['id']
             
             conn.commit()
-            
-            logger.info(f"✅ Usuario y paciente registrados: {username} (ID: {usuario_id}, Paciente ID: {paciente_id})")
-            
-            return {
-                "usuario_id": usuario_id,
-                "username": username,
-                "correo": correo,
-                "rol": "paciente",
-                "paciente_id": paciente_id,
-                "paciente_nombre": f"{nombre} {apellido}".strip() or username
-            }
+    except psycopg2.errors.UniqueViolation:
+        # Otro registro con el mismo usuario o correo se confirmó entre la verificación y el INSERT
+        logger.warning(f"Usuario o correo ya existe: {username} / {correo}")
+        return None
     except Exception as e:
-        conn.rollback()
         logger.error(f"Error registrando paciente: {e}")
         raise
 
+    logger.info(f"✅ Usuario y paciente registrados: {username} (ID: {usuario_id}, Paciente ID: {paciente_id})")
+
+    return {
+        "usuario_id": usuario_id,
+        "username": username,
+        "correo": correo,
+        "rol": "paciente",
+        "paciente_id": paciente_id,
+        "paciente_nombre": f"{nombre} {apellido}".strip() or username
+    }
+
 def get_doctor_by_id(doctor_id: int) -> Optional[Dict]:
     """Obtiene un médico por ID usando stored procedure"""
     query = "SELECT * FROM get_doctor_by_id_sp(%s)"
@@ -619,9 +1072,9 @@ def get_doctor_by_id(doctor_id: int) -> Optional[Dict]:
         result['nombre'] = partes_nombre[0] if len(partes_nombre) > 0 else ''
         result['apellido'] = partes_nombre[1] if len(partes_nombre) > 1 else ''
         
-        # Obtener foto de perfil
-        foto_url = get_doctor_photo(doctor_id)
-        result['foto_url'] = foto_url
+        # get_doctor_by_id_sp ya incluye la foto; consulta aparte solo si el SP es anterior
+        if 'foto_url' not in result:
+            result['foto_url'] = get_doctor_photo(doctor_id)
         
     return result
 
@@ -639,21 +1092,52 @@ def get_doctor_photo(doctor_id: int) -> Optional[str]:
     result = execute_one(query, (doctor_id,))
     return result.get("url") if result else None
 
+PHOTO_ENTITIES = {"patient": "PACIENTE", "doctor": "MEDICO"}
+
+def get_profile_photos(entity: str, entity_ids: List[int]) -> Dict[int, Optional[str]]:
+    """
+    Obtiene las fotos de perfil de muchos pacientes o médicos en una sola consulta.
+
+    Args:
+        entity: 'patient' o 'doctor'
+        entity_ids: IDs de las entidades
+
+    Returns:
+        {id: url o None} para cada ID solicitado
+    """
+    entidad = PHOTO_ENTITIES[entity]
+    ids = sorted({int(entity_id) for entity_id in entity_ids})
+    photos: Dict[int, Optional[str]] = {entity_id: None for entity_id in ids}
+    if not ids:
+        return photos
+    rows = execute_query("SELECT * FROM get_profile_photos_sp(%s, %s)", (entidad, ids))
+    for row in rows:
+        photos[row["entidad_id"]] = row["foto_url"]
+    return photos
+
 def get_doctor_patients(doctor_id: int) -> List[Dict]:
-    """Obtiene todos los pacientes asignados a un médico usando stored procedure"""
+    """Obtiene todos los pacientes asignados a un médico (con foto_url) en una sola consulta"""
     query = "SELECT * FROM get_doctor_patients_sp(%s)"
     results = execute_query(query, (doctor_id,))
     return [_normalize_patient_record(row) for row in results]
 
 
-def search_doctor_patients(doctor_id: int, search_term: str, limit: int = 10) -> List[Dict]:
-    """Busca pacientes del médico por nombre u otros campos legibles."""
+def search_doctor_patients(
+    doctor_id: int,
+    search_term: str,
+    limit: int = 10,
+    accent_insensitive: bool = True,
+) -> List[Dict]:
+    """
+    Busca pacientes del médico por nombre, correo o ID, ordenados por relevancia.
+    Con accent_insensitive (por defecto) "Ramon" encuentra "Ramón" y tolera errores de tipeo.
+    """
     if not search_term:
         return []
 
     sanitized_limit = max(1, min(limit, 25))
-    query = "SELECT * FROM search_doctor_patients_sp(%s, %s, %s)"
-    results = execute_query(query, (doctor_id, search_term, sanitized_limit))
+    query = "SELECT * FROM search_doctor_patients_sp(%s, %s, %s, %s)"
+    results = execute_query(query, (doctor_id, search_term, sanitized_limit, accent_insensitive))
     return [_normalize_patient_record(row) for row in results]
 
 
@@ -686,11 +1170,12 @@ def assign_patient_to_doctor(doctor_id: int, patient_username: str) -> Optional[
         RETURNING p.id
     """
 
-    conn = get_postgres_connection()
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(query, (username, doctor_id))
-            result = cursor.fetchone()
+        # La conexión vuelve al pool antes de releer el paciente (get_patient_by_id toma otra)
+        with postgres_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(query, (username, doctor_id))
+                result = cursor.fetchone()
             conn.commit()
 
         if not result or not result.get("id"):
@@ -699,7 +1184,6 @@ def assign_patient_to_doctor(doctor_id: int, patient_username: str) -> Optional[
         patient_id = result["id"]
         return get_patient_by_id(patient_id)
     except Exception as e:
-        conn.rollback()
         logger.error(f"Error vinculando paciente '{patient_username}' con médico {doctor_id}: {e}")
         raise
 
@@ -716,11 +1200,11 @@ def unassign_patient_from_doctor(doctor_id: int, patient_id: int) -> Optional[Di
         RETURNING id
     """
 
-    conn = get_postgres_connection()
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(query, (patient_id, doctor_id))
-            result = cursor.fetchone()
+        with postgres_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(query, (patient_id, doctor_id))
+                result = cursor.fetchone()
             conn.commit()
 
         if not result or not result.get("id"):
@@ -728,7 +1212,6 @@ def unassign_patient_from_doctor(doctor_id: int, patient_id: int) -> Optional[Di
 
         return get_patient_by_id(patient_id)
     except Exception as e:
-        conn.rollback()
         logger.error(f"Error desvinculando paciente {patient_id} del médico {doctor_id}: {e}")
         raise
 
@@ -778,16 +1261,102 @@ def get_doctors() -> List[Dict]:
     query = "SELECT id, nombre FROM MEDICO ORDER BY id"
     return execute_query(query)
 
+# Catálogos del sistema (respaldo de get_catalogos_sp; compartido con db_connection_async)
+CATALOG_QUERIES = {
+    "TIPO_SANGRE": "SELECT id, tipo as nombre FROM TIPO_SANGRE ORDER BY id",
+    "OCUPACION": "SELECT id, nombre FROM OCUPACION ORDER BY id",
+    "ESTADO_CIVIL": "SELECT id, nombre FROM ESTADO_CIVIL ORDER BY id",
+    "ESPECIALIDAD": "SELECT id, nombre FROM ESPECIALIDAD ORDER BY id",
+    "ESTADO_CITA": "SELECT id, nombre FROM ESTADO_CITA ORDER BY id",
+    "TIPO_CITA": "SELECT id, nombre FROM TIPO_CITA ORDER BY id",
+    "ESTADO_CONSULTA": "SELECT id, nombre FROM ESTADO_CONSULTA ORDER BY id",
+}
+
+_CATALOG_REDIS_KEY = "catalogos:v1"
+_catalog_cache: Dict[str, Any] = {"data": None, "etag": None, "expires": 0.0}
+_catalog_lock = threading.Lock()
+_catalog_redis = None
+
+
+def _get_catalog_redis():
+    """Cliente Redis de la caché de catálogos, o None si no está configurado/disponible."""
+    global _catalog_redis
+    if _catalog_redis is None and CATALOG_CACHE_REDIS_URL and redis is not None:
+        _catalog_redis = redis.from_url(CATALOG_CACHE_REDIS_URL, socket_timeout=1, decode_responses=True)
+    return _catalog_redis
+
+
+def _load_catalogos() -> Dict[str, List[Dict]]:
+    """Lee todos los catálogos (incluido MEDICO) en un solo round trip con get_catalogos_sp."""
+    try:
+        result = execute_one("SELECT get_catalogos_sp() AS catalogos")
+        data = (result or {}).get("catalogos") or {}
+    except Exception as e:
+        # Si el stored procedure no existe, usar las queries directas
+        logger.warning(f"get_catalogos_sp no disponible ({e}), usando queries directas")
+        data = {name: execute_query(query) for name, query in CATALOG_QUERIES.items()}
+        data["MEDICO"] = get_doctors()
+    # json_agg retorna NULL para tablas vacías
+    return {name: rows or [] for name, rows in data.items()}
+
+
+def _catalog_etag(data: Dict[str, List[Dict]]) -> str:
+    payload = json.dumps(data, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def get_catalogos_with_etag() -> Tuple[Dict[str, List[Dict]], str]:
+    """
+    Retorna (catálogos, etag) desde la caché; solo consulta PostgreSQL al expirar.
+    El etag cambia únicamente cuando cambia el contenido.
+    """
+    now = time.monotonic()
+    entry = _catalog_cache
+    if entry["data"] is not None and now < entry["expires"]:
+        return entry["data"], entry["etag"]
+
+    with _catalog_lock:
+        # Otro hilo pudo recargarla mientras esperábamos el lock
+        entry = _catalog_cache
+        if entry["data"] is not None and time.monotonic() < entry["expires"]:
+            return entry["data"], entry["etag"]
+
+        client = _get_catalog_redis()
+        data = None
+        if client is not None:
+            try:
+                cached = client.get(_CATALOG_REDIS_KEY)
+                data = json.loads(cached) if cached else None
+            except Exception as e:
+                logger.warning(f"⚠️ Caché Redis de catálogos no disponible: {e}")
+                client = None
+
+        if data is None:
+            data = _load_catalogos()
+            if client is not None:
+                try:
+                    client.set(_CATALOG_REDIS_KEY, json.dumps(data, default=str), ex=CATALOG_CACHE_TTL)
+                except Exception as e:
+                    logger.warning(f"⚠️ No se pudo guardar catálogos en Redis: {e}")
+
+        local_ttl = min(CATALOG_CACHE_LOCAL_TTL, CATALOG_CACHE_TTL) if client is not None else CATALOG_CACHE_TTL
+        etag = _catalog_etag(data)
+        _catalog_cache.update({"data": data, "etag": etag, "expires": time.monotonic() + local_ttl})
+        return data, etag
+
+
 def get_catalogos() -> Dict[str, List[Dict]]:
-    """Obtiene todos los catálogos del sistema usando queries directas"""
-    # Usar queries directas para mayor confiabilidad
-    return {
-        "TIPO_SANGRE": execute_query("SELECT id, tipo as nombre FROM TIPO_SANGRE ORDER BY id"),
-        "OCUPACION": execute_query("SELECT id, nombre FROM OCUPACION ORDER BY id"),
-        "ESTADO_CIVIL": execute_query("SELECT id, nombre FROM ESTADO_CIVIL ORDER BY id"),
-        "ESPECIALIDAD": execute_query("SELECT id, nombre FROM ESPECIALIDAD ORDER BY id"),
-        "ESTADO_CITA": execute_query("SELECT id, nombre FROM ESTADO_CITA ORDER BY id"),
-        "TIPO_CITA": execute_query("SELECT id, nombre FROM TIPO_CITA ORDER BY id"),
-        "ESTADO_CONSULTA": execute_query("SELECT id, nombre FROM ESTADO_CONSULTA ORDER BY id"),
-    }
+    """Obtiene todos los catálogos del sistema (incluye MEDICO); cacheado, no modificar el resultado"""
+    return get_catalogos_with_etag()[0]
 
+
+def invalidate_catalogos_cache() -> None:
+    """Descarta la caché de catálogos (llamar tras modificar catálogos o médicos)."""
+    with _catalog_lock:
+        _catalog_cache.update({"data": None, "etag": None, "expires": 0.0})
+    client = _get_catalog_redis()
+    if client is not None:
+        try:
+            client.delete(_CATALOG_REDIS_KEY)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo invalidar catálogos en Redis: {e}")
@@ -0,0 +1,296 @@
+"""
+Capa asíncrona de acceso a PostgreSQL
+Variante asyncio de las lecturas de db_connection (psycopg 3 + AsyncConnectionPool)
+
+Permite que un servidor async lance muchas consultas en paralelo sin ocupar un hilo
+por consulta. Reutiliza la configuración, el SQL y la normalización de db_connection;
+los servicios Flask existentes siguen usando la API síncrona de db_connection.
+
+Uso:
+    from db_connection_async import get_patient_by_id, get_patient_consultations
+
+    patient, consultations = await asyncio.gather(
+        get_patient_by_id(patient_id),
+        get_patient_consultations(patient_id),
+    )
+"""
+import asyncio
+import logging
+import os
+import weakref
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from db_connection import (
+    CATALOG_QUERIES,
+    POSTGRES_DB,
+    POSTGRES_HOST,
+    POSTGRES_PASSWORD,
+    POSTGRES_POOL_TIMEOUT,
+    POSTGRES_PORT,
+    POSTGRES_USER,
+    _CONSULTATIONS_FALLBACK_QUERY,
+    _normalize_patient_record,
+)
+
+logger = logging.getLogger(__name__)
+
+# Pool propio (independiente del ThreadedConnectionPool síncrono)
+POSTGRES_ASYNC_POOL_MIN = int(os.getenv("POSTGRES_ASYNC_POOL_MIN", "1"))
+POSTGRES_ASYNC_POOL_MAX = int(os.getenv("POSTGRES_ASYNC_POOL_MAX", "20"))
+
+# Las conexiones inactivas más de estos segundos se cierran (el pool repone hasta min)
+POSTGRES_ASYNC_MAX_IDLE = float(os.getenv("POSTGRES_ASYNC_MAX_IDLE", "300"))
+
+# ===========================================
+# POOL ASÍNCRONO
+# ===========================================
+
+# Un pool (y su lock) por event loop: las conexiones de psycopg quedan ligadas al loop que
+# las abrió, así que otro loop (un test, otro hilo) no puede reutilizarlas
+_async_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncConnectionPool]" = (
+    weakref.WeakKeyDictionary()
+)
+_async_pool_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _conninfo() -> str:
+    return (
+        f"host={POSTGRES_HOST} port={POSTGRES_PORT} dbname={POSTGRES_DB} "
+        f"user={POSTGRES_USER} password={POSTGRES_PASSWORD}"
+    )
+
+
+async def get_async_pool() -> AsyncConnectionPool:
+    """Obtiene (y abre la primera vez) el pool asíncrono del event loop actual."""
+    loop = asyncio.get_running_loop()
+    pool = _async_pools.get(loop)
+    if pool is not None:
+        return pool
+    lock = _async_pool_locks.setdefault(loop, asyncio.Lock())
+    async with lock:
+        if loop not in _async_pools:
+            pool = AsyncConnectionPool(
+                _conninfo(),
+                min_size=POSTGRES_ASYNC_POOL_MIN,
+                max_size=max(POSTGRES_ASYNC_POOL_MIN, POSTGRES_ASYNC_POOL_MAX),
+                timeout=POSTGRES_POOL_TIMEOUT,
+                max_idle=POSTGRES_ASYNC_MAX_IDLE,
+                kwargs={"row_factory": dict_row},
+                open=False,
+            )
+            await pool.open(wait=True)
+            _async_pools[loop] = pool
+            logger.info(
+                f"✅ Pool PostgreSQL async creado ({POSTGRES_ASYNC_POOL_MIN}-{POSTGRES_ASYNC_POOL_MAX} conexiones)"
+            )
+    return _async_pools[loop]
+
+
+async def close_async_pool():
+    """Cierra el pool del event loop actual (llamar al apagar el servidor async)."""
+    loop = asyncio.get_running_loop()
+    pool = _async_pools.pop(loop, None)
+    _async_pool_locks.pop(loop, None)
+    if pool is not None:
+        await pool.close()
+
+
+def get_async_pool_metrics() -> Dict[str, Any]:
+    """
+    Métricas de los pools async (en uso, esperando, tiempo de espera), como
+    get_postgres_pool_metrics; con varios event loops se suman y loops indica cuántos hay.
+    """
+    pools = list(_async_pools.values())
+    if not pools:
+        return {"min": POSTGRES_ASYNC_POOL_MIN, "max": POSTGRES_ASYNC_POOL_MAX, "open": False}
+    metrics: Dict[str, Any] = {
+        "min": POSTGRES_ASYNC_POOL_MIN,
+        "max": POSTGRES_ASYNC_POOL_MAX,
+        "open": True,
+        "loops": len(pools),
+    }
+    fields = {
+        "size": "pool_size",
+        "available": "pool_available",
+        "waiting": "requests_waiting",
+        "checkouts": "requests_num",
+        "timeouts": "requests_errors",
+        "wait_total_ms": "requests_wait_ms",
+    }
+    for name in fields:
+        metrics[name] = 0
+    for pool in pools:
+        stats = pool.get_stats()
+        for name, key in fields.items():
+            metrics[name] += stats.get(key, 0)
+    return metrics
+
+
+@asynccontextmanager
+async def async_postgres_connection():
+    """
+    Toma una conexión del pool async; al salir hace commit (o rollback si hubo error)
+    y la devuelve al pool.
+    """
+    pool = await get_async_pool()
+    async with pool.connection() as conn:
+        yield conn
+
+
+async def execute_query(query: str, params: tuple = None, fetch: bool = True) -> List[Dict]:
+    """Ejecuta una consulta SQL y retorna los resultados como lista de diccionarios"""
+    try:
+        async with async_postgres_connection() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(query, params)
+                return await cursor.fetchall() if fetch else []
+    except Exception as e:
+        logger.error(f"Error ejecutando query: {e}")
+        raise
+
+
+async def execute_one(query: str, params: tuple = None) -> Optional[Dict]:
+    """Ejecuta una consulta y retorna un solo resultado"""
+    results = await execute_query(query, params, fetch=True)
+    return results[0] if results else None
+
+# ===========================================
+# FUNCIONES PARA DATOS DE POSTGRESQL
+# ===========================================
+
+_PROFILE_PHOTO_QUERY = """
+    SELECT a.url
+    FROM ARCHIVO a
+    JOIN ARCHIVO_ASOCIACION aa ON a.id = aa.archivo_id
+    WHERE aa.entidad = %s
+    AND aa.entidad_id = %s
+    AND aa.descripcion = 'Foto de perfil'
+    LIMIT 1
+"""
+
+
+async def get_patient_by_id(patient_id: int) -> Optional[Dict]:
+    """Obtiene un paciente por ID con información relacionada usando stored procedure"""
+    result = await execute_one("SELECT * FROM get_patient_by_id_sp(%s)", (patient_id,))
+    return _normalize_patient_record(result)
+
+
+async def get_patient_diagnoses(patient_id: int) -> List[Dict]:
+    """Obtiene los diagnósticos (condiciones) de un paciente usando stored procedure"""
+    return await execute_query("SELECT * FROM get_patient_diagnoses_sp(%s)", (patient_id,))
+
+
+async def get_patient_consultations(patient_id: int, limit: int = 10) -> List[Dict]:
+    """Obtiene las consultas de un paciente usando stored procedure (con query directa de respaldo)"""
+    try:
+        results = await execute_query("SELECT * FROM get_patient_consultations_sp(%s, %s)", (patient_id, limit))
+        # Mapear campos para compatibilidad
+        for result in results:
+            result['cita_id'] = result.get('cita_id', 0)
+            result['id_estado_consulta'] = result.get('id_estado_consulta', 0)
+            result['id_episodio'] = result.get('id_episodio', 0)
+        return results
+    except Exception as e:
+        logger.error(f"Error en get_patient_consultations para paciente {patient_id}: {e}")
+        logger.warning("Intentando query directa como fallback...")
+        try:
+            return await execute_query(_CONSULTATIONS_FALLBACK_QUERY, (patient_id, limit))
+        except Exception as fallback_error:
+            logger.error(f"Error en query fallback: {fallback_error}")
+            raise e
+
+
+async def get_patient_files(patient_id: int) -> List[Dict]:
+    """Obtiene los archivos asociados a un paciente usando stored procedure"""
+    return await execute_query("SELECT * FROM get_patient_files_sp(%s)", (patient_id,))
+
+
+async def get_patient_photo(patient_id: int) -> Optional[str]:
+    """Obtiene la URL de la foto de perfil de un paciente"""
+    result = await execute_one(_PROFILE_PHOTO_QUERY, ('PACIENTE', patient_id))
+    return result.get("url") if result else None
+
+
+async def get_doctor_photo(doctor_id: int) -> Optional[str]:
+    """Obtiene la URL de la foto de perfil de un médico"""
+    result = await execute_one(_PROFILE_PHOTO_QUERY, ('MEDICO', doctor_id))
+    return result.get("url") if result else None
+
+
+async def get_doctor_by_id(doctor_id: int) -> Optional[Dict]:
+    """Obtiene un médico por ID usando stored procedure (incluye foto_url)"""
+    result = await execute_one("SELECT * FROM get_doctor_by_id_sp(%s)", (doctor_id,))
+    if result:
+        # Separar nombre completo en nombre y apellido
+        nombre_completo = result.get('nombre', '')
+        partes_nombre = nombre_completo.split(' ', 1)
+        result['nombre'] = partes_nombre[0] if len(partes_nombre) > 0 else ''
+        result['apellido'] = partes_nombre[1] if len(partes_nombre) > 1 else ''
+        # Consulta aparte solo si get_doctor_by_id_sp es anterior a la columna foto_url
+        if 'foto_url' not in result:
+            result['foto_url'] = await get_doctor_photo(doctor_id)
+    return result
+
+
+async def get_doctor_patients(doctor_id: int) -> List[Dict]:
+    """Obtiene todos los pacientes asignados a un médico usando stored procedure"""
+    results = await execute_query("SELECT * FROM get_doctor_patients_sp(%s)", (doctor_id,))
+    return [_normalize_patient_record(row) for row in results]
+
+
+async def search_doctor_patients(
+    doctor_id: int,
+    search_term: str,
+    limit: int = 10,
+    accent_insensitive: bool = True,
+) -> List[Dict]:
+    """
+    Busca pacientes del médico por nombre, correo o ID, ordenados por relevancia.
+    Con accent_insensitive (por defecto) "Ramon" encuentra "Ramón" y tolera errores de tipeo.
+    """
+    if not search_term:
+        return []
+
+    sanitized_limit = max(1, min(limit, 25))
+    results = await execute_query(
+        "SELECT * FROM search_doctor_patients_sp(%s, %s, %s, %s)",
+        (doctor_id, search_term, sanitized_limit, accent_insensitive),
+    )
+    return [_normalize_patient_record(row) for row in results]
+
+
+async def get_doctor_patient(doctor_id: int) -> Optional[Dict]:
+    """Obtiene el primer paciente asignado a un médico para compatibilidad retro"""
+    patients = await get_doctor_patients(doctor_id)
+    return patients[0] if patients else None
+
+
+async def get_doctors() -> List[Dict]:
+    """Obtiene la lista de todos los médicos"""
+    return await execute_query("SELECT id, nombre FROM MEDICO ORDER BY id")
+
+
+async def get_catalogos() -> Dict[str, List[Dict]]:
+    """
+    Obtiene todos los catálogos del sistema (incluido MEDICO) en un solo round trip con
+    get_catalogos_sp; mismo formato que db_connection._load_catalogos
+    """
+    try:
+        result = await execute_one("SELECT get_catalogos_sp() AS catalogos")
+        data = (result or {}).get("catalogos") or {}
+    except Exception as e:
+        # Si el stored procedure no existe, usar las queries directas (en paralelo)
+        logger.warning(f"get_catalogos_sp no disponible ({e}), usando queries directas")
+        names = list(CATALOG_QUERIES)
+        results = await asyncio.gather(
+            *(execute_query(CATALOG_QUERIES[name]) for name in names), get_doctors()
+        )
+        data = dict(zip(names + ["MEDICO"], results))
+    # json_agg retorna NULL para tablas vacías
+    return {name: rows or [] for name, rows in data.items()}
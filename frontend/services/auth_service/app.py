@@ -15,7 +15,14 @@ DB_ERROR = "Base de datos no disponible"
 DB_WARNING = None
 
 try:
-    from db_connection import authenticate_user, register_patient, warmup_postgres_connection  # noqa: E402
+    from db_connection import (  # noqa: E402
+        PasswordHasherSaturated,
+        authenticate_user,
+        get_password_hasher_metrics,
+        get_postgres_pool_metrics,
+        register_patient,
+        warmup_postgres_connection,
+    )
     DB_AVAILABLE = True
     try:
         warmup_postgres_connection()
@@ -37,12 +44,24 @@ apply_cors(app)
 JWT_SERVICE_URL = os.getenv('JWT_SERVICE_URL', 'http://127.0.0.1:8014')
 JWT_ENABLED = os.getenv('JWT_ENABLED', 'true').lower() == 'true'
 
+# Segundos sugeridos al cliente (Retry-After) cuando el pool de bcrypt está saturado
+BCRYPT_RETRY_AFTER = os.getenv('BCRYPT_RETRY_AFTER', '1')
+
+
+def _password_hasher_busy():
+    response = jsonify({"error": "Servidor ocupado, intenta de nuevo en unos segundos"})
+    response.headers["Retry-After"] = BCRYPT_RETRY_AFTER
+    return response, 429
+
 
 @app.get("/health")
 def health_check():
     payload = {"status": "ok", "service": "auth"}
     if not DB_AVAILABLE:
         payload["db"] = "unavailable"
+    else:
+        payload["db_pool"] = get_postgres_pool_metrics()
+        payload["password_hasher"] = get_password_hasher_metrics()
     if DB_WARNING:
         payload["db_warning"] = DB_WARNING
     return jsonify(payload)
@@ -115,6 +134,9 @@ def login():
         # Si JWT no está habilitado, retornar solo datos del usuario
         return jsonify({"success": True, "user": user}), 200
         
+    except PasswordHasherSaturated as exc:
+        app.logger.warning(f"Login rechazado: {exc}")
+        return _password_hasher_busy()
     except Exception as exc:  # pragma: no cover - logging en stdout
         app.logger.exception("Error en login")
         return jsonify({"error": str(exc)}), 500
@@ -162,6 +184,9 @@ def register():
             "user": user
         }), 201
 
+    except PasswordHasherSaturated as exc:
+        app.logger.warning(f"Registro rechazado: {exc}")
+        return _password_hasher_busy()
     except Exception as exc:  # pragma: no cover - logging en stdout
         app.logger.exception("Error en registro")
         return jsonify({"error": f"Error al registrar usuario: {str(exc)}"}), 500
@@ -0,0 +1,96 @@
+"""
+Benchmark de logins por segundo según el costo de bcrypt
+Ejecuta: python bench_logins.py [costo ...]      (por defecto: 10 11 12 13)
+
+No usa la base de datos: mide solo la verificación de contraseña, que es lo que domina
+el login. Para cada costo reporta:
+
+1. Un hilo llamando bcrypt.checkpw directamente (comportamiento anterior)
+2. BENCH_CLIENTS hilos concurrentes a través del PasswordHasherPool (BCRYPT_WORKERS hilos)
+3. Los mismos hilos repitiendo el login de BENCH_USERS usuarios con la caché HMAC activa
+"""
+import os
+import pathlib
+import sys
+import threading
+import time
+
+import bcrypt
+
+# Ensure project root is on path for db_connection import
+ROOT_DIR = pathlib.Path(__file__).resolve().parents[2]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.append(str(ROOT_DIR))
+
+from db_connection import (  # noqa: E402
+    BCRYPT_MAX_QUEUE,
+    BCRYPT_WORKERS,
+    PasswordHasherPool,
+    VerifiedPasswordCache,
+)
+
+BENCH_SECONDS = float(os.getenv("BENCH_SECONDS", "5"))
+BENCH_CLIENTS = int(os.getenv("BENCH_CLIENTS", str(BCRYPT_WORKERS * 2)))
+BENCH_USERS = int(os.getenv("BENCH_USERS", "50"))
+
+PASSWORD = b"Contrasena-Segura-123"
+
+
+def run_clients(clients: int, login) -> float:
+    """Ejecuta login() en bucle desde varios hilos durante BENCH_SECONDS; retorna logins/s."""
+    done = [0] * clients
+    deadline = time.monotonic() + BENCH_SECONDS
+
+    def worker(slot: int):
+        while time.monotonic() < deadline:
+            login(slot, done[slot])
+            done[slot] += 1
+
+    threads = [threading.Thread(target=worker, args=(slot,)) for slot in range(clients)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(done) / (time.monotonic() - start)
+
+
+def bench_cost(rounds: int):
+    stored_hash = bcrypt.hashpw(PASSWORD, bcrypt.gensalt(rounds=rounds))
+    stored_text = stored_hash.decode("utf-8")
+    password_text = PASSWORD.decode("utf-8")
+
+    inline = run_clients(1, lambda slot, n: bcrypt.checkpw(PASSWORD, stored_hash))
+
+    hasher = PasswordHasherPool(BCRYPT_WORKERS, max(BCRYPT_MAX_QUEUE, BENCH_CLIENTS))
+    pooled = run_clients(BENCH_CLIENTS, lambda slot, n: hasher.call(bcrypt.checkpw, PASSWORD, stored_hash))
+
+    cache = VerifiedPasswordCache(ttl_seconds=60, max_entries=BENCH_USERS)
+
+    def cached_login(slot: int, n: int):
+        user = (slot * 7919 + n) % BENCH_USERS
+        if not cache.check(user, password_text, stored_text):
+            if hasher.call(bcrypt.checkpw, PASSWORD, stored_hash):
+                cache.remember(user, password_text, stored_text)
+
+    with_cache = run_clients(BENCH_CLIENTS, cached_login)
+    metrics = hasher.metrics()
+    hasher.close()
+
+    print(f"   costo {rounds:<3} {inline:>10.1f} {pooled:>12.1f} {with_cache:>14.1f}"
+          f"   (espera media en cola {metrics['queue_wait_avg_ms']:.1f} ms)")
+
+
+def main():
+    costs = [int(arg) for arg in sys.argv[1:] if arg.isdigit()] or [10, 11, 12, 13]
+    print("=" * 72)
+    print(f"🔬 Logins/s por costo bcrypt: {BCRYPT_WORKERS} hilos bcrypt, {BENCH_CLIENTS} clientes, "
+          f"{BENCH_USERS} usuarios, {BENCH_SECONDS:.0f}s por medición")
+    print("=" * 72)
+    print(f"   {'':<9} {'1 hilo':>10} {'pool':>12} {'pool + caché':>14}")
+    for rounds in costs:
+        bench_cost(rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import os
 import pathlib
 import sys
 import logging
@@ -20,6 +21,7 @@ try:
         get_doctor_by_id,
         get_doctor_patient,
         get_doctor_patients,
+        get_postgres_pool_metrics,
         search_doctor_patients,
         unassign_patient_from_doctor,
         warmup_postgres_connection,
@@ -35,6 +37,7 @@ except Exception as exc:  # pragma: no cover - logging en stdout
 
 from services.common.config import ServiceConfig
 from services.common.cors import apply_cors
+from services.doctor_service.patient_index import PatientPrefixIndex
 
 load_dotenv()
 
@@ -45,12 +48,21 @@ apply_cors(app)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Índice en memoria para el autocompletado; expira para recoger cambios hechos desde otros servicios
+patient_index = PatientPrefixIndex(
+    ttl_seconds=float(os.getenv("PATIENT_INDEX_TTL", "300")),
+    max_doctors=int(os.getenv("PATIENT_INDEX_MAX_DOCTORS", "500")),
+)
+
 
 @app.get("/health")
 def health_check():
     payload: Dict[str, Any] = {"status": "ok", "service": "doctor"}
     if not DB_AVAILABLE:
         payload["db"] = "unavailable"
+    else:
+        payload["db_pool"] = get_postgres_pool_metrics()
+        payload["patient_index"] = patient_index.stats()
     if DB_WARNING:
         payload["db_warning"] = DB_WARNING
     return jsonify(payload)
@@ -121,12 +133,26 @@ def doctor_patients_search(doctor_id: int):
         raw_query = request.args.get("query") or request.args.get("q") or ""
         search_term = (raw_query or "").strip()
         limit = request.args.get("limit", default=10, type=int) or 10
+        # accents=strict: los acentos deben coincidir ("Ramón" no encuentra "Ramon")
+        accent_insensitive = (request.args.get("accents") or "").strip().lower() != "strict"
 
         if not search_term or len(search_term) < 2:
             return jsonify([]), 200
 
-        matches = search_doctor_patients(doctor_id, search_term, limit)
-        return jsonify(matches or []), 200
+        matches: List[Dict[str, Any]] = []
+        source = "db"
+        if accent_insensitive:
+            # Cada tecla se resuelve con el índice de prefijos, sin ir a la base de datos
+            matches = patient_index.search(doctor_id, search_term, max(1, min(limit, 25)), get_doctor_patients)
+            source = "index"
+        # Sin coincidencias de prefijo (p. ej. error de tipeo) o acentos estrictos: trigramas en PostgreSQL
+        if not matches and (not accent_insensitive or len(search_term) >= 3):
+            matches = search_doctor_patients(doctor_id, search_term, limit, accent_insensitive) or []
+            source = "db"
+
+        response = jsonify(matches)
+        response.headers["X-Search-Source"] = source
+        return response, 200
     except Exception as e:
         logger.error(f"Error al buscar pacientes del doctor {doctor_id}: {e}", exc_info=True)
         return jsonify({"error": f"Error interno: {str(e)}"}), 500
@@ -148,6 +174,10 @@ def doctor_assign_patient(doctor_id: int):
         if not patient:
             return jsonify({"error": "Paciente no encontrado"}), 404
 
+        # El paciente pudo venir de otro médico: se descartan ambos índices
+        patient_index.invalidate(doctor_id)
+        patient_index.invalidate_patient(patient.get("id"))
+
         return jsonify({"success": True, "patient": patient}), 200
     except Exception as e:
         logger.error(f"Error al asignar paciente al doctor {doctor_id}: {e}", exc_info=True)
@@ -164,6 +194,7 @@ def doctor_unassign_patient(doctor_id: int, patient_id: int):
         if not patient:
             return jsonify({"error": "Paciente no encontrado o no vinculado"}), 404
 
+        patient_index.invalidate(doctor_id)
         return jsonify({"success": True, "patient": patient}), 200
     except Exception as e:
         logger.error(f"Error al desasignar paciente {patient_id} del doctor {doctor_id}: {e}", exc_info=True)
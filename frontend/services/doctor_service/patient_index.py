@@ -0,0 +1,208 @@
+"""
+Índice de prefijos en memoria para el autocompletado de pacientes de un médico.
+
+Por médico se guardan arreglos ordenados de claves normalizadas (sin acentos, en
+minúsculas): el nombre completo, el nombre desde cada palabra ("lopez perez"), el correo
+y el ID. Una búsqueda es un bisect por arreglo, así que cada tecla se resuelve en
+microsegundos sin consultar PostgreSQL.
+
+El índice de un médico se construye la primera vez que se busca (con get_doctor_patients),
+expira tras PATIENT_INDEX_TTL segundos (cambios hechos desde otros servicios) y se
+invalida explícitamente al asignar o desasignar pacientes.
+"""
+import bisect
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+
+def normalize(text: Any) -> str:
+    """Minúsculas, sin acentos y con espacios colapsados ("  José  Núñez" -> "jose nunez")."""
+    decomposed = unicodedata.normalize("NFKD", str(text or ""))
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return " ".join(stripped.lower().split())
+
+
+class _SortedKeys:
+    """Arreglo ordenado de (clave, posición del paciente) con búsqueda por prefijo."""
+
+    __slots__ = ("keys", "positions")
+
+    def __init__(self, entries: List[Tuple[str, int]]):
+        entries.sort()
+        self.keys = [key for key, _ in entries]
+        self.positions = [position for _, position in entries]
+
+    def prefixed(self, term: str):
+        index = bisect.bisect_left(self.keys, term)
+        while index < len(self.keys) and self.keys[index].startswith(term):
+            yield self.keys[index], self.positions[index]
+            index += 1
+
+    def exact(self, term: str):
+        index = bisect.bisect_left(self.keys, term)
+        while index < len(self.keys) and self.keys[index] == term:
+            yield self.keys[index], self.positions[index]
+            index += 1
+
+
+class _DoctorIndex:
+    """Claves de los pacientes de un médico, un arreglo ordenado por tipo de coincidencia."""
+
+    __slots__ = ("patients", "patient_ids", "ids", "names", "words", "emails", "built_at")
+
+    def __init__(self, patients: List[Dict[str, Any]]):
+        self.patients = patients
+        self.patient_ids: Set[int] = set()
+        ids, names, words, emails = [], [], [], []
+        for position, patient in enumerate(patients):
+            patient_id = patient.get("id")
+            if patient_id is not None:
+                self.patient_ids.add(patient_id)
+                ids.append((str(patient_id), position))
+
+            full_name = normalize(f"{patient.get('nombre') or ''} {patient.get('apellido') or ''}")
+            if full_name:
+                names.append((full_name, position))
+                parts = full_name.split(" ")
+                for start in range(1, len(parts)):
+                    words.append((" ".join(parts[start:]), position))
+
+            email = normalize(patient.get("correo"))
+            if email:
+                emails.append((email, position))
+
+        self.ids = _SortedKeys(ids)
+        self.names = _SortedKeys(names)
+        self.words = _SortedKeys(words)
+        self.emails = _SortedKeys(emails)
+        self.built_at = time.monotonic()
+
+    def search(self, term: str, limit: int) -> List[Dict[str, Any]]:
+        """
+        Orden de relevancia: ID exacto, inicio del nombre, inicio de otra palabra del nombre,
+        correo y prefijo de ID. Cada arreglo ya está ordenado, así que basta con recorrerlos
+        hasta juntar limit pacientes (O(log n + limit)).
+        """
+        seen: Set[int] = set()
+        results: List[Dict[str, Any]] = []
+
+        def take(matches) -> bool:
+            for _, position in matches:
+                if position not in seen:
+                    seen.add(position)
+                    results.append(self.patients[position])
+                    if len(results) >= limit:
+                        return True
+            return False
+
+        for matches in (self.ids.exact(term), self.names.prefixed(term), self.words.prefixed(term),
+                        self.emails.prefixed(term), self.ids.prefixed(term)):
+            if take(matches):
+                break
+        return results
+
+
+class PatientPrefixIndex:
+    """
+    Índices por médico con expiración por TTL y límite LRU de médicos en memoria.
+
+    Las construcciones se serializan con un arreglo fijo de locks (el médico elige uno por
+    su ID), cada uno con un contador de generación que invalidate() incrementa: un índice
+    cuya construcción empezó antes de una invalidación se devuelve a quien lo pidió pero no
+    se guarda en la caché.
+    """
+
+    _STRIPES = 64
+
+    def __init__(self, ttl_seconds: float = 300, max_doctors: int = 500):
+        self.ttl_seconds = ttl_seconds
+        self.max_doctors = max_doctors
+        self._lock = threading.Lock()
+        self._indexes: "OrderedDict[int, _DoctorIndex]" = OrderedDict()
+        self._build_locks = [threading.Lock() for _ in range(self._STRIPES)]
+        self._generations = [0] * self._STRIPES
+        self.hits = 0
+        self.builds = 0
+
+    def _get(self, doctor_id: int) -> Optional[_DoctorIndex]:
+        with self._lock:
+            entry = self._indexes.get(doctor_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry.built_at > self.ttl_seconds:
+                del self._indexes[doctor_id]
+                return None
+            self._indexes.move_to_end(doctor_id)
+            return entry
+
+    def _stripe(self, doctor_id: int) -> int:
+        return hash(doctor_id) % self._STRIPES
+
+    def _get_or_build(self, doctor_id: int, loader: Callable[[int], List[Dict[str, Any]]]) -> _DoctorIndex:
+        entry = self._get(doctor_id)
+        if entry is not None:
+            with self._lock:
+                self.hits += 1
+            return entry
+
+        stripe = self._stripe(doctor_id)
+        # Un solo hilo construye el índice de cada médico; el resto espera y lo reutiliza
+        with self._build_locks[stripe]:
+            entry = self._get(doctor_id)
+            if entry is not None:
+                with self._lock:
+                    self.hits += 1
+                return entry
+            with self._lock:
+                generation = self._generations[stripe]
+            entry = _DoctorIndex(loader(doctor_id) or [])
+            with self._lock:
+                self.builds += 1
+                # Si se invalidó mientras se leía de la BD, el índice puede estar desactualizado
+                if self._generations[stripe] == generation:
+                    self._indexes[doctor_id] = entry
+                    self._indexes.move_to_end(doctor_id)
+                    while len(self._indexes) > self.max_doctors:
+                        self._indexes.popitem(last=False)
+            return entry
+
+    def search(
+        self,
+        doctor_id: int,
+        term: str,
+        limit: int,
+        loader: Callable[[int], List[Dict[str, Any]]],
+    ) -> List[Dict[str, Any]]:
+        """Pacientes del médico cuyo nombre (o una de sus palabras), correo o ID empiezan con term."""
+        normalized = normalize(term)
+        if not normalized:
+            return []
+        return self._get_or_build(doctor_id, loader).search(normalized, limit)
+
+    def invalidate(self, doctor_id: int) -> None:
+        with self._lock:
+            self._generations[self._stripe(doctor_id)] += 1
+            self._indexes.pop(doctor_id, None)
+
+    def invalidate_patient(self, patient_id: int) -> None:
+        """
+        Descarta los índices de cualquier médico que contenga al paciente; como no se sabe
+        qué construcciones en curso lo incluyen, ninguna de ellas se guarda.
+        """
+        with self._lock:
+            for stripe in range(self._STRIPES):
+                self._generations[stripe] += 1
+            for doctor_id in [d for d, entry in self._indexes.items() if patient_id in entry.patient_ids]:
+                del self._indexes[doctor_id]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "doctors": len(self._indexes),
+                "patients": sum(len(entry.patients) for entry in self._indexes.values()),
+                "hits": self.hits,
+                "builds": self.builds,
+            }
@@ -59,7 +59,9 @@ def health_check():
         return jsonify({
             "status": "healthy" if redis_status else "degraded",
             "redis": "connected" if redis_status else "disconnected",
-            "service": "jwt-redis-service"
+            "service": "jwt-redis-service",
+            "token_cache": jwt_service.token_cache.stats(),
+            "token_epoch_cache": jwt_service.epoch_cache.stats()
         }), 200
     except Exception as e:
         logger.error(f"Health check error: {e}")
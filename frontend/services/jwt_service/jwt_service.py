@@ -4,14 +4,168 @@ Maneja la generación, validación y refresh de tokens JWT
 """
 import os
 import jwt
+import secrets
 import time
-from datetime import datetime, timedelta
-from typing import Dict, Optional, Any
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Any, Set, Tuple
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+class ValidatedTokenCache:
+    """
+    LRU en proceso de tokens que ya se confirmaron en Redis (no revocados)
+    
+    Una entrada vive a lo sumo ttl segundos: es el tiempo máximo que un token revocado
+    puede seguir aceptándose si se pierde un aviso de pub/sub. Con pub/sub activo la
+    revocación se aplica en cuanto llega el mensaje.
+    """
+    
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._by_user: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+    
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry:
+            keys = self._by_user.get(entry[0])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_user[entry[0]]
+    
+    def contains(self, key: str) -> bool:
+        if not self.enabled:
+            return False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True
+            if entry:
+                self._remove(key)
+            self.misses += 1
+            return False
+    
+    def add(self, key: str, user_id: str) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (user_id, time.monotonic() + self.ttl)
+            self._by_user.setdefault(user_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+    
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._remove(key)
+    
+    def discard_user(self, user_id: str) -> None:
+        with self._lock:
+            for key in list(self._by_user.get(user_id, ())):
+                self._remove(key)
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "ttl_seconds": self.ttl,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class TokenEpochCache:
+    """
+    Epoch de tokens por usuario, leído de Redis a lo sumo cada refresh_interval segundos
+    
+    Un access token sin estado es válido si su claim token_epoch no es menor que el epoch
+    actual del usuario; revoke_all_user_tokens lo incrementa. refresh_interval es el tiempo
+    máximo que tarda una revocación en aplicarse si se pierde el aviso de pub/sub.
+    """
+    
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self._epochs: Dict[str, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.fetches = 0
+    
+    def get(self, user_id: str, loader) -> Optional[int]:
+        now = time.monotonic()
+        with self._lock:
+            self.lookups += 1
+            entry = self._epochs.get(user_id)
+        if entry and now - entry[1] < self.refresh_interval:
+            return entry[0]
+        epoch = loader(user_id)
+        if epoch is None:
+            # Redis no responde: se usa el último epoch conocido, si lo hay
+            return entry[0] if entry else None
+        self.put(user_id, epoch)
+        return epoch
+    
+    def put(self, user_id: str, epoch: int) -> None:
+        with self._lock:
+            self.fetches += 1
+            self._epochs[user_id] = (epoch, time.monotonic())
+    
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            self._epochs.pop(user_id, None)
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._epochs.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "refresh_interval_seconds": self.refresh_interval,
+                "users": len(self._epochs),
+                "lookups": self.lookups,
+                "fetches": self.fetches,
+            }
+
+
+# Claves en Redis por jti: "at:<jti>" (access) y "rt:<jti>" (refresh), con el user_id como valor
+ACCESS_KEY_PREFIX = "at"
+REFRESH_KEY_PREFIX = "rt"
+
+
+def _parse_grace_until(value: Optional[str]) -> Optional[float]:
+    """JWT_LEGACY_GRACE_UNTIL: epoch en segundos o fecha ISO (UTC); vacío = sin fecha límite."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+
+
 class JWTService:
     """Servicio para gestión de tokens JWT"""
     
@@ -29,6 +183,76 @@ class JWTService:
         # Tiempos de expiración (en segundos)
         self.access_token_expiry = int(os.getenv('ACCESS_TOKEN_EXPIRY', 3600))  # 1 hora por defecto
         self.refresh_token_expiry = int(os.getenv('REFRESH_TOKEN_EXPIRY', 604800))  # 7 días por defecto
+        
+        # Access tokens sin estado: no se guardan en Redis y llevan el claim token_epoch;
+        # conviene un ACCESS_TOKEN_EXPIRY corto, porque el logout de una sola sesión solo
+        # revoca su refresh token (revoke_all_user_tokens sí los invalida de inmediato)
+        self.stateless_access = os.getenv('JWT_STATELESS_ACCESS', 'false').lower() == 'true'
+        self.epoch_cache = TokenEpochCache(float(os.getenv('TOKEN_EPOCH_REFRESH', 5)))
+        
+        # Tokens emitidos antes del claim jti (clave con el JWT completo): se aceptan hasta
+        # JWT_LEGACY_GRACE_UNTIL; sin fecha, hasta que expiren (a lo sumo REFRESH_TOKEN_EXPIRY)
+        self.legacy_grace_until = _parse_grace_until(os.getenv('JWT_LEGACY_GRACE_UNTIL'))
+        
+        # Caché local de tokens validados (0 la desactiva); las revocaciones llegan por pub/sub
+        self.token_cache = ValidatedTokenCache(
+            float(os.getenv('TOKEN_CACHE_TTL', 10)),
+            int(os.getenv('TOKEN_CACHE_MAX', 10000))
+        )
+        if self.token_cache.enabled:
+            try:
+                self.redis_service.subscribe_revocations(
+                    self._apply_revocation, on_error=self._clear_local_caches
+                )
+            except Exception as e:
+                logger.warning(f"Sin pub/sub de revocaciones, caché local de tokens desactivada: {e}")
+                self.token_cache.ttl = 0
+    
+    def _apply_revocation(self, message: str) -> None:
+        """Aplica a la caché local una revocación publicada por cualquier instancia"""
+        kind, _, value = (message or "").partition(":")
+        if kind == "token":
+            self.token_cache.discard(value)
+        elif kind == "user":
+            self.token_cache.discard_user(value)
+            self.epoch_cache.invalidate(value)
+    
+    def _clear_local_caches(self) -> None:
+        self.token_cache.clear()
+        self.epoch_cache.clear()
+    
+    def _access_payload(self, user_id: str, username: str, role: str, metadata: Dict[str, Any],
+                        now: datetime, session_id: Optional[str], epoch: Optional[int]) -> Dict[str, Any]:
+        """Payload de un access token; en modo sin estado lleva token_epoch y la sesión (sid)"""
+        payload = {
+            'user_id': str(user_id),
+            'username': username,
+            'role': role,
+            'type': 'access',
+            'jti': secrets.token_urlsafe(12),
+            'iat': now,
+            'exp': now + timedelta(seconds=self.access_token_expiry),
+            'metadata': metadata
+        }
+        if self.stateless_access:
+            payload['token_epoch'] = epoch or 0
+            payload['sid'] = session_id
+        return payload
+    
+    def _token_key(self, payload: Dict[str, Any], token: str) -> Optional[str]:
+        """
+        Clave de Redis de un token: "at:<jti>" / "rt:<jti>", o el formato anterior
+        "access_token:<user_id>:<jwt>" para tokens sin jti dentro del periodo de gracia.
+        None si es un token sin jti fuera del periodo de gracia.
+        """
+        access = payload.get('type', 'access') == 'access'
+        jti = payload.get('jti')
+        if jti:
+            return f"{ACCESS_KEY_PREFIX if access else REFRESH_KEY_PREFIX}:{jti}"
+        if self.legacy_grace_until is not None and time.time() >= self.legacy_grace_until:
+            return None
+        prefix = "access_token" if access else "refresh_token"
+        return f"{prefix}:{payload.get('user_id')}:{token}"
     
     def generate_tokens(self, user_id: str, username: str, role: str = "user", 
                        metadata: Dict[str, Any] = None) -> Dict[str, Any]:
@@ -46,48 +270,38 @@ class JWTService:
         """
         now = datetime.utcnow()
         
-        # Payload del access token
-        access_payload = {
-            'user_id': str(user_id),
-            'username': username,
-            'role': role,
-            'type': 'access',
-            'iat': now,
-            'exp': now + timedelta(seconds=self.access_token_expiry),
-            'metadata': metadata or {}
-        }
-        
         # Payload del refresh token
         refresh_payload = {
             'user_id': str(user_id),
             'username': username,
             'type': 'refresh',
+            'jti': secrets.token_urlsafe(12),
             'iat': now,
             'exp': now + timedelta(seconds=self.refresh_token_expiry)
         }
         
+        # Payload del access token (sin estado: con el epoch actual, leído de Redis)
+        epoch = self.redis_service.get_token_epoch(user_id) if self.stateless_access else None
+        if epoch is not None:
+            self.epoch_cache.put(str(user_id), epoch)
+        access_payload = self._access_payload(
+            user_id, username, role, metadata or {}, now, refresh_payload['jti'], epoch
+        )
+        
         # Generar tokens
         access_token = jwt.encode(access_payload, self.secret_key, algorithm=self.algorithm)
         refresh_token = jwt.encode(refresh_payload, self.secret_key, algorithm=self.algorithm)
         
-        # Almacenar tokens en Redis
-        # Access token con expiración
-        self.redis_service.store_token(
-            f"access_token:{user_id}:{access_token}",
-            access_token,
-            self.access_token_expiry
+        # Almacenar ambos tokens (solo su jti) y la relación usuario-token (para poder
+        # revocar todos los tokens de un usuario) en un solo viaje a Redis
+        self.redis_service.issue_session(
+            user_id,
+            None if self.stateless_access else f"{ACCESS_KEY_PREFIX}:{access_payload['jti']}",
+            self.access_token_expiry,
+            refresh_key=f"{REFRESH_KEY_PREFIX}:{refresh_payload['jti']}",
+            refresh_expiry=self.refresh_token_expiry
         )
         
-        # Refresh token con expiración
-        self.redis_service.store_token(
-            f"refresh_token:{user_id}:{refresh_token}",
-            refresh_token,
-            self.refresh_token_expiry
-        )
-        
-        # Almacenar relación usuario-token para poder revocar todos los tokens de un usuario
-        self.redis_service.store_user_tokens(user_id, access_token, refresh_token)
-        
         logger.info(f"Tokens generados para usuario: {username} (ID: {user_id})")
         
         return {
@@ -112,18 +326,30 @@ class JWTService:
             
             # Verificar que el token no esté en la blacklist
             user_id = payload.get('user_id')
-            token_type = payload.get('type', 'access')
+            key = self._token_key(payload, token)
+            if key is None:
+                logger.warning(f"Token sin jti rechazado (periodo de gracia terminado) para usuario: {user_id}")
+                return None
             
-            if token_type == 'access':
-                key = f"access_token:{user_id}:{token}"
-            else:
-                key = f"refresh_token:{user_id}:{token}"
+            # Access token sin estado: basta con que no se hayan revocado todos los tokens
+            # del usuario después de emitirlo (epoch en caché local)
+            if 'token_epoch' in payload and payload.get('type', 'access') == 'access':
+                current_epoch = self.epoch_cache.get(str(user_id), self.redis_service.get_token_epoch)
+                if current_epoch is None or payload['token_epoch'] < current_epoch:
+                    logger.warning(f"Token sin estado revocado (epoch {payload['token_epoch']}) para usuario: {user_id}")
+                    return None
+                return payload
+            
+            # Tokens confirmados hace poco: la firma y la expiración ya se verificaron arriba
+            if self.token_cache.contains(key):
+                return payload
             
             # Verificar si el token existe en Redis (no ha sido revocado)
             if not self.redis_service.token_exists(key):
                 logger.warning(f"Token no encontrado en Redis (posiblemente revocado): {key}")
                 return None
             
+            self.token_cache.add(key, str(user_id))
             return payload
             
         except jwt.ExpiredSignatureError:
@@ -147,44 +373,47 @@ class JWTService:
             Dict con nuevo access_token y expires_in, o None si el refresh token es inválido
         """
         try:
-            # Validar refresh token
-            payload = self.validate_token(refresh_token)
+            # Validar firma y expiración del refresh token
+            payload = jwt.decode(refresh_token, self.secret_key, algorithms=[self.algorithm])
             
-            if not payload or payload.get('type') != 'refresh':
+            if payload.get('type') != 'refresh':
                 logger.warning("Refresh token inválido")
                 return None
             
             user_id = payload.get('user_id')
             username = payload.get('username')
+            key = self._token_key(payload, refresh_token)
+            if key is None:
+                logger.warning(f"Refresh token sin jti rechazado (periodo de gracia terminado) para usuario: {user_id}")
+                return None
             
-            # Obtener metadata del usuario desde Redis si está disponible
-            user_data = self.redis_service.get_user_data(user_id)
+            # Verificar que no haya sido revocado y obtener la metadata del usuario
+            # (si está disponible) en un solo viaje a Redis
+            exists, user_data, epoch = self.redis_service.get_session_context(key, user_id)
+            if not exists:
+                logger.warning(f"Refresh token no encontrado en Redis (posiblemente revocado) para usuario: {user_id}")
+                return None
             metadata = user_data.get('metadata', {}) if user_data else {}
             role = user_data.get('role', 'user') if user_data else 'user'
             
             # Generar nuevo access token
             now = datetime.utcnow()
-            access_payload = {
-                'user_id': str(user_id),
-                'username': username,
-                'role': role,
-                'type': 'access',
-                'iat': now,
-                'exp': now + timedelta(seconds=self.access_token_expiry),
-                'metadata': metadata
-            }
+            access_payload = self._access_payload(
+                user_id, username, role, metadata, now, payload.get('jti'), epoch
+            )
             
             new_access_token = jwt.encode(access_payload, self.secret_key, algorithm=self.algorithm)
             
-            # Almacenar nuevo access token en Redis
-            self.redis_service.store_token(
-                f"access_token:{user_id}:{new_access_token}",
-                new_access_token,
-                self.access_token_expiry
-            )
-            
-            # Actualizar relación usuario-token
-            self.redis_service.store_user_tokens(user_id, new_access_token, refresh_token)
+            if self.stateless_access:
+                # Nada que guardar; el epoch leído sirve también para la caché local
+                self.epoch_cache.put(str(user_id), epoch)
+            else:
+                # Almacenar nuevo access token y actualizar la relación usuario-token (un viaje a Redis)
+                self.redis_service.issue_session(
+                    user_id,
+                    f"{ACCESS_KEY_PREFIX}:{access_payload['jti']}",
+                    self.access_token_expiry
+                )
             
             logger.info(f"Nuevo access token generado para usuario: {username} (ID: {user_id})")
             
@@ -193,6 +422,12 @@ class JWTService:
                 'expires_in': self.access_token_expiry
             }
             
+        except jwt.ExpiredSignatureError:
+            logger.warning("Refresh token expirado")
+            return None
+        except jwt.InvalidTokenError as e:
+            logger.warning(f"Refresh token inválido: {e}")
+            return None
         except Exception as e:
             logger.error(f"Error refrescando token: {e}")
             return None
@@ -213,15 +448,20 @@ class JWTService:
                                options={"verify_exp": False})
             
             user_id = payload.get('user_id')
-            token_type = payload.get('type', 'access')
-            
-            if token_type == 'access':
-                key = f"access_token:{user_id}:{token}"
+            if 'token_epoch' in payload and payload.get('type', 'access') == 'access':
+                # Access token sin estado: se revoca su sesión (refresh token); el access
+                # token deja de servir al expirar
+                session_id = payload.get('sid')
+                key = f"{REFRESH_KEY_PREFIX}:{session_id}" if session_id else None
             else:
-                key = f"refresh_token:{user_id}:{token}"
+                key = self._token_key(payload, token)
+            if key is None:
+                return False
             
-            # Eliminar token de Redis
+            # Eliminar token de Redis y avisar a las cachés locales de todas las instancias
             success = self.redis_service.delete_token(key)
+            self.token_cache.discard(key)
+            self.redis_service.publish_revocation(f"token:{key}")
             
             if success:
                 logger.info(f"Token revocado para usuario: {user_id}")
@@ -243,7 +483,11 @@ class JWTService:
             True si se revocaron exitosamente, False en caso contrario
         """
         try:
-            return self.redis_service.revoke_all_user_tokens(user_id)
+            success = self.redis_service.revoke_all_user_tokens(user_id)
+            self.token_cache.discard_user(str(user_id))
+            self.epoch_cache.invalidate(str(user_id))
+            self.redis_service.publish_revocation(f"user:{user_id}")
+            return success
         except Exception as e:
             logger.error(f"Error revocando todos los tokens del usuario {user_id}: {e}")
             return False
@@ -2,10 +2,25 @@
 Pruebas de carga con Locust para el servicio JWT-Redis
 Prueba endpoints de autenticación y verificación de Redis
 """
-from locust import HttpUser, task, between
+from locust import HttpUser, task, between, events
+from locust.runners import WorkerRunner
+import os
 import random
 import json
 
+# Al terminar se guardan las latencias de los endpoints que escriben en Redis (login, refresh)
+# y de validación; con LOCUST_LATENCY_BASELINE se comparan contra una corrida anterior, p. ej.:
+#   LOCUST_LATENCY_REPORT=antes.json  (versión anterior del servicio)
+#   LOCUST_LATENCY_BASELINE=antes.json LOCUST_LATENCY_REPORT=despues.json
+LATENCY_REPORT = os.getenv("LOCUST_LATENCY_REPORT", "latency_report.json")
+LATENCY_BASELINE = os.getenv("LOCUST_LATENCY_BASELINE")
+LATENCY_ENDPOINTS = [
+    ("POST", "POST /api/auth/login"),
+    ("POST", "POST /api/auth/refresh"),
+    ("POST", "POST /api/auth/validate"),
+    ("GET", "GET /api/auth/user-info"),
+]
+
 class JWTServiceUser(HttpUser):
     """
     Usuario simulado que prueba el servicio JWT-Redis
@@ -50,6 +65,11 @@ class JWTServiceUser(HttpUser):
             else:
                 response.failure(f"Login failed: {response.status_code}")
     
+    @task(1)
+    def relogin(self):
+        """Repite el login (escrituras en Redis) para tener muestras suficientes de su latencia"""
+        self.login()
+    
     @task(3)
     def validate_token(self):
         """Prueba la validación de token (alta frecuencia)"""
@@ -142,3 +162,48 @@ class JWTServiceUser(HttpUser):
             except:
                 pass
 
+
+def _latency_summary(environment):
+    summary = {}
+    for method, name in LATENCY_ENDPOINTS:
+        entry = environment.stats.get(name, method)
+        if not entry.num_requests:
+            continue
+        summary[name] = {
+            "requests": entry.num_requests,
+            "avg_ms": round(entry.avg_response_time, 2),
+            "p50_ms": entry.get_response_time_percentile(0.5),
+            "p95_ms": entry.get_response_time_percentile(0.95),
+            "p99_ms": entry.get_response_time_percentile(0.99),
+        }
+    return summary
+
+
+@events.test_stop.add_listener
+def report_latency(environment, **kwargs):
+    """Guarda y muestra las latencias; si hay una corrida base, muestra la diferencia"""
+    if isinstance(environment.runner, WorkerRunner):
+        return
+    
+    summary = _latency_summary(environment)
+    with open(LATENCY_REPORT, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    
+    baseline = {}
+    if LATENCY_BASELINE and os.path.exists(LATENCY_BASELINE):
+        with open(LATENCY_BASELINE, encoding="utf-8") as f:
+            baseline = json.load(f)
+    
+    print("\n📊 Latencia por endpoint (ms)")
+    print(f"   {'endpoint':<26} {'p50':>8} {'p95':>8} {'avg':>8}   vs. base (p50 / p95)")
+    for name, current in summary.items():
+        line = f"   {name:<26} {current['p50_ms']:>8} {current['p95_ms']:>8} {current['avg_ms']:>8}"
+        base = baseline.get(name)
+        if base:
+            deltas = []
+            for metric in ("p50_ms", "p95_ms"):
+                change = (current[metric] - base[metric]) / base[metric] * 100 if base[metric] else 0
+                deltas.append(f"{change:+.0f}%")
+            line += f"   {' / '.join(deltas)}"
+        print(line)
+    print(f"   Reporte guardado en {LATENCY_REPORT}")
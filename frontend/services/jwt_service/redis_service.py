@@ -5,11 +5,80 @@ Maneja el almacenamiento y recuperación de tokens en Redis
 import os
 import redis
 import json
-from typing import Optional, Dict, Any, List
+import time
+from typing import Optional, Dict, Any, List, Tuple, Callable
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Canal de pub/sub por el que se avisan las revocaciones a las cachés locales de tokens
+REVOCATION_CHANNEL = os.getenv('JWT_REVOCATION_CHANNEL', 'jwt:revocations')
+
+# Sesiones (refresh tokens) activas por usuario; al emitir una más se revocan las más antiguas
+MAX_SESSIONS_PER_USER = int(os.getenv('JWT_MAX_SESSIONS', 10))
+
+# Índice de sesiones de un usuario: sorted set user_sessions:<user_id> con las claves de sus
+# tokens ("at:<jti>" / "rt:<jti>") y como score el epoch en que expiran. Antes era el set
+# user_tokens:<user_id>, que solo crecía; revoke_all_user_tokens también lo limpia.
+#
+# KEYS: índice, claves de los tokens a emitir
+# ARGV: user_id, ahora, máximo de sesiones, expiración (segundos) de cada token
+ISSUE_SESSION_SCRIPT = """
+local index = KEYS[1]
+local now = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', index, '-inf', now)
+for i = 2, #KEYS do
+    local ttl = tonumber(ARGV[i + 2])
+    redis.call('SET', KEYS[i], ARGV[1], 'EX', ttl)
+    redis.call('ZADD', index, now + ttl, KEYS[i])
+end
+local max_sessions = tonumber(ARGV[3])
+if max_sessions > 0 then
+    local sessions = {}
+    for _, member in ipairs(redis.call('ZRANGE', index, 0, -1)) do
+        if string.sub(member, 1, 3) == 'rt:' then
+            table.insert(sessions, member)
+        end
+    end
+    for i = 1, #sessions - max_sessions do
+        redis.call('DEL', sessions[i])
+        redis.call('ZREM', index, sessions[i])
+    end
+end
+local last = redis.call('ZRANGE', index, -1, -1, 'WITHSCORES')
+if last[2] then
+    redis.call('EXPIREAT', index, math.ceil(tonumber(last[2])))
+end
+return redis.call('ZCARD', index)
+"""
+
+# KEYS: índice de sesiones, set anterior user_tokens:<user_id>, token_epoch:<user_id>
+# ARGV: user_id, ahora
+REVOKE_ALL_SCRIPT = """
+local revoked = 0
+-- Invalida los access tokens sin estado (claim token_epoch). La clave no expira: si el
+-- contador volviera a 0, un token emitido poco antes de expirar la clave llevaría el mismo
+-- epoch que el siguiente incremento y sobreviviría a ese logout global
+redis.call('PERSIST', KEYS[3])
+redis.call('INCR', KEYS[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+for _, key in ipairs(redis.call('ZRANGE', KEYS[1], 0, -1)) do
+    revoked = revoked + redis.call('DEL', key)
+end
+if redis.call('TYPE', KEYS[2]).ok == 'set' then
+    for _, token in ipairs(redis.call('SMEMBERS', KEYS[2])) do
+        if string.sub(token, 1, 3) == 'at:' or string.sub(token, 1, 3) == 'rt:' then
+            revoked = revoked + redis.call('DEL', token)
+        else
+            revoked = revoked + redis.call('DEL', 'access_token:' .. ARGV[1] .. ':' .. token,
+                                                  'refresh_token:' .. ARGV[1] .. ':' .. token)
+        end
+    end
+end
+redis.call('DEL', KEYS[1], KEYS[2])
+return revoked
+"""
+
 
 class RedisService:
     """Servicio para gestión de Redis"""
@@ -92,6 +161,10 @@ class RedisService:
             self.redis_client.ping()
             logger.info(f"Conectado a Redis en {redis_host}:{redis_port}")
             
+            # Scripts Lua (EVALSHA; se recargan solos si Redis se reinicia)
+            self._issue_session_script = self.redis_client.register_script(ISSUE_SESSION_SCRIPT)
+            self._revoke_all_script = self.redis_client.register_script(REVOKE_ALL_SCRIPT)
+            
         except redis.ConnectionError as e:
             logger.error(f"Error conectando a Redis: {e}")
             raise
@@ -174,54 +247,142 @@ class RedisService:
             logger.error(f"Error eliminando token: {e}")
             return False
     
-    def store_user_tokens(self, user_id: str, access_token: str, refresh_token: str) -> bool:
+    def issue_session(self, user_id: str, access_key: Optional[str], access_expiry: int,
+                      refresh_key: Optional[str] = None, refresh_expiry: Optional[int] = None) -> bool:
         """
-        Almacena la relación usuario-tokens para poder revocar todos los tokens
+        Almacena los tokens de una sesión y los registra en el índice del usuario en un solo
+        viaje a Redis (script Lua atómico). Cada token se guarda como "<clave jti> -> user_id".
+        De paso elimina del índice los tokens expirados y, si el usuario supera
+        JWT_MAX_SESSIONS refresh tokens, revoca los más antiguos.
         
         Args:
             user_id: ID del usuario
-            access_token: Access token del usuario
-            refresh_token: Refresh token del usuario
+            access_key: Clave del access token ("at:<jti>"; None si el access token es sin estado)
+            access_expiry: Expiración del access token en segundos
+            refresh_key: Clave del refresh token (None en un refresh: se conserva el actual)
+            refresh_expiry: Expiración del refresh token en segundos
         
         Returns:
             True si se almacenó exitosamente
         """
         try:
-            # Almacenar tokens en un set para el usuario
-            user_tokens_key = f"user_tokens:{user_id}"
-            
-            # Agregar tokens al set
-            self.redis_client.sadd(user_tokens_key, access_token, refresh_token)
-            
-            # Establecer expiración (usar la del refresh token que es más larga)
-            refresh_expiry = int(os.getenv('REFRESH_TOKEN_EXPIRY', 604800))
-            self.redis_client.expire(user_tokens_key, refresh_expiry)
-            
+            keys = [f"user_sessions:{user_id}"]
+            expiries = []
+            if access_key:
+                keys.append(access_key)
+                expiries.append(access_expiry)
+            if refresh_key:
+                keys.append(refresh_key)
+                expiries.append(refresh_expiry)
+            self._issue_session_script(
+                keys=keys,
+                args=[str(user_id), int(time.time()), MAX_SESSIONS_PER_USER, *expiries]
+            )
             return True
         except Exception as e:
-            logger.error(f"Error almacenando tokens de usuario: {e}")
+            logger.error(f"Error almacenando sesión: {e}")
             return False
     
+    def get_session_context(self, key: str, user_id: str) -> Tuple[bool, Optional[Dict[str, Any]], int]:
+        """
+        Verifica que un token exista y obtiene los datos y el epoch de tokens del usuario
+        en un solo viaje a Redis
+        
+        Args:
+            key: Clave del token
+            user_id: ID del usuario
+        
+        Returns:
+            (existe, datos del usuario o None, epoch de tokens)
+        """
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.exists(key)
+            pipe.get(f"user_data:{user_id}")
+            pipe.get(f"token_epoch:{user_id}")
+            exists, data, epoch = pipe.execute()
+            return exists > 0, json.loads(data) if data else None, int(epoch or 0)
+        except Exception as e:
+            logger.error(f"Error obteniendo contexto de sesión: {e}")
+            return False, None, 0
+    
+    def get_token_epoch(self, user_id: str) -> Optional[int]:
+        """
+        Obtiene el epoch de tokens de un usuario (revoke_all_user_tokens lo incrementa)
+        
+        Args:
+            user_id: ID del usuario
+        
+        Returns:
+            Epoch actual (0 si nunca se revocó), None si Redis no responde
+        """
+        try:
+            return int(self.redis_client.get(f"token_epoch:{user_id}") or 0)
+        except Exception as e:
+            logger.error(f"Error obteniendo epoch de tokens: {e}")
+            return None
+    
+    def publish_revocation(self, message: str) -> bool:
+        """
+        Avisa a todas las instancias del servicio que invaliden su caché local de tokens
+        
+        Args:
+            message: "token:<clave>" o "user:<user_id>"
+        
+        Returns:
+            True si se publicó exitosamente
+        """
+        try:
+            self.redis_client.publish(REVOCATION_CHANNEL, message)
+            return True
+        except Exception as e:
+            logger.error(f"Error publicando revocación: {e}")
+            return False
+    
+    def subscribe_revocations(self, callback: Callable[[str], None],
+                              on_error: Optional[Callable[[], None]] = None):
+        """
+        Escucha el canal de revocaciones en un hilo en segundo plano
+        
+        Args:
+            callback: Función que recibe cada mensaje publicado con publish_revocation
+            on_error: Función a llamar si se pierde la conexión (se pueden haber perdido mensajes)
+        
+        Returns:
+            Hilo de pub/sub (redis.client.PubSubWorkerThread)
+        """
+        pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{REVOCATION_CHANNEL: lambda message: callback(message['data'])})
+        
+        def handle_error(error, pubsub, thread):
+            logger.warning(f"Conexión de pub/sub de revocaciones perdida: {error}")
+            if on_error:
+                on_error()
+            # redis-py reconecta y se vuelve a suscribir en la siguiente lectura
+            time.sleep(1)
+        
+        return pubsub.run_in_thread(sleep_time=1, daemon=True, exception_handler=handle_error)
+    
     def get_user_tokens(self, user_id: str) -> List[str]:
         """
-        Obtiene todos los tokens de un usuario
+        Obtiene los tokens activos de un usuario
         
         Args:
             user_id: ID del usuario
         
         Returns:
-            Lista de tokens del usuario
+            Claves de los tokens activos del usuario ("at:<jti>" / "rt:<jti>")
         """
         try:
-            user_tokens_key = f"user_tokens:{user_id}"
-            return list(self.redis_client.smembers(user_tokens_key))
+            return list(self.redis_client.zrangebyscore(f"user_sessions:{user_id}", int(time.time()), '+inf'))
         except Exception as e:
             logger.error(f"Error obteniendo tokens de usuario: {e}")
             return []
     
     def revoke_all_user_tokens(self, user_id: str) -> bool:
         """
-        Revoca todos los tokens de un usuario
+        Revoca todos los tokens de un usuario en un solo viaje a Redis (script Lua):
+        O(sesiones activas), porque las expiradas se descartan del índice antes de recorrerlo
         
         Args:
             user_id: ID del usuario
@@ -230,20 +391,11 @@ class RedisService:
             True si se revocaron exitosamente
         """
         try:
-            tokens = self.get_user_tokens(user_id)
-            
-            # Eliminar cada token
-            for token in tokens:
-                # Intentar eliminar como access token
-                self.delete_token(f"access_token:{user_id}:{token}")
-                # Intentar eliminar como refresh token
-                self.delete_token(f"refresh_token:{user_id}:{token}")
-            
-            # Eliminar el set de tokens del usuario
-            user_tokens_key = f"user_tokens:{user_id}"
-            self.redis_client.delete(user_tokens_key)
-            
-            logger.info(f"Todos los tokens revocados para usuario: {user_id}")
+            revoked = self._revoke_all_script(
+                keys=[f"user_sessions:{user_id}", f"user_tokens:{user_id}", f"token_epoch:{user_id}"],
+                args=[str(user_id), int(time.time())]
+            )
+            logger.info(f"Todos los tokens revocados para usuario: {user_id} ({revoked} claves)")
             return True
             
         except Exception as e:
@@ -1,6 +1,13 @@
+import hmac
+import os
 import pathlib
 import sys
-from typing import Any, Dict
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict
+
+import requests
 
 from dotenv import load_dotenv
 from flask import Flask, jsonify, request
@@ -14,16 +21,19 @@ DB_WARNING = None
 
 try:
     from db_connection import (  # noqa: E402
-        get_catalogos,
-        get_doctors,
+        POSTGRES_POOL_MAX,
+        get_catalogos_with_etag,
         get_patient_by_id,
         get_patient_consultations,
         get_patient_diagnoses,
         get_patient_files,
         get_patient_photo,
+        get_postgres_pool_metrics,
+        get_profile_photos,
         update_consultation,
         update_patient,
         create_diagnosis,
+        invalidate_catalogos_cache,
         warmup_postgres_connection,
     )
     DB_AVAILABLE = True
@@ -34,6 +44,7 @@ try:
 except Exception as exc:  # pragma: no cover - logging en stdout
     DB_AVAILABLE = False
     DB_ERROR = str(exc)
+    POSTGRES_POOL_MAX = 10
 
 from services.common.config import ServiceConfig
 from services.common.cors import apply_cors
@@ -43,12 +54,48 @@ load_dotenv()
 app = Flask(__name__)
 apply_cors(app)
 
+# Los navegadores pueden reutilizar los catálogos este tiempo (revalidan con ETag)
+CATALOG_BROWSER_MAX_AGE = int(os.getenv("CATALOG_BROWSER_MAX_AGE", "300"))
+
+# Invalidar la caché de catálogos es una operación interna: exige este token en el header
+# X-Internal-Token; sin token configurado el endpoint queda deshabilitado (detrás de un
+# proxy inverso todas las peticiones llegan desde 127.0.0.1, así que la IP no sirve)
+CATALOG_INVALIDATE_TOKEN = os.getenv("CATALOG_INVALIDATE_TOKEN", "")
+
+# Máximo de IDs por petición a /api/db/photos
+MAX_PHOTO_BATCH = int(os.getenv("MAX_PHOTO_BATCH", "500"))
+
+# Dashboard del paciente: las conversaciones D-ID viven en el backend principal (MongoDB)
+CONVERSATIONS_API = os.getenv("CONVERSATIONS_API", "http://127.0.0.1:8080")
+DASHBOARD_TIMEOUT = float(os.getenv("DASHBOARD_TIMEOUT", "10"))
+
+# Cada dashboard lanza 6 secciones en paralelo y 5 de ellas toman una conexión del pool de
+# PostgreSQL (POSTGRES_POOL_MAX por proceso). Se admiten DASHBOARD_CONCURRENCY dashboards a
+# la vez, de modo que DASHBOARD_CONCURRENCY * 5 conexiones quepan en el pool dejando
+# DASHBOARD_PG_RESERVE libres para el resto de endpoints; el executor tiene exactamente un
+# hilo por sección admitida (DASHBOARD_CONCURRENCY * 6), así ninguna sección espera hilo.
+# Para más dashboards simultáneos hay que subir POSTGRES_POOL_MAX junto con este valor.
+_DASHBOARD_SECTIONS = 6
+_DASHBOARD_PG_SECTIONS = 5
+DASHBOARD_PG_RESERVE = 2
+DASHBOARD_CONCURRENCY = int(os.getenv(
+    "DASHBOARD_CONCURRENCY",
+    str(max(1, (POSTGRES_POOL_MAX - DASHBOARD_PG_RESERVE) // _DASHBOARD_PG_SECTIONS)),
+))
+_dashboard_slots = threading.BoundedSemaphore(DASHBOARD_CONCURRENCY)
+_dashboard_executor = ThreadPoolExecutor(
+    max_workers=DASHBOARD_CONCURRENCY * _DASHBOARD_SECTIONS,
+    thread_name_prefix="dashboard",
+)
+
 
 @app.get("/health")
 def health_check():
     payload = {"status": "ok", "service": "patient"}
     if not DB_AVAILABLE:
         payload["db"] = "unavailable"
+    else:
+        payload["db_pool"] = get_postgres_pool_metrics()
     if DB_WARNING:
         payload["db_warning"] = DB_WARNING
     return jsonify(payload)
@@ -59,16 +106,30 @@ def catalogos():
     if not DB_AVAILABLE:
         return jsonify({"error": DB_ERROR}), 503
 
-    catalogos_data = get_catalogos()
-    try:
-        medicos = get_doctors()
-        catalogos_data["MEDICO"] = [
-            {"id": doctor.get("id"), "nombre": doctor.get("nombre")}
-            for doctor in medicos or []
-        ]
-    except Exception:
-        catalogos_data.setdefault("MEDICO", [])
-    return jsonify(catalogos_data), 200
+    catalogos_data, etag = get_catalogos_with_etag()
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(catalogos_data)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = f"public, max-age={CATALOG_BROWSER_MAX_AGE}"
+    return response
+
+
+@app.post("/api/db/catalogos/invalidate")
+def catalogos_invalidate():
+    """Descarta la caché de catálogos tras modificar catálogos o médicos (solo uso interno)."""
+    if not CATALOG_INVALIDATE_TOKEN:
+        return jsonify({"error": "Invalidación deshabilitada (CATALOG_INVALIDATE_TOKEN no configurado)"}), 403
+    token = request.headers.get("X-Internal-Token", "")
+    if not hmac.compare_digest(token.encode("utf-8"), CATALOG_INVALIDATE_TOKEN.encode("utf-8")):
+        return jsonify({"error": "No autorizado"}), 403
+
+    if not DB_AVAILABLE:
+        return jsonify({"error": DB_ERROR}), 503
+
+    invalidate_catalogos_cache()
+    return jsonify({"success": True}), 200
 
 
 @app.get("/api/db/patient/<int:patient_id>")
@@ -135,6 +196,136 @@ def patient_photo(patient_id: int):
     return jsonify({"photo_url": photo_url}), 200
 
 
+@app.post("/api/db/photos")
+def photos_batch():
+    """
+    Fotos de perfil de muchos pacientes o médicos en una sola consulta.
+    Body: {"entity": "patient" | "doctor", "ids": [1, 2, ...]}
+    Respuesta: {"entity": ..., "photos": {"1": url | null, ...}}
+    """
+    if not DB_AVAILABLE:
+        return jsonify({"error": DB_ERROR}), 503
+
+    data: Dict[str, Any] = request.get_json(silent=True) or {}
+    entity = data.get("entity", "patient")
+    if entity not in ("patient", "doctor"):
+        return jsonify({"error": "entity debe ser 'patient' o 'doctor'"}), 400
+
+    ids = data.get("ids")
+    if not isinstance(ids, list):
+        return jsonify({"error": "ids debe ser una lista de enteros"}), 400
+    if len(ids) > MAX_PHOTO_BATCH:
+        return jsonify({"error": f"Máximo {MAX_PHOTO_BATCH} ids por petición"}), 400
+    try:
+        entity_ids = [int(entity_id) for entity_id in ids]
+    except (TypeError, ValueError):
+        return jsonify({"error": "ids debe ser una lista de enteros"}), 400
+
+    photos = get_profile_photos(entity, entity_ids)
+    return jsonify({
+        "entity": entity,
+        "photos": {str(entity_id): url for entity_id, url in photos.items()},
+    }), 200
+
+
+def _fetch_patient_conversations(patient_id: int, limit: int) -> Any:
+    response = requests.get(
+        f"{CONVERSATIONS_API}/api/did/conversations",
+        params={"patientId": patient_id, "limit": limit},
+        timeout=DASHBOARD_TIMEOUT,
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def _timed(fn: Callable[[], Any], deadline: float) -> Dict[str, Any]:
+    # Si la sección empieza cuando la petición ya respondió, no se toma una conexión para nada
+    if time.monotonic() >= deadline:
+        return {"error": "abandonada tras el timeout", "ms": 0.0}
+    start = time.perf_counter()
+    try:
+        return {"data": fn(), "ms": round((time.perf_counter() - start) * 1000, 2)}
+    except Exception as exc:
+        return {"error": str(exc), "ms": round((time.perf_counter() - start) * 1000, 2)}
+
+
+@app.get("/api/db/patient/<int:patient_id>/dashboard")
+def patient_dashboard(patient_id: int):
+    """
+    Todo lo que la UI necesita al abrir un paciente en una sola petición: datos,
+    consultas, archivos, diagnósticos, foto y conversaciones D-ID, consultados en paralelo.
+    Cada sección reporta su tiempo en timings_ms; las que fallan (o no terminan en
+    DASHBOARD_TIMEOUT) quedan en null/[] con su error en errors y partial=true.
+    """
+    if not DB_AVAILABLE:
+        return jsonify({"error": DB_ERROR}), 503
+
+    try:
+        conversations_limit = max(1, min(int(request.args.get("conversations_limit", 10)), 100))
+    except ValueError:
+        return jsonify({"error": "conversations_limit debe ser un entero"}), 400
+
+    sections: Dict[str, Callable[[], Any]] = {
+        "patient": lambda: get_patient_by_id(patient_id),
+        "consultations": lambda: get_patient_consultations(patient_id) or [],
+        "files": lambda: get_patient_files(patient_id) or [],
+        "diagnoses": lambda: get_patient_diagnoses(patient_id) or [],
+        "photo_url": lambda: get_patient_photo(patient_id),
+        "conversations": lambda: _fetch_patient_conversations(patient_id, conversations_limit),
+    }
+    empty: Dict[str, Any] = {"consultations": [], "files": [], "diagnoses": []}
+
+    start = time.perf_counter()
+    deadline = time.monotonic() + DASHBOARD_TIMEOUT
+    # Esperar turno en lugar de lanzar secciones que solo esperarían conexión y caducarían
+    if not _dashboard_slots.acquire(timeout=DASHBOARD_TIMEOUT):
+        response = jsonify({"error": "Demasiados dashboards en curso, intenta de nuevo"})
+        response.headers["Retry-After"] = "1"
+        return response, 503
+
+    # El turno se libera cuando terminan todas las secciones (también las que caducaron)
+    remaining = [len(sections)]
+    remaining_lock = threading.Lock()
+
+    def _section_done(_future) -> None:
+        with remaining_lock:
+            remaining[0] -= 1
+            finished = remaining[0] == 0
+        if finished:
+            _dashboard_slots.release()
+
+    futures = {name: _dashboard_executor.submit(_timed, fn, deadline) for name, fn in sections.items()}
+    for future in futures.values():
+        future.add_done_callback(_section_done)
+    wait(futures.values(), timeout=max(0.0, deadline - time.monotonic()))
+
+    payload: Dict[str, Any] = {"patient_id": patient_id}
+    timings: Dict[str, float] = {}
+    errors: Dict[str, str] = {}
+    for name, future in futures.items():
+        if not future.done():
+            future.cancel()
+            errors[name] = f"timeout ({DASHBOARD_TIMEOUT:.0f}s)"
+            payload[name] = empty.get(name)
+            continue
+        result = future.result()
+        timings[name] = result["ms"]
+        if "error" in result:
+            app.logger.error(f"Dashboard paciente {patient_id}: error en {name}: {result['error']}")
+            errors[name] = result["error"]
+            payload[name] = empty.get(name)
+        else:
+            payload[name] = result["data"]
+
+    if "patient" not in errors and not payload["patient"]:
+        return jsonify({"error": "Paciente no encontrado"}), 404
+
+    payload["timings_ms"] = {**timings, "total": round((time.perf_counter() - start) * 1000, 2)}
+    payload["errors"] = errors
+    payload["partial"] = bool(errors)
+    return jsonify(payload), 200
+
+
 @app.put("/api/db/patient/<int:patient_id>")
 def patient_update(patient_id: int):
     if not DB_AVAILABLE:
@@ -229,6 +229,18 @@ const patient = {
   async getPatient(id: number) {
     return await tryFetch(withBase(PATIENT_API, `/api/db/patient/${id}`));
   },
+  // Paciente, consultas, archivos, diagnósticos, foto y conversaciones en una sola petición
+  async getDashboard(patientId: number, conversationsLimit: number = 10) {
+    return await tryFetch(withBase(PATIENT_API, `/api/db/patient/${patientId}/dashboard?conversations_limit=${conversationsLimit}`));
+  },
+  // Fotos de perfil de muchos pacientes/médicos en una sola petición: { photos: { [id]: url | null } }
+  async getPhotos(entity: "patient" | "doctor", ids: number[]) {
+    return await tryFetch(withBase(PATIENT_API, "/api/db/photos"), {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ entity, ids }),
+    });
+  },
   async getConsultations(patientId: number) {
     return await tryFetch(withBase(PATIENT_API, `/api/db/patient/${patientId}/consultations`));
   },